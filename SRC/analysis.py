@@ -0,0 +1,417 @@
+import asyncio, os, re, time
+import crops, http_client, metrics, ratelimit
+from datetime import datetime
+from cache import MISS, TieredCache
+from history import HistoryWindow, estimate_tokens
+from weather import aget_coordinates, afetch_conditions, fetch_conditions, get_coordinates, grid_cell, history_summary
+
+# Shared agricultural analysis chain used by the Streamlit app and the batch runner.
+# LangChain is imported lazily so that the data-only helpers stay cheap to import.
+
+MODEL_NAME = "Llama-3.3-70b-Versatile"
+
+# System and human messages of the enhanced prompt template
+PROMPT_MESSAGES = [
+    (
+        "system",
+        """You are an expert agricultural and weather analysis assistant. Your role is to provide actionable insights for farmers.
+
+**IMPORTANT**: Only respond to weather and agriculture-related queries. For other topics, politely redirect users.
+
+The title, location and current readings are shown above your answer automatically. Do not repeat them: describe the readings qualitatively or by range, and whenever you mention the location write the placeholder <<location>> instead of its name.
+
+Structure your response as follows:
+
+#### 📊 Detailed Analysis
+
+**Temperature Impact:**
+- Analyze the temperature range and its suitability for different crops
+- Consider the "feels like" temperature for outdoor work conditions
+
+**Humidity Assessment:**
+- Evaluate humidity levels and their implications for plant growth
+- Discuss disease risk based on moisture levels
+
+**Wind Conditions:**
+- Assess wind speed effects on crops and farming operations
+- Consider pollination and spray application conditions
+
+**Soil Moisture Analysis:**
+- Interpret soil moisture data for irrigation planning
+- Recommend water management strategies
+
+#### 🌾 Crop Recommendations
+
+A local suitability model has already ranked the crops for these conditions:
+{crop_facts}
+
+Use exactly these crops and scores. For each, explain in one or two sentences why it suits the conditions or what limits it. If no crop is listed, say why and do not recommend any.
+
+#### ⚠️ Recommendations & Precautions
+- List specific actions farmers should take
+- Include timing recommendations
+- Safety considerations
+
+Do not list pesticides, fertilizers or weedicides and do not add a footer: the agricultural inputs of the ranked crops are appended to your report automatically.
+"""
+    ),
+    (
+        "human",
+        """Analyze weather conditions for {location}.
+
+Location: {coordinates}
+Weather Data: {weather_info}
+Soil Conditions: {soil_moisture}
+
+Provide comprehensive agricultural guidance based on this data."""
+    ),
+]
+
+def get_llm(temperature=0.3):
+    """Create the Groq chat model"""
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(
+        model=MODEL_NAME,
+        api_key=os.getenv("GROQ_API_KEY"),
+        base_url=os.getenv("GROQ_API_BASE") or None,  # e.g. the local stand-in used by benchmark.py
+        temperature=temperature
+    )
+
+def build_prompt():
+    """Build the analysis prompt with a chat history placeholder"""
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages(PROMPT_MESSAGES + [MessagesPlaceholder(variable_name="chat_history")])
+
+def build_chain(llm=None):
+    """prompt | llm | StrOutputParser()"""
+    from langchain_core.output_parsers import StrOutputParser
+
+    return build_prompt() | (llm or get_llm()) | StrOutputParser()
+
+def summarize_conditions(location, latitude, longitude, conditions):
+    """Flatten fetch_conditions output into the fields used by the prompt.
+
+    Returns None when neither weather nor soil data is available.
+    """
+    weather = conditions["weather"]
+    soil = conditions["soil"]
+    if weather is None and soil is None:
+        return None
+
+    weather_data = {
+        "location": location,
+        "latitude": latitude,
+        "longitude": longitude,
+        "coordinates": f"Lat: {latitude:.4f}, Lon: {longitude:.4f}",
+        "description": weather.description.capitalize() if weather else 'N/A',
+        "temp": weather.temp if weather else 'N/A',
+        "feels_like": weather.feels_like if weather else 'N/A',
+        "humidity": weather.humidity if weather else 'N/A',
+        "wind_speed": weather.wind_speed if weather else 'N/A',
+        "soil_moisture": soil.profile() if soil else f"Soil moisture unavailable: {conditions['errors']['soil']}",
+        "soil_moisture_value": soil.moisture if soil and soil.moisture is not None else 'N/A',
+        "weather_info": str(weather) if weather else f"Weather data unavailable: {conditions['errors']['weather']}",
+        "errors": conditions["errors"],
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    # Crop ranking and inputs from the local rules engine; the model only writes the narrative
+    weather_data.update(crops.recommend(weather_data))
+    return weather_data
+
+def add_history(weather_data):
+    """Append the stored trends of the location (observation store) to the weather text the model sees"""
+    weather_data["history"] = history_summary(weather_data["latitude"], weather_data["longitude"])
+    if weather_data["history"]:
+        weather_data["weather_info"] += f"\nRecent history:\n{weather_data['history']}"
+
+def query_conditions(location, google_maps_token, openweather_api_key, coordinates=None):
+    """Geocode a location, fetch its conditions and flatten them for the prompt.
+
+    Known coordinates (e.g. from an autocomplete pick) skip geocoding. Adds per-stage
+    timings under "timings"; raises when no data could be fetched.
+    """
+    start = time.perf_counter()
+    timings = {}
+    if coordinates is None:
+        with metrics.span("geocode") as geocode:
+            coordinates = get_coordinates(location, google_maps_token)
+        timings["geocode"] = geocode.elapsed
+    latitude, longitude = coordinates
+
+    # Weather data and soil moisture are fetched in parallel
+    conditions = fetch_conditions(latitude, longitude, openweather_api_key)
+    weather_data = summarize_conditions(location, latitude, longitude, conditions)
+    if weather_data is None:
+        raise Exception(f"Failed to retrieve weather data: {conditions['errors'].get('weather', 'unknown error')}")
+    add_history(weather_data)
+    total = time.perf_counter() - start
+    metrics.observe("stage_seconds", total, stage="total")
+    weather_data["timings"] = {**timings, **conditions["timings"], "total": total}
+    return weather_data
+
+async def aquery_conditions(location, google_maps_token, openweather_api_key, coordinates=None):
+    """Async counterpart of query_conditions"""
+    start = time.perf_counter()
+    timings = {}
+    if coordinates is None:
+        with metrics.span("geocode") as geocode:
+            coordinates = await aget_coordinates(location, google_maps_token)
+        timings["geocode"] = geocode.elapsed
+    latitude, longitude = coordinates
+
+    conditions = await afetch_conditions(latitude, longitude, openweather_api_key)
+    weather_data = summarize_conditions(location, latitude, longitude, conditions)
+    if weather_data is None:
+        raise Exception(f"Failed to retrieve weather data: {conditions['errors'].get('weather', 'unknown error')}")
+    # The history is read from the observation store, off the event loop
+    await asyncio.to_thread(add_history, weather_data)
+    total = time.perf_counter() - start
+    metrics.observe("stage_seconds", total, stage="total")
+    weather_data["timings"] = {**timings, **conditions["timings"], "total": total}
+    return weather_data
+
+PROMPT_FIELDS = ("location", "coordinates", "soil_moisture", "weather_info", "crop_facts")
+
+# Chat history passed to the model is kept under this many (estimated) tokens
+history_window = HistoryWindow(
+    budget_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")),
+    recent_turns=int(os.getenv("HISTORY_RECENT_TURNS", "1")),
+)
+
+def chain_inputs(weather_data, chat_history=()):
+    """Select the prompt variables from a summarize_conditions result.
+
+    The chat history is trimmed to the token budget; the estimated prompt size is
+    recorded in weather_data["prompt_usage"].
+    """
+    inputs = {field: weather_data[field] for field in PROMPT_FIELDS}
+    inputs["chat_history"], usage = history_window.select(chat_history)
+    usage["prompt_tokens"] = usage["history_tokens"] + sum(
+        estimate_tokens(template.format(**inputs)) for _, template in PROMPT_MESSAGES)
+    weather_data["prompt_usage"] = usage
+    return inputs
+
+# Analysis cache: reports for nearby locations with near-identical conditions are
+# reused. The key is the location cell plus bucketed weather features. Only the
+# model's prose is cached: the title, location, current readings, inputs and
+# timestamp are rendered per request, and the model writes the <<location>>
+# placeholder instead of the place name. A response that names the place anyway is
+# not cached.
+ANALYSIS_GRID_PRECISION = float(os.getenv("ANALYSIS_GRID_PRECISION", "0.5"))
+ANALYSIS_BUCKETS = {
+    "temp": float(os.getenv("ANALYSIS_TEMP_STEP", "1")),
+    "feels_like": float(os.getenv("ANALYSIS_TEMP_STEP", "1")),
+    "humidity": float(os.getenv("ANALYSIS_HUMIDITY_STEP", "10")),
+    "wind_speed": float(os.getenv("ANALYSIS_WIND_STEP", "1")),
+    "soil_moisture_value": float(os.getenv("ANALYSIS_SOIL_STEP", "0.02")),
+}
+LOCATION_PLACEHOLDER = "<<location>>"
+
+analysis_cache = TieredCache(
+    maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", str(3 * 3600))),
+    path=os.getenv("ANALYSIS_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "analysis.sqlite")) or None,
+    table="analysis",
+    disk_max_entries=int(os.getenv("ANALYSIS_CACHE_DISK_SIZE", "20000")),
+)
+metrics.register_cache("analysis", analysis_cache)
+
+def analysis_key(weather_data):
+    """Cache key: location cell, bucketed temp/feels like/humidity/wind/soil moisture, description and crop ranking"""
+    lat, lon = grid_cell(weather_data["latitude"], weather_data["longitude"], ANALYSIS_GRID_PRECISION)
+    parts = [f"{lat},{lon}"]
+    for field, step in ANALYSIS_BUCKETS.items():
+        value = weather_data.get(field, 'N/A')
+        parts.append("na" if value == 'N/A' else str(round(float(value) / step)))
+    parts.append(str(weather_data.get("description", "")).lower())
+    # The report discusses the ranked crops, so it is only reused for the same ranking
+    parts.append(",".join(crop["crop"] for crop in weather_data.get("crops", ())))
+    return "|".join(parts)
+
+def report_header(weather_data):
+    """Title, location and current readings of a report, rendered from this request's data"""
+    return (f"### 🌤️ Weather Analysis for {weather_data['location']}\n\n"
+            f"#### 📍 Location Information\n{weather_data['coordinates']}\n\n"
+            f"#### 🌡️ Current Conditions\n"
+            f"**Description:** {weather_data['description']}\n"
+            f"**Temperature:** {weather_data['temp']}°C (Feels like: {weather_data['feels_like']}°C)\n"
+            f"**Humidity:** {weather_data['humidity']}%\n"
+            f"**Wind Speed:** {weather_data['wind_speed']} m/s\n"
+            f"**Soil Moisture:** {weather_data['soil_moisture']}\n\n")
+
+def report_footer(weather_data):
+    """Agricultural inputs of the ranked crops and the timestamp"""
+    return f"\n\n{weather_data['crop_inputs']}\n\n---\n*Analysis generated at {weather_data['timestamp']}*"
+
+def fill_template(text, weather_data):
+    """Put this request's location into the model's <<location>> placeholders"""
+    return text.replace(LOCATION_PLACEHOLDER, str(weather_data["location"]))
+
+def finish_report(response, weather_data):
+    """Full report: local header, the model's prose with the placeholders filled in, local footer"""
+    return report_header(weather_data) + fill_template(response, weather_data).strip() + report_footer(weather_data)
+
+def _names_location(response, weather_data):
+    """Whether the model wrote (part of) the place name instead of the placeholder"""
+    names = [part.strip() for part in str(weather_data["location"]).split(",") if len(part.strip()) >= 3]
+    return any(re.search(rf"\b{re.escape(name)}\b", response, re.IGNORECASE) for name in names)
+
+def _cache_response(key, response, weather_data):
+    if _names_location(response, weather_data):
+        metrics.inc("analysis_cache_skipped_total")
+        return
+    analysis_cache.set(key, response)
+
+def _fill_stream(chunks, weather_data):
+    """fill_template for streamed text; a chunk end that may start a placeholder is held back"""
+    pending = ""
+    for chunk in chunks:
+        text = fill_template(pending + chunk, weather_data)
+        cut = len(text)
+        for size in range(min(len(LOCATION_PLACEHOLDER) - 1, len(text)), 0, -1):
+            if LOCATION_PLACEHOLDER.startswith(text[-size:]):
+                cut -= size
+                break
+        pending = text[cut:]
+        if cut:
+            yield text[:cut]
+    if pending:
+        yield pending
+
+def _record_tokens(weather_data, response):
+    """Count the estimated prompt and completion tokens of one model call"""
+    metrics.inc("llm_tokens_total", weather_data["prompt_usage"]["prompt_tokens"], kind="prompt")
+    metrics.inc("llm_tokens_total", estimate_tokens(response), kind="completion")
+
+# Model calls wait for a slot in the "groq" rate limit bucket; a 429 slows the
+# bucket down and the call is retried up to LLM_MAX_RETRIES times
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+def _throttle_delay(error, attempt):
+    """Seconds to back off after a 429 from the model API, at most http_client.MAX_RETRY_AFTER; None for other errors"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    return http_client.retry_delay(attempt, getattr(error, "response", None))
+
+def _call_llm(call, inputs):
+    limiter = ratelimit.get_limiter("groq")
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = call(inputs)
+        except Exception as e:
+            delay = _throttle_delay(e, attempt)
+            if delay is None or attempt == LLM_MAX_RETRIES:
+                raise
+            if limiter is not None:
+                limiter.throttle(delay)
+            else:
+                time.sleep(delay)
+            continue
+        if limiter is not None:
+            limiter.succeed()
+        return response
+
+async def _acall_llm(call, inputs):
+    limiter = ratelimit.get_limiter("groq")
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if limiter is not None:
+            await limiter.aacquire()
+        try:
+            response = await call(inputs)
+        except Exception as e:
+            delay = _throttle_delay(e, attempt)
+            if delay is None or attempt == LLM_MAX_RETRIES:
+                raise
+            if limiter is not None:
+                limiter.throttle(delay)
+            else:
+                await asyncio.sleep(delay)
+            continue
+        if limiter is not None:
+            limiter.succeed()
+        return response
+
+def _stream_llm(chain, inputs):
+    """chain.stream with rate limiting; a 429 is only retried before the first chunk"""
+    limiter = ratelimit.get_limiter("groq")
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        started = False
+        try:
+            for chunk in chain.stream(inputs):
+                started = True
+                yield chunk
+        except Exception as e:
+            delay = _throttle_delay(e, attempt)
+            if started or delay is None or attempt == LLM_MAX_RETRIES:
+                raise
+            if limiter is not None:
+                limiter.throttle(delay)
+            else:
+                time.sleep(delay)
+            continue
+        if limiter is not None:
+            limiter.succeed()
+        return
+
+def invoke_analysis(chain, weather_data, chat_history=()):
+    """chain.invoke with the analysis cache in front of it"""
+    key = analysis_key(weather_data)
+    cached = analysis_cache.get(key)
+    if cached is not MISS and cached is not None:
+        return finish_report(cached, weather_data)
+    inputs = chain_inputs(weather_data, chat_history)
+    with metrics.span("analysis"):
+        response = _call_llm(chain.invoke, inputs)
+    _record_tokens(weather_data, response)
+    _cache_response(key, response, weather_data)
+    return finish_report(response, weather_data)
+
+async def ainvoke_analysis(chain, weather_data, chat_history=()):
+    """Async counterpart of invoke_analysis"""
+    key = analysis_key(weather_data)
+    cached = analysis_cache.get(key)
+    if cached is not MISS and cached is not None:
+        return finish_report(cached, weather_data)
+    inputs = chain_inputs(weather_data, chat_history)
+    with metrics.span("analysis"):
+        response = await _acall_llm(chain.ainvoke, inputs)
+    _record_tokens(weather_data, response)
+    _cache_response(key, response, weather_data)
+    return finish_report(response, weather_data)
+
+def stream_analysis(chain, weather_data, chat_history=()):
+    """Yield the analysis as it is generated; a cached report is yielded in one piece"""
+    key = analysis_key(weather_data)
+    cached = analysis_cache.get(key)
+    if cached is not MISS and cached is not None:
+        yield finish_report(cached, weather_data)
+        return
+    inputs = chain_inputs(weather_data, chat_history)
+    start = time.perf_counter()
+    parts = []
+
+    def chunks():
+        for chunk in _stream_llm(chain, inputs):
+            if not parts:
+                metrics.observe("llm_first_token_seconds", time.perf_counter() - start)
+            parts.append(chunk)
+            yield chunk
+
+    yield report_header(weather_data)
+    try:
+        yield from _fill_stream(chunks(), weather_data)
+    except Exception:
+        metrics.inc("stage_errors_total", stage="analysis")
+        raise
+    # Includes the time the caller spent rendering between chunks
+    metrics.observe("stage_seconds", time.perf_counter() - start, stage="analysis")
+    response = "".join(parts)
+    _record_tokens(weather_data, response)
+    _cache_response(key, response, weather_data)
+    yield report_footer(weather_data)
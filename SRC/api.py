@@ -0,0 +1,314 @@
+import argparse, asyncio, json, os, sys, time
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+from dotenv import load_dotenv
+import http_client, metrics, observations, ratelimit, weather
+from analysis import ainvoke_analysis, aquery_conditions
+from batch import process_record, record_coordinates
+load_dotenv()
+
+# Headless HTTP/JSON API around the weather pipeline, for clients other than the
+# Streamlit app (mobile app, SMS gateway). One asyncio event loop serves every
+# connection; at most API_WORKERS requests run the pipeline at once and API_QUEUE
+# more may wait for a worker. Anything beyond that is answered 503 with Retry-After
+# straight away instead of queueing without bound, and a request that has not
+# finished within its deadline (API_DEADLINE, or ?deadline= up to that) gets 504.
+#
+#   GET  /v1/coordinates?location=Pune
+#   GET  /v1/conditions?location=Pune        weather and soil moisture (or ?lat=&lon=)
+#   GET  /v1/soil?lat=18.52&lon=73.85
+#   GET  /v1/analysis?location=Pune          conditions, crop ranking and LLM report
+#   POST /v1/batch                           {"records": [{"location": ...} | {"lat": ..., "lon": ...}], "analyze": false}
+#   GET  /healthz, /metrics
+#
+#   python api.py --port 8080
+
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_WORKERS = int(os.getenv("API_WORKERS", "32"))
+API_QUEUE = int(os.getenv("API_QUEUE", "64"))
+# Seconds a request may take, including the wait for a worker
+API_DEADLINE = float(os.getenv("API_DEADLINE", "15"))
+API_BATCH_DEADLINE = float(os.getenv("API_BATCH_DEADLINE", "60"))
+# Records per batch request, and how many of them run at once
+API_BATCH_MAX = int(os.getenv("API_BATCH_MAX", "100"))
+API_BATCH_CONCURRENCY = int(os.getenv("API_BATCH_CONCURRENCY", "8"))
+API_MAX_BODY = int(os.getenv("API_MAX_BODY", str(1024 * 1024)))
+API_RETRY_AFTER = int(os.getenv("API_RETRY_AFTER", "1"))
+# Seconds an idle keep-alive connection is kept open
+API_KEEPALIVE = float(os.getenv("API_KEEPALIVE", "15"))
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+class WorkerPool:
+    """At most `workers` requests run at once and `queue` more wait; the rest are refused"""
+
+    def __init__(self, workers=API_WORKERS, queue=API_QUEUE):
+        self.workers = workers
+        self.queue = queue
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.expired = 0
+        self._slots = asyncio.Semaphore(workers)
+
+    async def run(self, handler, deadline):
+        """Await handler() in a worker slot; HTTPError 503 when saturated, 504 past the deadline"""
+        if self.running + self.waiting >= self.workers + self.queue:
+            self.rejected += 1
+            metrics.inc("api_rejected_total")
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "server is busy, retry later",
+                            {"Retry-After": str(API_RETRY_AFTER)})
+        end = time.monotonic() + deadline
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), deadline)
+        except asyncio.TimeoutError:
+            self._expire(deadline, "waiting for a worker")
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            # Only the deadline expiring is a 504; a timeout raised inside the handler
+            # (e.g. an upstream request) propagates like any other upstream failure
+            task = asyncio.ensure_future(handler())
+            try:
+                done, _ = await asyncio.wait({task}, timeout=max(0.0, end - time.monotonic()))
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if not done:
+                task.cancel()
+                self._expire(deadline, "processing")
+            return task.result()
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def _expire(self, deadline, stage):
+        self.expired += 1
+        metrics.inc("api_deadline_exceeded_total")
+        raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, f"deadline of {deadline:g}s exceeded while {stage}")
+
+    def stats(self):
+        return {"workers": self.workers, "queue": self.queue, "running": self.running,
+                "waiting": self.waiting, "rejected": self.rejected, "expired": self.expired}
+
+def _deadline(params, limit):
+    """The ?deadline= of a request, capped at limit"""
+    try:
+        return min(limit, float(params["deadline"])) if "deadline" in params else limit
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "deadline must be a number of seconds")
+
+class WeatherAPI:
+    def __init__(self, workers=API_WORKERS, queue=API_QUEUE):
+        self.google_maps_token = os.getenv("google_maps_token")
+        self.openweather_api_key = os.getenv("openweather_api_key")
+        self.pool = WorkerPool(workers, queue)
+        self.routes = {
+            ("GET", "/v1/coordinates"): self.coordinates,
+            ("GET", "/v1/conditions"): self.conditions,
+            ("GET", "/v1/soil"): self.soil,
+            ("GET", "/v1/analysis"): self.analysis,
+            ("POST", "/v1/batch"): self.batch,
+        }
+        self._chain = None
+        self._chain_lock = asyncio.Lock()
+
+    async def get_chain(self):
+        """The analysis chain, built on the first analysis request (off the event loop)"""
+        async with self._chain_lock:
+            if self._chain is None:
+                from analysis import build_chain
+
+                self._chain = await asyncio.to_thread(build_chain)
+        return self._chain
+
+    async def _locate(self, params):
+        """(location, latitude, longitude) from ?lat=&lon= or ?location="""
+        try:
+            coordinates = record_coordinates(params)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "lat and lon must be numbers")
+        location = params.get("location")
+        if coordinates is None:
+            if not location:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "pass location or lat and lon")
+            with metrics.span("geocode"):
+                coordinates = await weather.aget_coordinates(location, self.google_maps_token)
+        return location, coordinates[0], coordinates[1]
+
+    # -- endpoints ------------------------------------------------------------
+
+    async def coordinates(self, params, body):
+        location, latitude, longitude = await self._locate(params)
+        return {"location": location, "latitude": latitude, "longitude": longitude}
+
+    async def conditions(self, params, body):
+        location, latitude, longitude = await self._locate(params)
+        conditions = await weather.afetch_conditions(latitude, longitude, self.openweather_api_key)
+        return {
+            "location": location,
+            "latitude": latitude,
+            "longitude": longitude,
+            "weather": conditions["weather"].to_dict() if conditions["weather"] else None,
+            "soil": conditions["soil"].to_dict() if conditions["soil"] else None,
+            "errors": conditions["errors"],
+        }
+
+    async def soil(self, params, body):
+        location, latitude, longitude = await self._locate(params)
+        with metrics.span("soil"):
+            soil = await weather.aget_soil_moisture(latitude, longitude)
+        return {"location": location, **soil.to_dict()}
+
+    async def analysis(self, params, body):
+        location, latitude, longitude = await self._locate(params)
+        weather_data = await aquery_conditions(location or f"{latitude}, {longitude}", self.google_maps_token,
+                                               self.openweather_api_key, (latitude, longitude))
+        report = await ainvoke_analysis(await self.get_chain(), weather_data)
+        fields = ("location", "latitude", "longitude", "description", "temp", "feels_like", "humidity",
+                  "wind_speed", "soil_moisture_value", "crops", "errors", "timestamp")
+        return {**{field: weather_data[field] for field in fields}, "analysis": report}
+
+    async def batch(self, params, body):
+        try:
+            request = json.loads(body or b"{}")
+            records = request["records"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'body must be JSON like {"records": [...]}')
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "records must be a list of objects")
+        if len(records) > API_BATCH_MAX:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"at most {API_BATCH_MAX} records per request")
+        chain = await self.get_chain() if request.get("analyze") else None
+        slots = asyncio.Semaphore(API_BATCH_CONCURRENCY)
+
+        async def run(index, record):
+            # Set in the record's own task, so it does not outlive the request on this connection:
+            # interactive requests of other clients go first at the rate limiter
+            ratelimit.set_priority(ratelimit.BATCH)
+            record = {str(key).lower(): value for key, value in record.items()}
+            record["id"] = str(record.get("id", index))
+            async with slots:
+                return await process_record(record, self.google_maps_token, self.openweather_api_key, chain)
+
+        tasks = [asyncio.create_task(run(index, record)) for index, record in enumerate(records)]
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            # The deadline cancelled this request: stop the records still running
+            for task in tasks:
+                task.cancel()
+        counts = {"ok": 0, "error": 0}
+        for result in results:
+            counts[result["status"]] += 1
+        return {"results": results, "counts": counts}
+
+    # -- HTTP -----------------------------------------------------------------
+
+    async def dispatch(self, method, target, body):
+        """(status, payload, headers) for one request"""
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if url.path == "/healthz":
+            return HTTPStatus.OK, {"status": "ok", **self.pool.stats()}, {}
+        if url.path == "/metrics":
+            return HTTPStatus.OK, metrics.prometheus(), {"Content-Type": "text/plain; version=0.0.4"}
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            known = any(path == url.path for _, path in self.routes)
+            status = HTTPStatus.METHOD_NOT_ALLOWED if known else HTTPStatus.NOT_FOUND
+            return status, {"error": status.phrase}, {}
+
+        start = time.perf_counter()
+        try:
+            deadline = _deadline(params, API_BATCH_DEADLINE if url.path == "/v1/batch" else API_DEADLINE)
+            status, payload, headers = HTTPStatus.OK, await self.pool.run(lambda: handler(params, body), deadline), {}
+        except HTTPError as e:
+            status, payload, headers = e.status, {"error": str(e)}, e.headers
+        except ratelimit.RateLimitExceeded as e:
+            status, payload, headers = HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, {"Retry-After": str(API_RETRY_AFTER)}
+        except weather.LocationNotFound as e:
+            status, payload, headers = HTTPStatus.NOT_FOUND, {"error": str(e)}, {}
+        except Exception as e:
+            # Upstream failures, e.g. a provider outage or timeout
+            status, payload, headers = HTTPStatus.BAD_GATEWAY, {"error": str(e) or type(e).__name__}, {}
+        metrics.observe("api_request_seconds", time.perf_counter() - start, endpoint=url.path)
+        metrics.inc("api_requests_total", endpoint=url.path, status=int(status))
+        return status, payload, headers
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests (with keep-alive) on one connection"""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), API_KEEPALIVE)
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), API_KEEPALIVE)
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length > API_MAX_BODY:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "request body too large"}, {}, False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), API_KEEPALIVE) if length else b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, payload, extra = await self.dispatch(method.upper(), target, body)
+                await self._respond(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # idle, malformed or closed by the client
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, headers, keep_alive):
+        if isinstance(payload, str):
+            data = payload.encode("utf-8")
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers = {"Content-Type": "application/json", **headers}
+        head = [f"HTTP/1.1 {int(status)} {status.phrase}", f"Content-Length: {len(data)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+async def serve(host=API_HOST, port=API_PORT, workers=API_WORKERS, queue=API_QUEUE):
+    """Run the API until cancelled"""
+    api = WeatherAPI(workers, queue)
+    server = await asyncio.start_server(api.handle_connection, host, port)
+    print(f"Serving the weather API on http://{host}:{port} ({workers} workers, queue {queue})", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # Readings still buffered for the observation store are written before exiting
+        observations.flush()
+        await http_client.aclose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the weather pipeline as an HTTP/JSON API.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="requests processed at once")
+    parser.add_argument("--queue", type=int, default=API_QUEUE, help="requests waiting for a worker before 503s are returned")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os, threading
+from bisect import bisect_left
+from dataclasses import dataclass
+import numpy as np
+import gazetteer
+from gazetteer import normalize_name
+from weather import geocode_cache
+
+# Location suggestions while typing, from an in-memory sorted array of normalized
+# labels ("pune maharashtra india"): the most populous gazetteer places plus
+# addresses that were geocoded before, shown as they were typed. A lookup is two
+# binary searches for the matching range and a partial sort of its weights, so even
+# a one-letter prefix returns the most populous matches. Each suggestion carries its
+# coordinates, so picking one skips geocoding altogether.
+
+AUTOCOMPLETE_PLACES = int(os.getenv("AUTOCOMPLETE_PLACES", "50000"))
+AUTOCOMPLETE_HISTORY = int(os.getenv("AUTOCOMPLETE_HISTORY", "5000"))
+# Addresses geocoded before rank above gazetteer places of any population
+HISTORY_WEIGHT = 2 ** 40
+
+@dataclass(frozen=True)
+class Suggestion:
+    __slots__ = ("label", "latitude", "longitude", "weight")
+    label: str
+    latitude: float
+    longitude: float
+    weight: int
+
+    @property
+    def coordinates(self):
+        return self.latitude, self.longitude
+
+class PlaceIndex:
+    def __init__(self, suggestions=()):
+        self._lock = threading.Lock()
+        # (keys, entries, weights) is replaced as a whole on every change, so readers need no lock
+        self._data = ([], [], np.empty(0, dtype=np.int64))
+        self.extend(suggestions)
+
+    def __len__(self):
+        return len(self._data[0])
+
+    def extend(self, suggestions):
+        """Add many suggestions with a single sort"""
+        with self._lock:
+            pairs = list(zip(*self._data[:2]))
+            pairs.extend((normalize_name(suggestion.label), suggestion) for suggestion in suggestions)
+            pairs = sorted((pair for pair in pairs if pair[0]), key=lambda pair: pair[0])
+            self._set([key for key, _ in pairs], [entry for _, entry in pairs])
+
+    def add(self, suggestion):
+        """Add one suggestion, replacing an entry with the same label"""
+        key = normalize_name(suggestion.label)
+        if not key:
+            return
+        with self._lock:
+            keys, entries = list(self._data[0]), list(self._data[1])
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                entries[index] = suggestion
+            else:
+                keys.insert(index, key)
+                entries.insert(index, suggestion)
+            self._set(keys, entries)
+
+    def _set(self, keys, entries):
+        self._data = (keys, entries, np.fromiter((entry.weight for entry in entries), dtype=np.int64, count=len(entries)))
+
+    def suggest(self, text, limit=8):
+        """Up to limit suggestions whose label starts with text, best first"""
+        key = normalize_name(text)
+        if not key:
+            return []
+        keys, entries, weights = self._data
+        start = bisect_left(keys, key)
+        end = bisect_left(keys, key + "\uffff", start)
+        # Heaviest first; a few extra candidates make up for duplicate labels
+        candidates = _heaviest(weights[start:end], limit * 4)
+        results = _distinct(entries, start, candidates, limit)
+        if len(results) < limit and len(candidates) < end - start:
+            results = _distinct(entries, start, _heaviest(weights[start:end], end - start), limit)
+        return results
+
+def _heaviest(weights, count):
+    """Indices of the count largest weights, largest first (ties in label order)"""
+    if count < len(weights):
+        top = np.argpartition(-weights, count - 1)[:count]
+    else:
+        top = np.arange(len(weights))
+    return top[np.lexsort((top, -weights[top]))]
+
+def _distinct(entries, start, candidates, limit):
+    results, labels = [], set()
+    for offset in candidates.tolist():
+        suggestion = entries[start + offset]
+        if suggestion.label not in labels:
+            labels.add(suggestion.label)
+            results.append(suggestion)
+            if len(results) == limit:
+                break
+    return results
+
+def build_index():
+    """Index the top AUTOCOMPLETE_PLACES gazetteer places and the geocoding history"""
+    suggestions = []
+    index = gazetteer.get_gazetteer()
+    if index is not None and AUTOCOMPLETE_PLACES > 0:
+        population = np.asarray(index.places["population"])
+        top = np.argsort(population, kind="stable")[::-1][:AUTOCOMPLETE_PLACES]
+        suggestions.extend(Suggestion(index.label(place), *index.coordinates(place), int(population[place]))
+                           for place in top.tolist())
+    for address, cached in geocode_cache.items(AUTOCOMPLETE_HISTORY):
+        # Entries carry the address as typed; older ones only have the normalized key
+        label = cached[2] if len(cached) > 2 else address
+        suggestions.append(Suggestion(label, cached[0], cached[1], HISTORY_WEIGHT))
+    return PlaceIndex(suggestions)
+
+_index = None
+_lock = threading.Lock()
+
+def get_index():
+    """The process-wide PlaceIndex, built on first use"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+def suggest(text, limit=8):
+    """Suggestions for a partly typed location.
+
+    Falls back to the gazetteer's full name index (alternate names such as "Bombay")
+    when the in-memory index has fewer than limit matches.
+    """
+    results = get_index().suggest(text, limit)
+    index = gazetteer.get_gazetteer()
+    if len(results) < limit and index is not None and len(normalize_name(text)) >= 3:
+        labels = {suggestion.label for suggestion in results}
+        for label, latitude, longitude in index.prefix(text, limit):
+            if label not in labels and len(results) < limit:
+                labels.add(label)
+                results.append(Suggestion(label, latitude, longitude, 0))
+    return results
+
+def remember(label, latitude, longitude):
+    """Offer a successfully geocoded address as a suggestion from now on"""
+    get_index().add(Suggestion(label, latitude, longitude, HISTORY_WEIGHT))
@@ -0,0 +1,168 @@
+import argparse, asyncio, csv, json, os, sys, time
+from dotenv import load_dotenv
+import http_client, metrics, observations, ratelimit, weather
+from analysis import ainvoke_analysis, summarize_conditions
+load_dotenv()
+
+# Batch runner: analyze many locations from a CSV or JSONL file.
+#
+# Every input record needs either a "location" (address / place name) or a
+# "lat"/"lon" pair ("latitude"/"longitude" also work) and may carry an "id".
+# Results are appended to the output JSONL as soon as each record completes; the
+# output file doubles as the checkpoint, so re-running with --resume skips every
+# id that already has a result line.
+#
+#   python batch.py plots.csv results.jsonl --concurrency 64 --analyze --resume
+#
+# --metrics writes the per-stage latency histograms and cache statistics at the end
+# (JSON for a .json path, Prometheus text otherwise).
+
+def read_records(path):
+    """Yield input records as dicts with an "id" field"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for index, row in enumerate(rows):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            row.setdefault("id", str(index))
+            row["id"] = str(row["id"])
+            yield row
+
+def completed_ids(path):
+    """Ids already present in an output file; a torn last line is ignored"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+def record_coordinates(record):
+    """(lat, lon) of a record, or None when it only has a location"""
+    lat = record.get("lat", record.get("latitude"))
+    lon = record.get("lon", record.get("longitude"))
+    if lat in (None, "") or lon in (None, ""):
+        return None
+    return float(lat), float(lon)
+
+async def process_record(record, google_maps_token, openweather_api_key, chain=None, timeout=None):
+    """Run geocode -> weather + soil -> optional analysis for one record"""
+    start = time.perf_counter()
+    result = {"id": record["id"], "location": record.get("location")}
+    try:
+        coordinates = record_coordinates(record)
+        if coordinates is None:
+            if not record.get("location"):
+                raise ValueError("record needs a location or lat/lon")
+            with metrics.span("geocode"):
+                coordinates = await weather.aget_coordinates(record["location"], google_maps_token)
+        geocode_time = time.perf_counter() - start
+        latitude, longitude = coordinates
+
+        conditions = await weather.afetch_conditions(latitude, longitude, openweather_api_key, timeout)
+        result.update({
+            "latitude": latitude,
+            "longitude": longitude,
+            "weather": conditions["weather"].to_dict() if conditions["weather"] else None,
+            "soil": conditions["soil"].to_dict() if conditions["soil"] else None,
+            "errors": conditions["errors"],
+        })
+        timings = {"geocode": geocode_time, **conditions["timings"]}
+
+        weather_data = summarize_conditions(record.get("location") or f"{latitude}, {longitude}", latitude, longitude, conditions)
+        if weather_data is not None:
+            result["crops"] = [{"crop": crop["crop"], "score": crop["score"]} for crop in weather_data["crops"]]
+        if chain is not None and weather_data is not None:
+            analysis_start = time.perf_counter()
+            try:
+                result["analysis"] = await ainvoke_analysis(chain, weather_data)
+            except Exception as e:
+                result["errors"]["analysis"] = str(e)
+            timings["analysis"] = time.perf_counter() - analysis_start
+
+        result["status"] = "ok" if weather_data is not None else "error"
+        result["timings"] = {**timings, "total": time.perf_counter() - start}
+        metrics.observe("stage_seconds", result["timings"]["total"], stage="total")
+    except Exception as e:
+        result.update({"status": "error", "error": str(e), "timings": {"total": time.perf_counter() - start}})
+    return result
+
+async def run_batch(records, output_path, concurrency=32, chain=None, resume=False, timeout=None, progress_every=100):
+    """Process records with at most `concurrency` in flight, streaming results to output_path"""
+    # Interactive requests of the app in the same process go first at the rate limiter
+    ratelimit.set_priority(ratelimit.BATCH)
+    google_maps_token = os.getenv("google_maps_token")
+    openweather_api_key = os.getenv("openweather_api_key")
+    skip = completed_ids(output_path) if resume else set()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+        if resume and out.tell() > 0:
+            # Terminate a line torn by a crash so the next result starts cleanly
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+        async def worker():
+            while True:
+                record = await queue.get()
+                if record is None:
+                    return
+                result = await process_record(record, google_maps_token, openweather_api_key, chain, timeout)
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[result["status"]] += 1
+                done = counts["ok"] + counts["error"]
+                if progress_every and done % progress_every == 0:
+                    rate = done / (time.perf_counter() - start)
+                    print(f"{done} done ({counts['error']} errors, {rate:.1f}/s)", file=sys.stderr)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for record in records:
+            if record["id"] in skip:
+                counts["skipped"] += 1
+                continue
+            await queue.put(record)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    # Readings still buffered for the observation store are written before returning
+    observations.flush()
+    await http_client.aclose()
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze weather and soil conditions for many locations.")
+    parser.add_argument("input", help="CSV or JSONL file with location or lat/lon columns")
+    parser.add_argument("output", help="JSONL file to write results to (also used as the checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "32")),
+                        help="maximum number of records processed at once")
+    parser.add_argument("--analyze", action="store_true", help="also run the LLM analysis for every record")
+    parser.add_argument("--resume", action="store_true", help="skip records that already have a result in the output file")
+    parser.add_argument("--timeout", type=float, default=None, help="per-provider timeout in seconds")
+    parser.add_argument("--metrics", help="write stage latency metrics to this file when done")
+    args = parser.parse_args(argv)
+
+    chain = None
+    if args.analyze:
+        from analysis import build_chain
+        chain = build_chain()
+
+    counts = asyncio.run(run_batch(read_records(args.input), args.output, args.concurrency, chain, args.resume, args.timeout))
+    print(f"Finished: {counts['ok']} ok, {counts['error']} errors, {counts['skipped']} skipped "
+          f"in {counts['seconds']:.1f}s", file=sys.stderr)
+    if args.metrics:
+        metrics.write(args.metrics)
+
+if __name__ == "__main__":
+    main()
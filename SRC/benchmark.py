@@ -0,0 +1,438 @@
+import argparse, asyncio, hashlib, json, math, multiprocessing, os, random, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Offline benchmark: local stand-ins for Google Geocoding, OpenWeather, Open-Meteo and
+# the Groq chat endpoint, returning the JSON shapes the app consumes, with
+# configurable latency and error rates. The pipeline (query_conditions and the
+# analysis chain) is driven at a given concurrency and throughput plus p50/p95/p99
+# latency per stage are reported. No network access is needed.
+#
+#   python benchmark.py --requests 500 --concurrency 32 --latency geocode=80,weather=120,soil=150
+#   python benchmark.py --mode async --analyze --latency groq=800 --error-rate weather=0.05
+#   RATE_LIMIT_OPENWEATHER=600 python benchmark.py --quota weather=600 --rate-limit --cache
+
+SERVICES = ("geocode", "weather", "soil", "groq")
+
+# What the model writes for the analysis prompt: prose only, with the <<location>>
+# placeholder; the title, current conditions and agricultural inputs are added locally
+FAKE_REPORT = """#### 📊 Detailed Analysis
+
+**Temperature Impact:**
+- Warm conditions in <<location>> suit most kharif crops.
+
+**Humidity Assessment:**
+- Moderate humidity; watch for fungal disease.
+
+#### 🌾 Crop Recommendations
+1. **Rice**: benefits from the soil moisture
+2. **Maize**: tolerates the temperature range
+3. **Groundnut**: suited to light soils
+
+#### ⚠️ Recommendations & Precautions
+- Irrigate the fields around <<location>> in the early morning.
+"""
+
+
+class Profile:
+    """Latency (seconds, gaussian with jitter), error rate and quota of one fake upstream"""
+
+    def __init__(self, latency=0.0, jitter=0.2, error_rate=0.0, error_status=503, quota=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.quota = quota  # requests per minute, 0 for unlimited
+        self._lock = None
+
+    def start_quota(self):
+        # Called in the server process; a lock cannot be handed to it
+        self._lock = threading.Lock()
+        self._tokens = self.quota / 6
+        self._updated = time.monotonic()
+
+    def over_quota(self):
+        """Retry-After seconds if the quota (ten seconds of burst) is used up, else None"""
+        if not self.quota:
+            return None
+        rate = self.quota / 60
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(max(rate * 10, 1.0), self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / rate
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(max(0.0, random.gauss(self.latency, self.latency * self.jitter)))
+
+    def failed(self):
+        return random.random() < self.error_rate
+
+
+def _fake_coordinates(address):
+    # Stable pseudo-random coordinates per address so distinct places land in distinct cells
+    digest = hashlib.sha1(address.lower().encode()).digest()
+    return (int.from_bytes(digest[:4], "big") / 2**32 * 120 - 50,
+            int.from_bytes(digest[4:8], "big") / 2**32 * 340 - 170)
+
+
+def _soil_location(latitude, longitude):
+    now = int(time.time()) // 3600 * 3600
+    times = [now - 24 * 3600 + 3600 * i for i in range(48)]
+    hourly = {"time": times}
+    for depth, base in (("0_to_1cm", 0.22), ("1_to_3cm", 0.24), ("3_to_9cm", 0.26), ("9_to_27cm", 0.28), ("27_to_81cm", 0.3)):
+        hourly[f"soil_moisture_{depth}"] = [round(base + 0.0005 * i, 4) for i in range(48)]
+    return {"latitude": float(latitude), "longitude": float(longitude), "utc_offset_seconds": 0, "hourly": hourly}
+
+
+class FakeUpstreams:
+    """One local HTTP server answering for all four upstream APIs"""
+
+    def __init__(self, profiles=None, token_delay=0.0):
+        self.profiles = {service: Profile() for service in SERVICES}
+        self.profiles.update(profiles or {})
+        self.token_delay = token_delay
+        # Shared with the server process
+        self._counts = multiprocessing.Array("l", len(SERVICES))
+        self._throttled = multiprocessing.Array("l", len(SERVICES))
+        self.server = None
+        self._process = None
+
+    @property
+    def counts(self):
+        return dict(zip(SERVICES, self._counts[:]))
+
+    @property
+    def throttled(self):
+        """429 answers per service"""
+        return dict(zip(SERVICES, self._throttled[:]))
+
+    def _count(self, service):
+        with self._counts.get_lock():
+            self._counts[SERVICES.index(service)] += 1
+
+    def _count_throttled(self, service):
+        with self._throttled.get_lock():
+            self._throttled[SERVICES.index(service)] += 1
+
+    def start(self, separate_process=True):
+        """Start serving and return the base URL.
+
+        By default the server runs in its own process so that it does not compete
+        with the code under test for the GIL.
+        """
+        if not separate_process:
+            self.server = self._make_server()
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            return f"http://127.0.0.1:{self.server.server_port}"
+        ready = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=self._serve, args=(ready,), daemon=True)
+        self._process.start()
+        return f"http://127.0.0.1:{ready.get(timeout=30)}"
+
+    def _serve(self, ready):
+        server = self._make_server()
+        ready.put(server.server_port)
+        server.serve_forever()
+
+    def _make_server(self):
+        upstreams = self
+        for profile in self.profiles.values():
+            profile.start_quota()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body are separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=()):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _fail(self, service):
+                profile = upstreams.profiles[service]
+                retry_after = profile.over_quota()
+                if retry_after is not None:
+                    upstreams._count_throttled(service)
+                    self._send_json(429, {"error": True, "message": "rate limit exceeded"},
+                                    [("Retry-After", str(math.ceil(retry_after)))])
+                    return True
+                profile.delay()
+                if profile.failed():
+                    self._send_json(profile.error_status, {"error": True, "message": "injected failure"})
+                    return True
+                return False
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path.endswith("/geocode/json"):
+                    upstreams._count("geocode")
+                    if self._fail("geocode"):
+                        return
+                    if query.get("address", "").lower().startswith("nowhere"):
+                        self._send_json(200, {"status": "ZERO_RESULTS", "results": []})
+                        return
+                    lat, lng = _fake_coordinates(query.get("address", ""))
+                    self._send_json(200, {"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}]})
+                elif url.path.endswith("/data/2.5/weather"):
+                    upstreams._count("weather")
+                    if self._fail("weather"):
+                        return
+                    self._send_json(200, {
+                        "weather": [{"description": "scattered clouds"}],
+                        "main": {"temp": 27.4, "feels_like": 29.1, "humidity": 68},
+                        "wind": {"speed": 3.2},
+                    })
+                elif url.path.endswith("/v1/forecast"):
+                    upstreams._count("soil")
+                    if self._fail("soil"):
+                        return
+                    latitudes = query.get("latitude", "0").split(",")
+                    longitudes = query.get("longitude", "0").split(",")
+                    locations = [_soil_location(lat, lon) for lat, lon in zip(latitudes, longitudes)]
+                    self._send_json(200, locations[0] if len(locations) == 1 else locations)
+                else:
+                    self._send_json(404, {"error": True, "message": "unknown path"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "unknown path"}})
+                    return
+                upstreams._count("groq")
+                if self._fail("groq"):
+                    return
+                text = FAKE_REPORT
+                usage = {"prompt_tokens": sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4,
+                         "completion_tokens": len(text) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                model = body.get("model", "fake")
+                if not body.get("stream"):
+                    self._send_json(200, {
+                        "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    })
+                    return
+                # Server-sent events, one chunk per word
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                words = text.split(" ")
+                for index, word in enumerate(words):
+                    chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {"content": word + (" " if index < len(words) - 1 else "")},
+                                                          "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    if upstreams.token_delay:
+                        time.sleep(upstreams.token_delay)
+                final = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+                self.close_connection = True
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024  # the default backlog of 5 drops connections under load
+
+        return Server(("127.0.0.1", 0), Handler)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+    def env(self, base_url):
+        """Environment variables that point the app at this server"""
+        return {
+            "GEOCODING_URL": f"{base_url}/maps/api/geocode/json",
+            "OPENWEATHER_URL": f"{base_url}/data/2.5/weather",
+            "OPEN_METEO_URL": f"{base_url}/v1/forecast",
+            "GROQ_API_BASE": base_url,
+            "google_maps_token": "bench",
+            "openweather_api_key": "bench",
+            "GROQ_API_KEY": "bench",
+        }
+
+
+def _parse_pairs(text, cast=float):
+    """'geocode=80,weather=120' -> {'geocode': 80.0, 'weather': 120.0}"""
+    pairs = {}
+    for item in filter(None, (text or "").split(",")):
+        name, _, value = item.partition("=")
+        if name.strip() not in SERVICES:
+            raise SystemExit(f"unknown service '{name}', expected one of {', '.join(SERVICES)}")
+        pairs[name.strip()] = cast(value)
+    return pairs
+
+
+def percentiles(samples):
+    import numpy as np
+
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": int(values.size), "mean_ms": float(values.mean()), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(values.max())}
+
+
+def run_sync(locations, concurrency, chain):
+    from analysis import invoke_analysis, query_conditions
+
+    def one(location):
+        try:
+            weather_data = query_conditions(location, os.getenv("google_maps_token"), os.getenv("openweather_api_key"))
+            timings = dict(weather_data["timings"])
+            if chain is not None:
+                start = time.perf_counter()
+                invoke_analysis(chain, weather_data)
+                timings["analysis"] = time.perf_counter() - start
+                timings["total"] += timings["analysis"]
+            return timings, None, weather_data["errors"]
+        except Exception as e:
+            return None, str(e), {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, locations))
+
+
+async def run_async(locations, concurrency, chain):
+    import http_client
+    from analysis import ainvoke_analysis, aquery_conditions
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(location):
+        async with semaphore:
+            try:
+                weather_data = await aquery_conditions(location, os.getenv("google_maps_token"), os.getenv("openweather_api_key"))
+                timings = dict(weather_data["timings"])
+                if chain is not None:
+                    start = time.perf_counter()
+                    await ainvoke_analysis(chain, weather_data)
+                    timings["analysis"] = time.perf_counter() - start
+                    timings["total"] += timings["analysis"]
+                return timings, None, weather_data["errors"]
+            except Exception as e:
+                return None, str(e), {}
+
+    results = await asyncio.gather(*(one(location) for location in locations))
+    await http_client.aclose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the weather pipeline against local fake upstreams.")
+    parser.add_argument("--requests", type=int, default=200, help="number of pipeline runs")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--locations", type=int, default=50, help="distinct place names cycled through")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--analyze", action="store_true", help="include the LLM analysis stage (needs langchain-groq)")
+    parser.add_argument("--cache", action="store_true", help="keep the in-memory caches enabled")
+    parser.add_argument("--latency", default="geocode=80,weather=120,soil=150,groq=1500",
+                        help="mean upstream latency in ms per service")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency standard deviation as a fraction of the mean")
+    parser.add_argument("--error-rate", default="", help="fraction of requests failing with 503, per service")
+    parser.add_argument("--quota", default="", help="requests per minute before answering 429, per service")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the app's client-side rate limits (RATE_LIMIT_*); off by default")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="ms between streamed LLM chunks")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    latency = _parse_pairs(args.latency)
+    errors = _parse_pairs(args.error_rate)
+    quotas = _parse_pairs(args.quota)
+    profiles = {service: Profile(latency.get(service, 0) / 1000, args.jitter, errors.get(service, 0.0), quota=quotas.get(service, 0.0))
+                for service in SERVICES}
+    upstreams = FakeUpstreams(profiles, args.token_delay / 1000)
+    base_url = upstreams.start()
+
+    # Configure the app modules before they are imported
+    os.environ.update(upstreams.env(base_url))
+    os.environ.update({"GEOCODE_CACHE_PATH": "", "ANALYSIS_CACHE_PATH": "", "OBSERVATION_STORE_PATH": ""})
+    if not args.cache:
+        os.environ.update({"GEOCODE_CACHE_TTL": "0", "WEATHER_CACHE_TTL": "0", "SOIL_CACHE_TTL": "0",
+                           "ANALYSIS_CACHE_TTL": "0", "STALE_WHILE_REVALIDATE": "false"})
+    if not args.rate_limit:
+        os.environ.update({"RATE_LIMIT_GOOGLE": "0", "RATE_LIMIT_OPENWEATHER": "0", "RATE_LIMIT_OPEN_METEO": "0", "RATE_LIMIT_GROQ": "0"})
+
+    chain = None
+    if args.analyze:
+        from analysis import build_chain
+        chain = build_chain()
+
+    locations = [f"Village {i % args.locations}" for i in range(args.requests)]
+    start = time.perf_counter()
+    if args.mode == "async":
+        results = asyncio.run(run_async(locations, args.concurrency, chain))
+    else:
+        results = run_sync(locations, args.concurrency, chain)
+    elapsed = time.perf_counter() - start
+    upstreams.stop()
+
+    stages = {}
+    failures = []
+    # Runs that returned, but with weather or soil missing
+    degraded = {}
+    for timings, error, partial in results:
+        for field in partial:
+            degraded[field] = degraded.get(field, 0) + 1
+        if error is not None:
+            failures.append(error)
+            continue
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    report = {
+        "mode": args.mode,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "throughput_rps": args.requests / elapsed,
+        "errors": len(failures),
+        "degraded": degraded,
+        "upstream_calls": upstreams.counts,
+        "upstream_429s": upstreams.throttled,
+        "stages": {stage: percentiles(samples) for stage, samples in stages.items()},
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"{args.requests} requests, {args.mode}, concurrency {args.concurrency}: "
+          f"{elapsed:.2f}s, {report['throughput_rps']:.1f} req/s, {len(failures)} errors")
+    if degraded:
+        print("degraded (field missing): " + ", ".join(f"{field} {count}" for field, count in degraded.items()))
+    print("upstream calls: " + ", ".join(f"{name} {count}" for name, count in upstreams.counts.items()))
+    if any(upstreams.throttled.values()):
+        print("upstream 429s: " + ", ".join(f"{name} {count}" for name, count in upstreams.throttled.items()))
+    print(f"{'stage':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<10}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    if failures:
+        print(f"first error: {failures[0]}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import asyncio, json, os, sqlite3, threading, time
+from collections import OrderedDict
+
+# Sentinel returned by the caches when a key is absent or expired
+MISS = object()
+
+
+# A value fetched before now (e.g. read back from a persistent store). Returned by a
+# ResponseCache fetch function, it is aged from fetched_at instead of from the time
+# it was cached, so it expires when the original would have.
+class Dated:
+    __slots__ = ("value", "fetched_at")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+# In-process LRU cache where every entry carries its own expiry time
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self):
+        """Unexpired (key, value) pairs, most recently used first"""
+        now = time.time()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in reversed(self._data.items()) if expires_at >= now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# SQLite-backed key/value store, values are stored as JSON. Expired rows and rows
+# above max_entries are pruned every prune_every writes or prune_interval seconds,
+# so the table may briefly hold up to prune_every rows more than max_entries.
+class DiskCache:
+    def __init__(self, path, table="cache", max_entries=100000, prune_every=256, prune_interval=60):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.prune_interval = prune_interval
+        self._writes = 0
+        self._last_prune = time.time()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_stored_at ON {table} (stored_at)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+        self._prune(self._last_prune)
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return MISS, None
+        value, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            self.delete(key)
+            return MISS, None
+        return json.loads(value), remaining
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes >= self.prune_every or now - self._last_prune >= self.prune_interval:
+                self._prune(now)
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def items(self, limit=None):
+        """Unexpired (key, value) pairs, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM {self.table} WHERE expires_at >= ? ORDER BY stored_at DESC LIMIT ?",
+                (time.time(), -1 if limit is None else limit),
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def _prune(self, now):
+        # Drop expired rows first, then the oldest rows above the size limit
+        self._writes = 0
+        self._last_prune = now
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY stored_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+# Two-tier cache: in-process LRU in front of an optional on-disk store
+class TieredCache:
+    def __init__(self, maxsize=1024, ttl=3600, negative_ttl=None, path=None, table="cache", disk_max_entries=100000):
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(path, table=table, max_entries=disk_max_entries) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is MISS and self.disk is not None:
+            value, remaining = self.disk.get(key)
+            if value is not MISS:
+                # Promote to memory for the rest of the entry's lifetime
+                self.memory.set(key, value, ttl=remaining)
+                self.disk_hits += 1
+        if value is MISS:
+            self.misses += 1
+            return MISS
+        self.hits += 1
+        if value is None:
+            self.negative_hits += 1
+        return value
+
+    def set(self, key, value):
+        # None marks a negative result and is kept for negative_ttl only
+        ttl = self.negative_ttl if value is None else self.ttl
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def items(self, limit=None):
+        """Unexpired positive (key, value) pairs from both tiers, newest first"""
+        items = dict(self.memory.items())
+        if self.disk is not None:
+            for key, value in self.disk.items(limit):
+                items.setdefault(key, value)
+        pairs = [(key, value) for key, value in items.items() if value is not None]
+        return pairs if limit is None else pairs[:limit]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+        }
+
+
+# Response cache with stale-while-revalidate: once an entry is older than ttl but
+# younger than ttl + max_stale, the old value is returned immediately and a
+# background refresh is started for that key. None marks a negative result (e.g. no
+# data for a location) and is kept for negative_ttl instead of ttl.
+class ResponseCache:
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, maxsize=4096, ttl=600, max_stale=0, stale_while_revalidate=True, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_stale = max_stale
+        self.stale_while_revalidate = stale_while_revalidate
+        self._data = OrderedDict()
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    @classmethod
+    def _background(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                cls._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+            return cls._executor
+
+    def _lookup(self, key):
+        """Return (value, refresh) for a usable entry, or (MISS, False).
+
+        refresh is True when the caller should start the background refresh
+        for a stale entry; the key is already marked as refreshing.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, fetched_at, ttl = entry
+                age = now - fetched_at
+                if age < ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value, False
+                if self.stale_while_revalidate and age < ttl + self.max_stale:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return value, refresh
+            self.misses += 1
+            return MISS, False
+
+    def get(self, key):
+        """Return a fresh value or MISS; stale entries count as misses here"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.time() - entry[1] < entry[2]:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return MISS
+
+    def get_or_fetch(self, key, fetch):
+        value, refresh = self._lookup(key)
+        if refresh:
+            self._background().submit(self._refresh, key, fetch)
+        if value is not MISS:
+            return value
+
+        return self.set(key, fetch())
+
+    async def aget_or_fetch(self, key, fetch):
+        """Async variant: fetch is a zero-argument callable returning an awaitable"""
+        value, refresh = self._lookup(key)
+        if refresh:
+            task = asyncio.get_running_loop().create_task(self._arefresh(key, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if value is not MISS:
+            return value
+
+        return self.set(key, await fetch())
+
+    def _refresh(self, key, fetch):
+        try:
+            self.set(key, fetch())
+        except Exception:
+            # Keep serving the stale value; the next request past max_stale fetches inline
+            self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _arefresh(self, key, fetch):
+        try:
+            self.set(key, await fetch())
+        except Exception:
+            self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value):
+        """Store value (or a Dated value) and return the plain value"""
+        fetched_at = time.time()
+        if isinstance(value, Dated):
+            value, fetched_at = value.value, value.fetched_at
+        with self._lock:
+            self._data[key] = (value, fetched_at, self.negative_ttl if value is None else self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "entries": len(self._data),
+        }
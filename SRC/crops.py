@@ -0,0 +1,326 @@
+import argparse, json, os
+from dataclasses import asdict, dataclass
+import numpy as np
+
+# Local crop suitability rules. Every crop has tolerance ranges for temperature,
+# humidity, wind and topsoil moisture; a reading scores 1 inside the optimum band and
+# falls linearly to 0 at the crop's limits. The crop score is the weighted product of
+# the four factors, so a single unsuitable factor rules a crop out. All crops (and,
+# for batch runs, all locations) are scored in one NumPy pass. Without a temperature
+# or humidity reading nothing is ranked; a missing wind or soil moisture reading (NaN)
+# is left out of the score and reported as unknown.
+#
+# The ranking is handed to the LLM as facts, so it only writes the narrative around
+# it; the fertilizer / pesticide / weedicide listings of the top crops are appended to
+# the report locally instead of being generated.
+#
+#   python crops.py results.jsonl --top 3     # rank the records of a batch.py output
+
+# Crops recommended per location
+CROP_TOP = int(os.getenv("CROP_TOP", "5"))
+# Crops scoring below this are never recommended
+CROP_MIN_SCORE = float(os.getenv("CROP_MIN_SCORE", "0.2"))
+
+FACTORS = ("temperature", "humidity", "wind", "soil moisture")
+# Factors a ranking cannot be made without
+REQUIRED_FACTORS = 2
+# Exponents of the factors in the score: temperature matters most, wind least
+WEIGHTS = np.array([1.0, 0.6, 0.3, 0.8])
+
+# temp and humidity (°C, %) and soil (0-1cm moisture, m³/m³) are (min, optimum low,
+# optimum high, max); wind (m/s) is (comfortable, max). Inputs are (chemical, natural).
+CROPS = {
+    "Rice": {
+        "temp": (16, 22, 32, 38), "humidity": (50, 65, 90, 100), "wind": (8, 16), "soil": (0.20, 0.30, 0.55, 0.65),
+        "fertilizer": ("NPK 120:60:40 kg/ha; urea in 3 splits (basal, tillering, panicle initiation)",
+                       "FYM 10 t/ha before puddling; Azolla or green manure (dhaincha)"),
+        "pesticide": ("Stem borer: chlorantraniliprole 0.4% GR 10 kg/ha; BPH: pymetrozine 50 WG 300 g/ha",
+                      "Neem oil 3% spray; light traps; release Trichogramma japonicum"),
+        "weedicide": ("Pretilachlor 50 EC 0.75 kg a.i./ha pre-emergence; bispyribac-sodium 25 g a.i./ha post-emergence",
+                      "Keep 5 cm standing water; cono-weeder at 20 and 40 days"),
+    },
+    "Wheat": {
+        "temp": (5, 15, 24, 32), "humidity": (30, 40, 70, 85), "wind": (8, 16), "soil": (0.10, 0.18, 0.35, 0.45),
+        "fertilizer": ("NPK 120:60:40 kg/ha; half N basal, half at crown root initiation",
+                       "Vermicompost 5 t/ha; Azotobacter seed treatment"),
+        "pesticide": ("Aphids: imidacloprid 17.8 SL 100 ml/ha; rust: propiconazole 25 EC 0.1%",
+                      "Neem seed kernel extract 5%; yellow sticky traps"),
+        "weedicide": ("Clodinafop-propargyl 60 g a.i./ha + metsulfuron-methyl 4 g a.i./ha at 30-35 days",
+                      "Stale seedbed; one hand weeding at 30 days"),
+    },
+    "Maize": {
+        "temp": (12, 20, 30, 38), "humidity": (35, 50, 80, 90), "wind": (7, 15), "soil": (0.12, 0.20, 0.40, 0.50),
+        "fertilizer": ("NPK 120:60:40 kg/ha + ZnSO4 25 kg/ha; N in 3 splits",
+                       "FYM 10 t/ha; Azospirillum seed treatment"),
+        "pesticide": ("Fall armyworm: emamectin benzoate 5 SG 0.4 g/l or spinetoram 11.7 SC 0.5 ml/l into the whorl",
+                      "Sand + lime in the whorl; Bt or Metarhizium sprays; pheromone traps 5/acre"),
+        "weedicide": ("Atrazine 50 WP 1 kg a.i./ha pre-emergence; tembotrione 120 g a.i./ha post-emergence",
+                      "Intercrop with cowpea; inter-row cultivation at 20-25 days"),
+    },
+    "Cotton": {
+        "temp": (16, 21, 32, 40), "humidity": (30, 45, 70, 85), "wind": (7, 14), "soil": (0.10, 0.18, 0.35, 0.45),
+        "fertilizer": ("NPK 100:50:50 kg/ha; 2% DAP foliar spray at flowering",
+                       "FYM 10 t/ha; PSB and Azotobacter"),
+        "pesticide": ("Pink bollworm: profenofos 50 EC 2 ml/l; sucking pests: flonicamid 50 WG 0.3 g/l",
+                      "Pheromone traps; neem oil 5 ml/l; border crop of marigold"),
+        "weedicide": ("Pendimethalin 30 EC 1 kg a.i./ha pre-emergence; pyrithiobac-sodium 62.5 g a.i./ha post-emergence",
+                      "Inter-cultivation with bullock hoe; mulching"),
+    },
+    "Sugarcane": {
+        "temp": (15, 22, 34, 40), "humidity": (45, 60, 85, 95), "wind": (8, 18), "soil": (0.18, 0.25, 0.45, 0.55),
+        "fertilizer": ("NPK 250:115:115 kg/ha; N in 3 splits up to 90 days",
+                       "Press mud 10 t/ha; trash mulching; Gluconacetobacter"),
+        "pesticide": ("Early shoot borer: chlorantraniliprole 18.5 SC 375 ml/ha; white grub: fipronil 0.3 GR 25 kg/ha",
+                      "Trichogramma chilonis cards; remove dead hearts"),
+        "weedicide": ("Atrazine 2 kg a.i./ha pre-emergence; 2,4-D sodium salt 1 kg a.i./ha post-emergence",
+                      "Trash mulching; intercrop with green gram in early months"),
+    },
+    "Soybean": {
+        "temp": (12, 20, 30, 36), "humidity": (40, 55, 80, 90), "wind": (8, 15), "soil": (0.15, 0.22, 0.40, 0.50),
+        "fertilizer": ("NPK 20:60:40 kg/ha + sulphur 20 kg/ha",
+                       "Rhizobium + PSB seed treatment; FYM 5 t/ha"),
+        "pesticide": ("Girdle beetle / semilooper: chlorantraniliprole 18.5 SC 150 ml/ha",
+                      "Neem oil 3%; bird perches 20/acre; NPV for Spodoptera"),
+        "weedicide": ("Imazethapyr 10 SL 100 g a.i./ha at 15-20 days",
+                      "Two hand weedings at 20 and 40 days"),
+    },
+    "Groundnut": {
+        "temp": (15, 22, 32, 38), "humidity": (35, 50, 75, 90), "wind": (8, 15), "soil": (0.10, 0.16, 0.32, 0.42),
+        "fertilizer": ("NPK 25:50:25 kg/ha + gypsum 500 kg/ha at flowering",
+                       "FYM 5 t/ha; Rhizobium seed treatment"),
+        "pesticide": ("Leaf miner / thrips: dimethoate 30 EC 1.7 ml/l; tikka: mancozeb 2 g/l",
+                      "Neem seed kernel extract 5%; Trichoderma seed treatment"),
+        "weedicide": ("Pendimethalin 1 kg a.i./ha pre-emergence; imazethapyr 75 g a.i./ha post-emergence",
+                      "Hand weeding at 20 and 40 days; no disturbance after pegging"),
+    },
+    "Chickpea": {
+        "temp": (8, 15, 26, 33), "humidity": (25, 35, 60, 80), "wind": (8, 15), "soil": (0.08, 0.14, 0.30, 0.40),
+        "fertilizer": ("NPK 20:40:20 kg/ha + sulphur 20 kg/ha",
+                       "Rhizobium + PSB seed treatment; vermicompost 2.5 t/ha"),
+        "pesticide": ("Pod borer: emamectin benzoate 5 SG 0.4 g/l or indoxacarb 14.5 SC 1 ml/l",
+                      "HaNPV 250 LE/ha; bird perches; neem seed kernel extract 5%"),
+        "weedicide": ("Pendimethalin 1 kg a.i./ha pre-emergence",
+                      "One hand weeding at 30-35 days"),
+    },
+    "Tomato": {
+        "temp": (12, 18, 28, 34), "humidity": (40, 55, 75, 90), "wind": (5, 11), "soil": (0.15, 0.22, 0.38, 0.48),
+        "fertilizer": ("NPK 120:80:60 kg/ha; calcium nitrate spray against blossom-end rot",
+                       "Vermicompost 5 t/ha; Azospirillum seedling dip"),
+        "pesticide": ("Fruit borer: spinosad 45 SC 0.3 ml/l; early blight: mancozeb 75 WP 2.5 g/l",
+                      "Marigold trap crop; neem oil 3%; Trichoderma soil application"),
+        "weedicide": ("Metribuzin 70 WP 0.5 kg a.i./ha pre-transplant",
+                      "Plastic or straw mulch; hand weeding"),
+    },
+    "Potato": {
+        "temp": (6, 14, 22, 28), "humidity": (50, 60, 85, 95), "wind": (7, 14), "soil": (0.15, 0.22, 0.38, 0.48),
+        "fertilizer": ("NPK 150:100:100 kg/ha; half N at earthing up",
+                       "FYM 20 t/ha; PSB"),
+        "pesticide": ("Late blight: mancozeb 0.25% preventive, metalaxyl + mancozeb 0.25% on appearance; aphids: imidacloprid 0.03%",
+                      "Certified seed tubers; haulm cutting before harvest; neem oil for aphids"),
+        "weedicide": ("Metribuzin 0.5 kg a.i./ha pre-emergence",
+                      "Earthing up at 25-30 days"),
+    },
+    "Pearl millet": {
+        "temp": (18, 25, 35, 42), "humidity": (20, 30, 60, 80), "wind": (9, 18), "soil": (0.05, 0.10, 0.28, 0.38),
+        "fertilizer": ("NPK 60:30:30 kg/ha",
+                       "FYM 5 t/ha; Azospirillum seed treatment"),
+        "pesticide": ("Shoot fly: thiamethoxam 30 FS seed treatment 3 g/kg; downy mildew: metalaxyl seed treatment",
+                      "Resistant hybrids; neem seed kernel extract 5%"),
+        "weedicide": ("Atrazine 0.5 kg a.i./ha pre-emergence",
+                      "Inter-cultivation at 20-25 days"),
+    },
+    "Sorghum": {
+        "temp": (15, 24, 33, 40), "humidity": (25, 35, 70, 85), "wind": (9, 17), "soil": (0.06, 0.12, 0.30, 0.40),
+        "fertilizer": ("NPK 80:40:40 kg/ha",
+                       "FYM 5 t/ha; Azospirillum"),
+        "pesticide": ("Shoot fly: thiamethoxam 30 FS seed treatment; stem borer: carbofuran 3 G in the whorl",
+                      "Early sowing; fish meal traps for shoot fly"),
+        "weedicide": ("Atrazine 0.5 kg a.i./ha pre-emergence",
+                      "Intercrop with pigeon pea; hand weeding"),
+    },
+    "Mustard": {
+        "temp": (6, 12, 25, 30), "humidity": (30, 40, 70, 85), "wind": (8, 15), "soil": (0.08, 0.14, 0.30, 0.40),
+        "fertilizer": ("NPK 80:40:40 kg/ha + sulphur 40 kg/ha",
+                       "Vermicompost 2.5 t/ha; Azotobacter"),
+        "pesticide": ("Aphids: imidacloprid 17.8 SL 0.25 ml/l; white rust: mancozeb 0.2%",
+                      "Timely sowing; yellow sticky traps; neem oil 3%"),
+        "weedicide": ("Pendimethalin 1 kg a.i./ha pre-emergence",
+                      "Hand weeding and thinning at 20-25 days"),
+    },
+    "Onion": {
+        "temp": (10, 15, 25, 32), "humidity": (35, 45, 70, 85), "wind": (7, 14), "soil": (0.12, 0.18, 0.35, 0.45),
+        "fertilizer": ("NPK 100:50:50 kg/ha + sulphur 30 kg/ha",
+                       "FYM 20 t/ha; Azospirillum and PSB"),
+        "pesticide": ("Thrips: fipronil 5 SC 1.5 ml/l; purple blotch: mancozeb 0.25%",
+                      "Maize border rows; blue sticky traps; neem oil 3%"),
+        "weedicide": ("Oxyfluorfen 23.5 EC 0.25 kg a.i./ha pre-transplant",
+                      "Hand weeding at 30 and 60 days"),
+    },
+    "Banana": {
+        "temp": (14, 22, 32, 38), "humidity": (50, 65, 90, 100), "wind": (5, 12), "soil": (0.20, 0.28, 0.45, 0.55),
+        "fertilizer": ("NPK 200:60:300 g/plant in splits",
+                       "FYM 10 kg/plant; banana trash mulch"),
+        "pesticide": ("Sigatoka: propiconazole 0.1%; pseudostem weevil: chlorpyrifos 2.5 ml/l injection",
+                      "Remove and burn infected leaves; stem traps for weevils"),
+        "weedicide": ("Glyphosate 1 kg a.i./ha directed between rows",
+                      "Cover crop of cowpea; mulching"),
+    },
+}
+
+CROP_NAMES = tuple(CROPS)
+# (crops, 4) bounds of every factor: columns min, optimum low, optimum high, max
+_BOUNDS = np.array([[CROPS[name]["temp"] for name in CROP_NAMES],
+                    [CROPS[name]["humidity"] for name in CROP_NAMES],
+                    [(-1e9, -1e9) + CROPS[name]["wind"] for name in CROP_NAMES],
+                    [CROPS[name]["soil"] for name in CROP_NAMES]], dtype=np.float64)  # (factors, crops, 4)
+
+@dataclass(frozen=True)
+class CropScore:
+    __slots__ = ("crop", "score", "limiting")
+    crop: str
+    score: float
+    limiting: str  # e.g. "temperature too high", None when every known factor is optimal
+
+def memberships(temp, humidity, wind_speed, soil_moisture):
+    """(locations, crops, factors) suitability of every factor, 0..1; NaN readings count as 1 (left out of the score)"""
+    readings = np.stack(np.broadcast_arrays(*(np.atleast_1d(np.asarray(value, dtype=np.float64))
+                                              for value in (temp, humidity, wind_speed, soil_moisture))), axis=-1)
+    x = readings[:, None, :]                      # (locations, 1, factors)
+    low, opt_low, opt_high, high = (_BOUNDS[:, :, column].T[None] for column in range(4))  # (1, crops, factors)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rising = np.where(opt_low > low, (x - low) / (opt_low - low), np.where(x >= opt_low, 1.0, 0.0))
+        falling = (high - x) / (high - opt_high)
+    result = np.clip(np.minimum(rising, falling), 0.0, 1.0)
+    return np.where(np.isnan(x), 1.0, result)
+
+def score(temp, humidity, wind_speed, soil_moisture):
+    """(locations, crops) weighted product of the factor memberships"""
+    return np.prod(memberships(temp, humidity, wind_speed, soil_moisture) ** WEIGHTS, axis=-1)
+
+def _missing_required(temp, humidity):
+    """Locations without one of the readings a ranking needs"""
+    return np.isnan(np.atleast_1d(np.asarray(temp, dtype=np.float64))) | np.isnan(np.atleast_1d(np.asarray(humidity, dtype=np.float64)))
+
+def rank_many(temp, humidity, wind_speed, soil_moisture, top=CROP_TOP):
+    """Top crops of many locations at once: (indices into CROP_NAMES, scores), each (locations, top).
+
+    Scores are NaN for locations without a temperature or humidity reading.
+    """
+    scores = score(temp, humidity, wind_speed, soil_moisture)
+    top = min(top, scores.shape[1])
+    # Ties go to the crop listed first, as in rank()
+    keys = scores - np.arange(scores.shape[1]) * 1e-9
+    # argpartition keeps this linear in the number of crops; only the top few are sorted
+    best = np.argpartition(-keys, top - 1, axis=1)[:, :top]
+    order = np.argsort(-np.take_along_axis(keys, best, axis=1), axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    missing = np.broadcast_to(_missing_required(temp, humidity), (scores.shape[0],))
+    return best, np.where(missing[:, None], np.nan, np.take_along_axis(scores, best, axis=1))
+
+def rank(temp, humidity, wind_speed, soil_moisture, top=CROP_TOP, min_score=CROP_MIN_SCORE):
+    """[CropScore] of one location, best first, without crops below min_score.
+
+    Empty without a temperature or humidity reading.
+    """
+    if _missing_required(temp, humidity)[0]:
+        return []
+    factors = memberships(temp, humidity, wind_speed, soil_moisture)[0]
+    scores = np.prod(factors ** WEIGHTS, axis=-1)
+    readings = (temp, humidity, wind_speed, soil_moisture)
+    known = ~np.isnan(np.array(readings, dtype=np.float64))
+    results = []
+    for crop in np.argsort(-scores, kind="stable")[:top]:
+        if scores[crop] < min_score:
+            break
+        # Only measured factors can limit a crop
+        weakest = int(np.argmin(np.where(known, factors[crop], np.inf)))
+        limiting = None
+        if factors[crop, weakest] < 1:
+            too = "high" if readings[weakest] > _BOUNDS[weakest, crop, 2] else "low"
+            limiting = f"{FACTORS[weakest]} too {too}"
+        results.append(CropScore(CROP_NAMES[crop], round(float(scores[crop]), 2), limiting))
+    return results
+
+def _reading(value):
+    return np.nan if value in (None, "N/A") else float(value)
+
+def advisories(temp, humidity, wind_speed, soil_moisture):
+    """Condition-driven precautions for applying inputs"""
+    notes = []
+    if not np.isnan(wind_speed) and wind_speed > 4:
+        notes.append(f"Wind {wind_speed:g} m/s: postpone spraying (drift) until it drops below 4 m/s")
+    if not np.isnan(humidity) and humidity >= 80:
+        notes.append(f"Humidity {humidity:g}%: high fungal disease risk, prefer preventive fungicide sprays")
+    if not np.isnan(temp) and temp >= 35:
+        notes.append(f"Temperature {temp:g}°C: spray only early morning or evening")
+    if not np.isnan(soil_moisture):
+        if soil_moisture < 0.12:
+            notes.append(f"Soil moisture {soil_moisture:g} m³/m³: irrigate before fertilizer top-dressing")
+        elif soil_moisture > 0.45:
+            notes.append(f"Soil moisture {soil_moisture:g} m³/m³: delay fertilizer application to avoid leaching")
+    return notes
+
+def recommend(weather_data, top=CROP_TOP):
+    """Crop ranking for a summarize_conditions result.
+
+    Returns {"crops": [{crop, score, limiting}], "crop_facts": text for the prompt,
+    "crop_inputs": the markdown Agricultural Inputs section}.
+    """
+    readings = tuple(_reading(weather_data.get(field)) for field in ("temp", "humidity", "wind_speed", "soil_moisture_value"))
+    unknown = [factor for factor, value in zip(FACTORS, readings) if np.isnan(value)]
+    crops = rank(*readings, top=top)
+    if set(unknown) & set(FACTORS[:REQUIRED_FACTORS]):
+        lines = [f"- No ranking: the {' and '.join(unknown)} reading is unavailable, so no crop can be recommended"]
+    elif crops:
+        suffix = f"; {', '.join(unknown)} unknown" if unknown else ""
+        lines = [f"- {crop.crop}: suitability {crop.score:.0%}"
+                 + (f" (limited by {crop.limiting}{suffix})" if crop.limiting
+                    else f" (known factors optimal{suffix})" if unknown else " (all factors optimal)")
+                 for crop in crops]
+    else:
+        lines = ["- No crop in the local table suits the current conditions"]
+    notes = advisories(*readings)
+    lines.extend(f"- Precaution: {note}" for note in notes)
+    names = [crop.crop for crop in crops]
+    return {"crops": [asdict(crop) for crop in crops], "crop_facts": "\n".join(lines), "crop_inputs": inputs_section(names, notes)}
+
+def inputs_section(names, notes=()):
+    """Agricultural inputs of the named crops as a markdown section with a plaintext block"""
+    if not names:
+        return ""
+    blocks = []
+    for title, key in (("PESTICIDES", "pesticide"), ("FERTILIZERS", "fertilizer"), ("WEEDICIDES", "weedicide")):
+        chemical = "\n".join(f"  • {name}: {CROPS[name][key][0]}" for name in names)
+        natural = "\n".join(f"  • {name}: {CROPS[name][key][1]}" for name in names)
+        blocks.append(f"{title}:\nChemical Options:\n{chemical}\n\nNatural Alternatives:\n{natural}")
+    section = "#### 🧪 Agricultural Inputs\n\n```plaintext\n" + "\n\n".join(blocks) + "\n```\n"
+    if notes:
+        section += "\n" + "\n".join(f"- ⚠️ {note}" for note in notes) + "\n"
+    return section + "\n*Rates are typical label values; follow the product label and local extension advice.*"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank crops for every record of a batch.py output file.")
+    parser.add_argument("results", help="JSONL written by batch.py")
+    parser.add_argument("--top", type=int, default=CROP_TOP)
+    args = parser.parse_args(argv)
+
+    ids, readings = [], []
+    with open(args.results, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            weather = record.get("weather") or {}
+            soil = record.get("soil") or {}
+            ids.append(record.get("id"))
+            readings.append([_reading(weather.get("temp")), _reading(weather.get("humidity")),
+                             _reading(weather.get("wind_speed")), _reading(soil.get("moisture"))])
+    if not ids:
+        return
+    readings = np.array(readings)
+    best, scores = rank_many(*readings.T, top=args.top)
+    for record_id, crops, values in zip(ids, best, scores):
+        ranked = [{"crop": CROP_NAMES[crop], "score": round(float(value), 2)}
+                  for crop, value in zip(crops, values) if value >= CROP_MIN_SCORE]
+        print(json.dumps({"id": record_id, "crops": ranked}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import argparse, hashlib, mmap, os, re, sys, threading, unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+import numpy as np
+
+# Local gazetteer: towns and districts from a GeoNames dump (e.g. cities15000.txt or
+# IN.txt from https://download.geonames.org/export/dump/) in a compact on-disk index
+# that is memory-mapped, so opening it is instant and only touched pages are read.
+#
+#   places.npy        lat, lon, population and country of every place
+#   labels.bin        "Pune, Maharashtra, India" display labels (+ label_offsets.npy)
+#   hashes.npy        sorted 64-bit hashes of every normalized name and alternate name,
+#   hash_places.npy   with the place each one refers to (exact lookups by binary search)
+#   names.bin         sorted unique normalized names (+ name_offsets.npy) for prefix
+#   name_places.npy   search; the places of names[i] are name_places[name_starts[i]:
+#   name_starts.npy   name_starts[i + 1]], so a prefix range maps to one slice
+#
+#   python gazetteer.py build cities15000.txt --admin1 admin1CodesASCII.txt --countries countryInfo.txt
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "gazetteer"))
+# A name shared by several places resolves locally only if the most populous one is
+# this many times larger than the runner-up; otherwise Google decides
+GAZETTEER_AMBIGUITY_RATIO = float(os.getenv("GAZETTEER_AMBIGUITY_RATIO", "5"))
+
+PLACE_DTYPE = np.dtype([("lat", "<f4"), ("lon", "<f4"), ("population", "<u4"), ("country", "S2")])
+
+def normalize_name(name):
+    """Lowercase, strip accents and punctuation: "São Paulo" -> "sao paulo" """
+    name = unicodedata.normalize("NFKD", name.lower())
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return re.sub(r"[\W_]+", " ", name).strip()
+
+def name_hash(normalized):
+    """Stable 64-bit hash of a normalized name (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+@dataclass(frozen=True)
+class GazetteerMatch:
+    __slots__ = ("latitude", "longitude", "label", "population", "ambiguous")
+    latitude: float
+    longitude: float
+    label: str
+    population: int
+    ambiguous: bool
+
+    @property
+    def coordinates(self):
+        return self.latitude, self.longitude
+
+class _Strings:
+    """Read-only sequence over a memory-mapped blob of strings with an offsets array"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.blob[int(self.offsets[index]):int(self.offsets[index + 1])]
+
+class Gazetteer:
+    def __init__(self, path):
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.places = load("places.npy")
+        self.hashes = load("hashes.npy")
+        self.hash_places = load("hash_places.npy")
+        self.name_places = load("name_places.npy")
+        self.name_starts = load("name_starts.npy")
+        self._files = []
+        self.labels = _Strings(self._map("labels.bin"), load("label_offsets.npy"))
+        self.names = _Strings(self._map("names.bin"), load("name_offsets.npy"))
+
+    def _map(self, name):
+        f = open(os.path.join(self.path, name), "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.places)
+
+    def label(self, place):
+        return self.labels[place].decode("utf-8")
+
+    def coordinates(self, place):
+        # Stored as float32; five decimals (about a metre) is all they carry
+        return round(float(self.places[place]["lat"]), 5), round(float(self.places[place]["lon"]), 5)
+
+    def candidates(self, name):
+        """Indices of the places called name (already normalized)"""
+        key = np.uint64(name_hash(name))
+        start = np.searchsorted(self.hashes, key, "left")
+        end = np.searchsorted(self.hashes, key, "right")
+        return np.unique(self.hash_places[start:end])
+
+    def _qualifies(self, place, qualifier):
+        """True if a qualifier ("maharashtra", "india", "in") matches the place's label or country"""
+        if qualifier == self.places[place]["country"].decode("ascii").lower():
+            return True
+        return qualifier in (normalize_name(part) for part in self.label(place).split(",")[1:])
+
+    def resolve(self, address):
+        """Best local match for an address like "Pune" or "Pune, Maharashtra, India", or None"""
+        parts = [normalize_name(part) for part in address.split(",")]
+        parts = [part for part in parts if part]
+        if not parts:
+            return None
+        candidates = [int(place) for place in self.candidates(parts[0])]
+        for qualifier in parts[1:]:
+            candidates = [place for place in candidates if self._qualifies(place, qualifier)]
+        if not candidates:
+            return None
+
+        candidates.sort(key=lambda place: int(self.places[place]["population"]), reverse=True)
+        best = self.places[candidates[0]]
+        ambiguous = len(candidates) > 1 and \
+            int(best["population"]) < GAZETTEER_AMBIGUITY_RATIO * max(int(self.places[candidates[1]]["population"]), 1)
+        return GazetteerMatch(*self.coordinates(candidates[0]), self.label(candidates[0]),
+                              int(best["population"]), ambiguous)
+
+    def prefix(self, prefix, limit=10):
+        """(label, lat, lon) of places whose normalized name starts with prefix, most populous first"""
+        prefix = normalize_name(prefix).encode("utf-8")
+        if not prefix:
+            return []
+        # Names sharing the prefix sit between prefix and prefix with its last byte
+        # incremented (0xff never occurs in UTF-8)
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix[:-1] + bytes([prefix[-1] + 1]), start)
+        places = np.unique(self.name_places[self.name_starts[start]:self.name_starts[end]])
+        if len(places) > limit:
+            population = self.places["population"][places]
+            places = places[np.argpartition(population, -limit)[-limit:]]
+        places = sorted((int(place) for place in places), key=lambda place: int(self.places[place]["population"]), reverse=True)
+        return [(self.label(place), *self.coordinates(place)) for place in places]
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+_gazetteer = None
+_opened = False
+_lock = threading.Lock()
+
+def get_gazetteer():
+    """The gazetteer at GAZETTEER_PATH, opened on first use; None when no index was built"""
+    global _gazetteer, _opened
+    if not _opened:
+        with _lock:
+            if not _opened:
+                if GAZETTEER_PATH and os.path.exists(os.path.join(GAZETTEER_PATH, "places.npy")):
+                    _gazetteer = Gazetteer(GAZETTEER_PATH)
+                _opened = True
+    return _gazetteer
+
+def resolve(address):
+    """GazetteerMatch for address from the local index, or None (no index or no match)"""
+    gazetteer = get_gazetteer()
+    return gazetteer.resolve(address) if gazetteer is not None else None
+
+def _read_codes(path, key_column, value_column):
+    codes = {}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) > max(key_column, value_column):
+                    codes[fields[key_column]] = fields[value_column]
+    return codes
+
+def build(source, path, admin1=None, countries=None, min_population=0, alternates=True):
+    """Build the index at path from a GeoNames dump; returns the number of places"""
+    admin1_names = _read_codes(admin1, 0, 1)      # admin1CodesASCII.txt: "IN.16" -> "Maharashtra"
+    country_names = _read_codes(countries, 0, 4)  # countryInfo.txt: "IN" -> "India"
+
+    places, labels, names = [], [], {}
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            # Populated places (P) and administrative areas such as districts (A)
+            if len(fields) < 15 or fields[6] not in ("P", "A"):
+                continue
+            population = int(fields[14] or 0)
+            if population < min_population:
+                continue
+            country = fields[8]
+            index = len(places)
+            places.append((float(fields[4]), float(fields[5]), min(population, 2**32 - 1), country.encode("ascii")[:2]))
+            admin = admin1_names.get(f"{country}.{fields[10]}")
+            labels.append(", ".join(part for part in (fields[1], admin, country_names.get(country, country)) if part))
+            variants = {fields[1], fields[2]}
+            if alternates and fields[3]:
+                variants.update(name for name in fields[3].split(",") if len(name) <= 60)
+            for variant in variants:
+                normalized = normalize_name(variant)
+                if normalized:
+                    names.setdefault(normalized, set()).add(index)
+
+    os.makedirs(path, exist_ok=True)
+    places = np.array(places, dtype=PLACE_DTYPE)
+    np.save(os.path.join(path, "places.npy"), places)
+    _save_strings(path, "labels.bin", "label_offsets.npy", labels)
+
+    pairs = sorted((name_hash(name), place) for name, indices in names.items() for place in indices)
+    np.save(os.path.join(path, "hashes.npy"), np.array([pair[0] for pair in pairs], dtype="<u8"))
+    np.save(os.path.join(path, "hash_places.npy"), np.array([pair[1] for pair in pairs], dtype="<u4"))
+
+    # Sorted by UTF-8 bytes, the order bisect sees when searching the memory-mapped blob
+    sorted_names = sorted(names, key=lambda name: name.encode("utf-8"))
+    _save_strings(path, "names.bin", "name_offsets.npy", sorted_names)
+    np.save(os.path.join(path, "name_places.npy"),
+            np.array([place for name in sorted_names for place in sorted(names[name])], dtype="<u4"))
+    starts = np.zeros(len(sorted_names) + 1, dtype="<u8")
+    starts[1:] = np.cumsum([len(names[name]) for name in sorted_names])
+    np.save(os.path.join(path, "name_starts.npy"), starts)
+    return len(places)
+
+def _save_strings(path, blob_name, offsets_name, strings):
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    with open(os.path.join(path, blob_name), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(path, offsets_name), offsets)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local gazetteer index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build the index from a GeoNames dump")
+    build_parser.add_argument("source", help="GeoNames dump, e.g. cities15000.txt or IN.txt")
+    build_parser.add_argument("--output", default=GAZETTEER_PATH, help="index directory (default: GAZETTEER_PATH)")
+    build_parser.add_argument("--admin1", help="admin1CodesASCII.txt, for state / province names in labels")
+    build_parser.add_argument("--countries", help="countryInfo.txt, for country names in labels")
+    build_parser.add_argument("--min-population", type=int, default=0)
+    build_parser.add_argument("--no-alternates", action="store_true", help="index only the main and ASCII names")
+    query_parser = commands.add_parser("query", help="resolve an address or list prefix matches")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--prefix", action="store_true", help="list places starting with text")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build(args.source, args.output, args.admin1, args.countries, args.min_population, not args.no_alternates)
+        print(f"Indexed {count} places in {args.output}", file=sys.stderr)
+        return
+    gazetteer = get_gazetteer()
+    if gazetteer is None:
+        sys.exit(f"No gazetteer index at {GAZETTEER_PATH}; run 'python gazetteer.py build' first")
+    if args.prefix:
+        for label, latitude, longitude in gazetteer.prefix(args.text):
+            print(f"{label}\t{latitude:.4f}, {longitude:.4f}")
+    else:
+        print(gazetteer.resolve(args.text))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os, re
+
+# Token-budgeted chat history for the analysis prompt. The newest turns are passed
+# verbatim; older turns are compacted into one message of key facts (location,
+# conditions, recommended crops) so the prompt stays under the budget however long
+# the session gets. Token counts are estimated from character length. An AI message
+# may carry its fact line in response_metadata["facts"] (SessionHistory computes it
+# once per analysis); otherwise the report is parsed again.
+
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+
+def estimate_tokens(text):
+    """Rough token count for text (about four characters per token for English)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+_FACT_FIELDS = ("Description", "Temperature", "Humidity", "Wind Speed", "Soil Moisture")
+
+def report_facts(report):
+    """One line of key facts from an analysis report"""
+    facts = []
+    heading = re.search(r"Weather Analysis for (.+)", report)
+    if heading:
+        facts.append(heading.group(1).strip(" *#"))
+    for field in _FACT_FIELDS:
+        match = re.search(rf"\*\*{field}:\*\*\s*([^\n]+)", report)
+        if match:
+            facts.append(f"{field.lower()} {match.group(1).strip()}")
+    crops = re.search(r"Crop Recommendations(.*?)(?:\n#|\Z)", report, re.S)
+    if crops:
+        names = re.findall(r"^\s*(?:[-*•]|\d+\.)\s*\**([^:*\n]{2,40})", crops.group(1), re.M)
+        if names:
+            facts.append("crops " + ", ".join(name.strip() for name in names[:6]))
+    return "; ".join(facts) if facts else report[:200].replace("\n", " ")
+
+def _facts(message):
+    facts = getattr(message, "response_metadata", {}).get("facts")
+    return facts if facts is not None else report_facts(message.content)
+
+def _turns(messages):
+    """Group messages into [human, ai] turns"""
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+class HistoryWindow:
+    def __init__(self, budget_tokens=2000, recent_turns=1, summary_share=0.25):
+        self.budget_tokens = budget_tokens
+        self.recent_turns = recent_turns
+        # Part of the budget kept free for the summary of older turns
+        self.summary_share = summary_share
+
+    def select(self, messages):
+        """Return (messages for the prompt, usage dict)"""
+        messages = list(messages)
+        turns = _turns(messages)
+        budget = self.budget_tokens
+
+        # Newest turns verbatim while they fit
+        verbatim = []
+        used = 0
+        verbatim_budget = budget if len(turns) <= self.recent_turns else budget * (1 - self.summary_share)
+        for turn in reversed(turns):
+            if len(verbatim) >= self.recent_turns:
+                break
+            tokens = sum(estimate_tokens(message.content) for message in turn)
+            if used + tokens > verbatim_budget:
+                break
+            verbatim.insert(0, turn)
+            used += tokens
+
+        # Older turns as fact lines, newest first until the budget is spent
+        older = turns[:len(turns) - len(verbatim)]
+        lines = []
+        for turn in reversed(older):
+            ai = [message for message in turn if message.type == "ai"]
+            human = [message.content for message in turn if message.type == "human"]
+            line = "- " + (_facts(ai[-1]) if ai else human[0][:200])
+            tokens = estimate_tokens(line)
+            if used + tokens > budget:
+                break
+            lines.insert(0, line)
+            used += tokens
+
+        selected = []
+        if lines:
+            from langchain_core.messages import AIMessage
+
+            selected.append(AIMessage(content="Summary of earlier analyses in this conversation:\n" + "\n".join(lines)))
+        for turn in verbatim:
+            selected.extend(turn)
+
+        usage = {
+            "history_tokens": sum(estimate_tokens(message.content) for message in selected),
+            "full_history_tokens": sum(estimate_tokens(message.content) for message in messages),
+            "verbatim_turns": len(verbatim),
+            "summarized_turns": len(lines),
+            "dropped_turns": len(older) - len(lines),
+        }
+        return selected, usage
@@ -0,0 +1,144 @@
+import asyncio, os, random, threading, time, weakref
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import ratelimit
+
+# Shared HTTP layer for every upstream call: one pooled keep-alive session per host,
+# connect/read timeouts and bounded retries with jittered exponential backoff.
+# Retries happen in get()/aget() rather than inside the connection pool, so every
+# attempt of a call made for a rate-limited provider (see ratelimit.py) waits for a
+# request slot first; 429 answers slow the provider's bucket down instead of being
+# retried blindly.
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+# Upper bound (seconds) on a Retry-After wait, so an upstream asking for an hour
+# cannot hold a worker that long on every attempt
+MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "30"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_lock = threading.Lock()
+# Async clients (one per host) are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_session(url):
+    """Return the pooled session for the host of url, creating it on first use"""
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount(host, adapter)
+                _sessions[host] = session
+    return session
+
+def get(url, params=None, timeout=None, provider=None, **kwargs):
+    """GET through the shared pool with the default (connect, read) timeouts.
+
+    provider names the rate limit bucket the call counts against (e.g. "openweather").
+    """
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    limiter = ratelimit.get_limiter(provider)
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = get_session(url).get(url, params=params, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(retry_delay(attempt))
+            continue
+        if limiter is not None:
+            if response.status_code == 429:
+                limiter.throttle(retry_delay(attempt, response))
+            else:
+                limiter.succeed()
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+        # With a limiter the throttle pause already holds back every caller of the provider
+        if limiter is None or response.status_code != 429:
+            time.sleep(retry_delay(attempt, response))
+    return response
+
+def get_async_client(url):
+    """Return the pooled httpx.AsyncClient for the host of url on the running event loop"""
+    import httpx
+
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(host)
+    if client is None:
+        # Bounded like the sync pools; httpcore's pool bookkeeping grows with every open connection
+        client = clients[host] = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+    return client
+
+def retry_delay(attempt, response=None):
+    """Seconds to wait before retry number attempt: Retry-After (at most MAX_RETRY_AFTER) if given, else jittered backoff"""
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            delay = None
+        if delay is not None and delay == delay:  # NaN falls back to the backoff
+            return min(max(0.0, delay), MAX_RETRY_AFTER)
+    return BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, BACKOFF_JITTER)
+
+async def aget(url, params=None, timeout=None, provider=None, **kwargs):
+    """Async GET with the same timeouts, retry policy and rate limiting as get()"""
+    import httpx
+
+    client = get_async_client(url)
+    limiter = ratelimit.get_limiter(provider)
+    if timeout is not None and not isinstance(timeout, tuple):
+        kwargs["timeout"] = timeout
+    elif timeout is not None:
+        kwargs["timeout"] = httpx.Timeout(timeout[1], connect=timeout[0])
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            await limiter.aacquire()
+        try:
+            response = await client.get(url, params=params, **kwargs)
+        except httpx.TransportError:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
+            continue
+        if limiter is not None:
+            if response.status_code == 429:
+                limiter.throttle(retry_delay(attempt, response))
+            else:
+                limiter.succeed()
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+        if limiter is None or response.status_code != 429:
+            await asyncio.sleep(retry_delay(attempt, response))
+    return response
+
+async def aclose():
+    """Close the async clients of the running event loop"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+def close():
+    """Close all pooled connections"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,279 @@
+import json, os, threading, time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-stage latency histograms and counters for the fetch / analysis pipeline,
+# exported as Prometheus text or JSON. Cache and single-flight statistics are read
+# from the registered objects at export time, so they cost nothing per request.
+# With METRICS_ENABLED=false every recording call returns immediately.
+#
+#   METRICS_PORT=9464      serve /metrics (Prometheus) and /metrics.json
+#   METRICS_FILE=metrics.prom   rewrite the file every METRICS_FILE_INTERVAL seconds (.json for JSON)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+METRICS_PREFIX = "weather_app"
+# Histogram upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_DESCRIPTIONS = {
+    "stage_seconds": "Latency of one pipeline stage",
+    "stage_errors_total": "Failed pipeline stages",
+    "llm_first_token_seconds": "Time until the first streamed chunk of an analysis",
+    "llm_tokens_total": "Estimated LLM tokens (prompt and completion)",
+}
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last slot is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile from the bucket counts (linear inside the bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> Histogram
+_counters = {}    # (name, labels) -> value
+_caches = {}      # name -> object with stats()
+_flights = []
+_started = time.time()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    """Add one observation to a histogram"""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def inc(name, amount=1, **labels):
+    """Increase a counter"""
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def record_timings(timings, errors=None):
+    """Record a {stage: seconds} dict, plus the stages that failed"""
+    if not METRICS_ENABLED:
+        return
+    for stage, seconds in timings.items():
+        observe("stage_seconds", seconds, stage=stage)
+    for stage in errors or ():
+        inc("stage_errors_total", stage=stage)
+
+class span:
+    """Time a block as one pipeline stage; the duration is kept in .elapsed"""
+    __slots__ = ("stage", "start", "elapsed")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        if METRICS_ENABLED:
+            observe("stage_seconds", self.elapsed, stage=self.stage)
+            if exc_type is not None:
+                inc("stage_errors_total", stage=self.stage)
+        return False
+
+def register_cache(name, cache):
+    """Export cache.stats() under the given cache name"""
+    _caches[name] = cache
+
+def register_singleflight(flights):
+    """Export the executed / coalesced counts of a SingleFlight"""
+    _flights.append(flights)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def snapshot():
+    """All metrics as a JSON-serialisable dict"""
+    with _lock:
+        histograms = [(name, dict(labels), histogram.summary()) for (name, labels), histogram in _histograms.items()]
+        counters = [(name, dict(labels), value) for (name, labels), value in _counters.items()]
+    result = {"enabled": METRICS_ENABLED, "uptime_seconds": time.time() - _started, "histograms": {}, "counters": {}}
+    for name, labels, summary in sorted(histograms, key=lambda item: (item[0], sorted(item[1].items()))):
+        result["histograms"].setdefault(name, []).append({"labels": labels, **summary})
+    for name, labels, value in sorted(counters, key=lambda item: (item[0], sorted(item[1].items()))):
+        result["counters"].setdefault(name, []).append({"labels": labels, "value": value})
+    result["caches"] = {name: cache.stats() for name, cache in sorted(_caches.items())}
+    singleflight = {}
+    for flights in _flights:
+        singleflight.update(flights.stats())
+    result["singleflight"] = singleflight
+    return result
+
+def stage_summary(data=None):
+    """{stage: {count, errors, mean, p50, p95, p99, sum}} for the diagnostics panel"""
+    data = data or snapshot()
+    errors = {entry["labels"].get("stage"): entry["value"] for entry in data["counters"].get("stage_errors_total", [])}
+    stages = {}
+    for entry in data["histograms"].get("stage_seconds", []):
+        stage = entry["labels"].get("stage")
+        stages[stage] = {key: value for key, value in entry.items() if key != "labels"}
+        stages[stage]["errors"] = errors.get(stage, 0)
+    return stages
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels)
+    return "{" + pairs + "}"
+
+def _header(lines, name, kind, description):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in _histograms.items())
+        counters = sorted(_counters.items())
+    lines = []
+    seen = set()
+    for (name, labels), counts, total, count in histograms:
+        metric = f"{METRICS_PREFIX}_{name}"
+        if metric not in seen:
+            seen.add(metric)
+            _header(lines, metric, "histogram", _DESCRIPTIONS.get(name, name))
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += bucket
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{metric}_sum{_labels(labels)} {total}")
+        lines.append(f"{metric}_count{_labels(labels)} {count}")
+    for (name, labels), value in counters:
+        metric = f"{METRICS_PREFIX}_{name}"
+        if metric not in seen:
+            seen.add(metric)
+            _header(lines, metric, "counter", _DESCRIPTIONS.get(name, name))
+        lines.append(f"{metric}{_labels(labels)} {value}")
+
+    if _caches:
+        events = f"{METRICS_PREFIX}_cache_events_total"
+        entries = f"{METRICS_PREFIX}_cache_entries"
+        _header(lines, events, "counter", "Cache lookups by outcome")
+        cache_entries = []
+        for name, cache in sorted(_caches.items()):
+            stats = cache.stats()
+            for event in ("hits", "stale_hits", "disk_hits", "negative_hits", "misses", "refresh_errors"):
+                if event in stats:
+                    lines.append(f"{events}{_labels((('cache', name), ('event', event)))} {stats[event]}")
+            cache_entries.append((name, stats.get("entries", stats.get("memory_entries", 0))))
+        _header(lines, entries, "gauge", "Entries held in memory")
+        for name, count in cache_entries:
+            lines.append(f"{entries}{_labels((('cache', name),))} {count}")
+
+    if _flights:
+        calls = f"{METRICS_PREFIX}_singleflight_calls_total"
+        _header(lines, calls, "counter", "Upstream calls executed or coalesced into an in-flight call")
+        for flights in _flights:
+            for upstream, stats in flights.stats().items():
+                for outcome, value in stats.items():
+                    lines.append(f"{calls}{_labels((('upstream', upstream), ('outcome', outcome)))} {value}")
+    return "\n".join(lines) + "\n"
+
+def write(path):
+    """Write the metrics to path (JSON for *.json, Prometheus text otherwise)"""
+    body = json.dumps(snapshot(), indent=2) if path.endswith(".json") else prometheus()
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(temporary, path)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body, content_type = prometheus(), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics and /metrics.json from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def _write_periodically(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write(path)
+        except OSError:
+            pass
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+def start_exporter():
+    """Start the exporters configured by METRICS_PORT / METRICS_FILE (once per process)"""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started or not METRICS_ENABLED:
+            return
+        _exporter_started = True
+    port = os.getenv("METRICS_PORT")
+    if port:
+        serve(int(port), os.getenv("METRICS_HOST", "127.0.0.1"))
+    path = os.getenv("METRICS_FILE")
+    if path:
+        interval = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+        threading.Thread(target=_write_periodically, args=(path, interval), name="metrics-file", daemon=True).start()
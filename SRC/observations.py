@@ -0,0 +1,354 @@
+import argparse, atexit, os, sqlite3, sys, threading, time
+import numpy as np
+import metrics
+
+# Local history of every weather and soil reading the fetchers receive, in a SQLite
+# file keyed by grid cell and time (WITHOUT ROWID tables clustered on
+# (cell_lat, cell_lon, time), so a range query for one cell reads contiguous pages).
+#
+#   weather          one row per OpenWeather reading
+#   weather_latest   the newest reading of every cell (latest-per-location queries)
+#   soil             hourly Open-Meteo soil moisture, one column per layer; a refetch
+#                    overwrites the overlapping hours with the newer values
+#   soil_latest      when each cell was last fetched and which hours that fetch covered
+#
+# Writes are buffered and flushed in bulk by a background thread, so recording a
+# reading never waits for the disk. Reads use a connection per thread and only see
+# flushed readings (at most OBSERVATION_FLUSH_INTERVAL old); thanks to WAL they
+# never wait for the writer or maintenance. Readings older than OBSERVATION_RETENTION_DAYS are
+# dropped, and weather readings older than OBSERVATION_COMPACT_AFTER_DAYS are thinned
+# to the last one per hour.
+#
+#   python observations.py history 18.52 73.85 --days 3
+#   python observations.py maintain
+
+OBSERVATION_STORE_PATH = os.getenv("OBSERVATION_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "observations.sqlite"))
+OBSERVATION_RETENTION_DAYS = float(os.getenv("OBSERVATION_RETENTION_DAYS", "90"))
+OBSERVATION_COMPACT_AFTER_DAYS = float(os.getenv("OBSERVATION_COMPACT_AFTER_DAYS", "7"))
+# Seconds between background flushes; a flush also happens once this many rows are pending
+OBSERVATION_FLUSH_INTERVAL = float(os.getenv("OBSERVATION_FLUSH_INTERVAL", "1"))
+OBSERVATION_FLUSH_ROWS = int(os.getenv("OBSERVATION_FLUSH_ROWS", "1000"))
+# Retention and compaction run at most this often (seconds) from the flush thread
+MAINTENANCE_INTERVAL = 6 * 3600
+
+WEATHER_FIELDS = ("description", "temp", "feels_like", "humidity", "wind_speed")
+# Soil moisture layers per row, shallowest first (the order of weather.SOIL_DEPTHS)
+SOIL_LAYERS = 5
+_SOIL_COLUMNS = tuple(f"m{layer}" for layer in range(SOIL_LAYERS))
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS weather (
+    cell_lat REAL NOT NULL, cell_lon REAL NOT NULL, observed_at REAL NOT NULL,
+    description TEXT, temp REAL, feels_like REAL, humidity INTEGER, wind_speed REAL,
+    PRIMARY KEY (cell_lat, cell_lon, observed_at)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS weather_observed_at ON weather (observed_at);
+CREATE TABLE IF NOT EXISTS weather_latest (
+    cell_lat REAL NOT NULL, cell_lon REAL NOT NULL, observed_at REAL NOT NULL,
+    description TEXT, temp REAL, feels_like REAL, humidity INTEGER, wind_speed REAL,
+    PRIMARY KEY (cell_lat, cell_lon)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS soil (
+    cell_lat REAL NOT NULL, cell_lon REAL NOT NULL, time INTEGER NOT NULL,
+    {", ".join(f"{column} REAL" for column in _SOIL_COLUMNS)}, fetched_at REAL NOT NULL,
+    PRIMARY KEY (cell_lat, cell_lon, time)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS soil_time ON soil (time);
+CREATE TABLE IF NOT EXISTS soil_latest (
+    cell_lat REAL NOT NULL, cell_lon REAL NOT NULL, fetched_at REAL NOT NULL,
+    first_time INTEGER NOT NULL, last_time INTEGER NOT NULL, utc_offset INTEGER NOT NULL,
+    PRIMARY KEY (cell_lat, cell_lon)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+_COLUMNS = ", ".join(WEATHER_FIELDS)
+_INSERT_WEATHER = (f"INSERT OR REPLACE INTO weather (cell_lat, cell_lon, observed_at, {_COLUMNS}) "
+                   f"VALUES ({', '.join('?' * (3 + len(WEATHER_FIELDS)))})")
+_UPSERT_WEATHER_LATEST = (
+    _INSERT_WEATHER.replace("INSERT OR REPLACE INTO weather", "INSERT INTO weather_latest")
+    + " ON CONFLICT (cell_lat, cell_lon) DO UPDATE SET "
+    + ", ".join(f"{field} = excluded.{field}" for field in ("observed_at",) + WEATHER_FIELDS)
+    + " WHERE excluded.observed_at >= weather_latest.observed_at")
+_INSERT_SOIL = (f"INSERT OR REPLACE INTO soil (cell_lat, cell_lon, time, {', '.join(_SOIL_COLUMNS)}, fetched_at) "
+                f"VALUES ({', '.join('?' * (4 + SOIL_LAYERS))})")
+_UPSERT_SOIL_LATEST = (
+    "INSERT INTO soil_latest (cell_lat, cell_lon, fetched_at, first_time, last_time, utc_offset) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (cell_lat, cell_lon) DO UPDATE SET fetched_at = excluded.fetched_at, first_time = excluded.first_time, "
+    "last_time = excluded.last_time, utc_offset = excluded.utc_offset WHERE excluded.fetched_at >= soil_latest.fetched_at")
+
+def _nullable(value):
+    return None if value is None or value != value else float(value)  # NaN -> NULL
+
+class ObservationStore:
+    def __init__(self, path, flush_interval=OBSERVATION_FLUSH_INTERVAL, flush_rows=OBSERVATION_FLUSH_ROWS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()          # guards the write connection
+        self._pending_lock = threading.Lock()  # guards the write buffers
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Only takes effect on a new file; lets maintain() hand freed pages back to the OS
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._weather = []
+        self._soil = []
+        self._soil_latest = []
+        self._readers = threading.local()
+        self._reader_conns = []
+        self._wake = threading.Event()
+        self._writer = None
+        self._last_maintenance = time.time()
+        self.rows_written = 0
+        self.warm_hits = 0
+        self.warm_misses = 0
+
+    # -- writes ---------------------------------------------------------------
+
+    def record_weather(self, cell, fields, observed_at=None):
+        """Queue one weather reading ({WEATHER_FIELDS...}) for cell"""
+        row = (cell[0], cell[1], time.time() if observed_at is None else observed_at,
+               *(fields[field] for field in WEATHER_FIELDS))
+        with self._pending_lock:
+            self._weather.append(row)
+        self._schedule()
+
+    def record_soil(self, cell, times, values, utc_offset, fetched_at=None):
+        """Queue an hourly soil series: values has one row per layer (SOIL_LAYERS, NaN where missing)"""
+        if not len(times):
+            return
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        values = np.asarray(values, dtype=np.float64)
+        rows = [(cell[0], cell[1], int(hour), *(_nullable(value) for value in column), fetched_at)
+                for hour, column in zip(times.tolist(), values.T.tolist())]
+        with self._pending_lock:
+            self._soil.extend(rows)
+            self._soil_latest.append((cell[0], cell[1], fetched_at, int(times[0]), int(times[-1]), int(utc_offset)))
+        self._schedule()
+
+    def _schedule(self):
+        if self._writer is None:
+            with self._pending_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="observations", daemon=True)
+                    self._writer.start()
+                    atexit.register(self.flush)
+        if len(self._weather) + len(self._soil) >= self.flush_rows:
+            self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_maintenance >= MAINTENANCE_INTERVAL:
+                    self.maintain()
+            except sqlite3.Error:
+                metrics.inc("stage_errors_total", stage="observations")
+
+    def flush(self):
+        """Write the buffered readings in one transaction; returns the number of rows"""
+        # The connection lock is taken first so that batches are written in the order they were queued
+        with self._lock:
+            with self._pending_lock:
+                weather, self._weather = self._weather, []
+                soil, self._soil = self._soil, []
+                soil_latest, self._soil_latest = self._soil_latest, []
+            if not weather and not soil:
+                return 0
+            with self._conn:
+                self._conn.executemany(_INSERT_WEATHER, weather)
+                self._conn.executemany(_UPSERT_WEATHER_LATEST, weather)
+                self._conn.executemany(_INSERT_SOIL, soil)
+                self._conn.executemany(_UPSERT_SOIL_LATEST, soil_latest)
+        self.rows_written += len(weather) + len(soil)
+        metrics.inc("observation_rows_total", len(weather), kind="weather")
+        metrics.inc("observation_rows_total", len(soil), kind="soil")
+        return len(weather) + len(soil)
+
+    # -- reads ----------------------------------------------------------------
+
+    def _query(self, sql, params):
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._pending_lock:
+                self._reader_conns.append(conn)
+        return conn.execute(sql, params).fetchall()
+
+    def _count(self, hit):
+        # latest_* lookups are the warm read path of the fetchers
+        if hit:
+            self.warm_hits += 1
+        else:
+            self.warm_misses += 1
+        metrics.inc("observation_reads_total", result="hit" if hit else "miss")
+
+    def latest_weather(self, cell, max_age=None):
+        """(observed_at, fields) of the newest reading of cell, or None (also when older than max_age)"""
+        rows = self._query(f"SELECT observed_at, {_COLUMNS} FROM weather_latest "
+                           "WHERE cell_lat = ? AND cell_lon = ?", (cell[0], cell[1]))
+        if not rows or (max_age is not None and time.time() - rows[0][0] > max_age):
+            self._count(False)
+            return None
+        self._count(True)
+        return rows[0][0], dict(zip(WEATHER_FIELDS, rows[0][1:]))
+
+    def latest_weather_many(self, since=None):
+        """{cell: (observed_at, fields)} of the newest reading of every cell, optionally only since a time"""
+        rows = self._query(f"SELECT cell_lat, cell_lon, observed_at, {_COLUMNS} FROM weather_latest "
+                           "WHERE observed_at >= ?", (since or 0,))
+        return {(row[0], row[1]): (row[2], dict(zip(WEATHER_FIELDS, row[3:]))) for row in rows}
+
+    def weather_range(self, cell, start, end=None):
+        """[(observed_at, fields)] of cell with start <= observed_at < end, oldest first"""
+        rows = self._query(f"SELECT observed_at, {_COLUMNS} FROM weather "
+                           "WHERE cell_lat = ? AND cell_lon = ? AND observed_at >= ? AND observed_at < ? ORDER BY observed_at",
+                           (cell[0], cell[1], start, time.time() + 1 if end is None else end))
+        return [(row[0], dict(zip(WEATHER_FIELDS, row[1:]))) for row in rows]
+
+    def weather_array(self, cell, start, end=None):
+        """(observed_at, temp, feels_like, humidity, wind_speed) float arrays of cell between start and end"""
+        rows = self._query("SELECT observed_at, temp, feels_like, humidity, wind_speed FROM weather "
+                           "WHERE cell_lat = ? AND cell_lon = ? AND observed_at >= ? AND observed_at < ? ORDER BY observed_at",
+                           (cell[0], cell[1], start, time.time() + 1 if end is None else end))
+        data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        return tuple(data.T)
+
+    def soil_range(self, cell, start, end=None):
+        """(times, values) of cell's hourly soil series with start <= time < end.
+
+        values has shape (SOIL_LAYERS, len(times)) with NaN where a layer was missing.
+        """
+        rows = self._query(f"SELECT time, {', '.join(_SOIL_COLUMNS)} FROM soil "
+                           "WHERE cell_lat = ? AND cell_lon = ? AND time >= ? AND time < ? ORDER BY time",
+                           (cell[0], cell[1], int(start), int(time.time() + 86400 if end is None else end)))
+        data = np.array(rows, dtype=np.float64).reshape(-1, 1 + SOIL_LAYERS)  # NULL -> NaN
+        return data[:, 0].astype(np.int64), data[:, 1:].T.copy()
+
+    def latest_soil(self, cell, max_age=None):
+        """(fetched_at, utc_offset, times, values) covering cell's last fetch, or None (also when older than max_age)"""
+        rows = self._query("SELECT fetched_at, first_time, last_time, utc_offset FROM soil_latest "
+                           "WHERE cell_lat = ? AND cell_lon = ?", (cell[0], cell[1]))
+        if not rows or (max_age is not None and time.time() - rows[0][0] > max_age):
+            self._count(False)
+            return None
+        self._count(True)
+        fetched_at, first, last, utc_offset = rows[0]
+        times, values = self.soil_range(cell, first, last + 1)
+        return fetched_at, utc_offset, times, values
+
+    # -- retention ------------------------------------------------------------
+
+    def maintain(self, retention_days=OBSERVATION_RETENTION_DAYS, compact_after_days=OBSERVATION_COMPACT_AFTER_DAYS):
+        """Drop readings past retention and thin old weather readings to one per hour.
+
+        Returns {"expired": rows, "compacted": rows}. Compaction is incremental: only
+        the hours since the previous run are scanned.
+        """
+        self.flush()
+        now = time.time()
+        self._last_maintenance = now
+        expired = compacted = 0
+        with self._lock, self._conn:
+            if retention_days > 0:
+                cutoff = now - retention_days * 86400
+                expired += self._conn.execute("DELETE FROM weather WHERE observed_at < ?", (cutoff,)).rowcount
+                expired += self._conn.execute("DELETE FROM soil WHERE time < ?", (cutoff,)).rowcount
+                self._conn.execute("DELETE FROM weather_latest WHERE observed_at < ?", (cutoff,))
+                self._conn.execute("DELETE FROM soil_latest WHERE fetched_at < ?", (cutoff,))
+            if compact_after_days > 0:
+                # Whole hours only, so a bucket is never thinned while it can still grow
+                until = (now - compact_after_days * 86400) // 3600 * 3600
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'compacted_until'").fetchone()
+                since = row[0] if row else 0.0
+                compacted = self._conn.execute(
+                    "DELETE FROM weather AS old WHERE observed_at >= ? AND observed_at < ? AND EXISTS ("
+                    "SELECT 1 FROM weather AS newer WHERE newer.cell_lat = old.cell_lat AND newer.cell_lon = old.cell_lon "
+                    "AND newer.observed_at > old.observed_at "
+                    "AND newer.observed_at < (CAST(old.observed_at / 3600 AS INTEGER) + 1) * 3600)",
+                    (since, until)).rowcount
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('compacted_until', ?)", (max(since, until),))
+        with self._lock:
+            self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA optimize")
+        return {"expired": expired, "compacted": compacted}
+
+    def stats(self):
+        with self._lock:
+            cells = self._conn.execute("SELECT COUNT(*) FROM weather_latest").fetchone()[0]
+        lookups = self.warm_hits + self.warm_misses
+        return {
+            "cells": cells,
+            "rows_written": self.rows_written,
+            "pending": len(self._weather) + len(self._soil),
+            "warm_hits": self.warm_hits,
+            "warm_misses": self.warm_misses,
+            "warm_hit_rate": self.warm_hits / lookups if lookups else 0.0,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+        with self._pending_lock:
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns = []
+
+_store = None
+_opened = False
+_lock = threading.Lock()
+
+def get_store():
+    """The store at OBSERVATION_STORE_PATH, opened on first use; None when disabled"""
+    global _store, _opened
+    if not _opened:
+        with _lock:
+            if not _opened:
+                if OBSERVATION_STORE_PATH:
+                    _store = ObservationStore(OBSERVATION_STORE_PATH)
+                _opened = True
+    return _store
+
+def flush():
+    """Write buffered readings now (e.g. at the end of a batch run)"""
+    store = get_store()
+    return store.flush() if store is not None else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or maintain the local observation store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    history_parser = commands.add_parser("history", help="print the stored readings of a location")
+    history_parser.add_argument("latitude", type=float)
+    history_parser.add_argument("longitude", type=float)
+    history_parser.add_argument("--days", type=float, default=1)
+    commands.add_parser("latest", help="print the newest reading of every stored location")
+    commands.add_parser("maintain", help="apply retention and compaction now")
+    commands.add_parser("stats", help="print store statistics")
+    args = parser.parse_args(argv)
+
+    store = get_store()
+    if store is None:
+        sys.exit("OBSERVATION_STORE_PATH is empty; the observation store is disabled")
+    if args.command == "history":
+        from weather import grid_cell
+
+        cell = grid_cell(args.latitude, args.longitude)
+        for observed_at, fields in store.weather_range(cell, time.time() - args.days * 86400):
+            print(time.strftime("%Y-%m-%d %H:%M", time.localtime(observed_at)), "\t".join(str(fields[field]) for field in WEATHER_FIELDS), sep="\t")
+    elif args.command == "latest":
+        for (lat, lon), (observed_at, fields) in sorted(store.latest_weather_many().items()):
+            print(f"{lat:.3f}, {lon:.3f}", time.strftime("%Y-%m-%d %H:%M", time.localtime(observed_at)),
+                  "\t".join(str(fields[field]) for field in WEATHER_FIELDS), sep="\t")
+    elif args.command == "maintain":
+        print(store.maintain())
+    else:
+        print(store.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse, heapq, itertools, math, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import metrics, observations, ratelimit, weather
+from batch import read_records, record_coordinates
+load_dotenv()
+
+# Background refresh of a watchlist of farms, so that the morning visit finds their
+# weather and soil moisture already cached.
+#
+# The watchlist is a CSV or JSONL file in the batch.py input format (a "location" or
+# "lat"/"lon", optional "id"). Every entry is refreshed once at start-up, then on the
+# providers' cadence: weather every PREFETCH_WEATHER_INTERVAL seconds (OpenWeather
+# updates about every 10 minutes), each farm at its own offset so the requests are
+# spread evenly over the interval; soil moisture for all farms together, in
+# multi-location requests, PREFETCH_SOIL_DELAY seconds after every hour (Open-Meteo's
+# hourly update). Refreshes land a little before the cached value expires
+# (PREFETCH_LEAD) and go through the rate limiter at batch priority. The last error
+# of each refresh is kept per source; entries with unusable coordinates are skipped.
+#
+# Inside the Streamlit app the scheduler warms the in-process caches. Run on its own,
+# it fills the observation store, which the app reads when its own cache misses:
+#
+#   python prefetch.py watchlist.csv [--once]
+
+PREFETCH_WATCHLIST = os.getenv("PREFETCH_WATCHLIST", "")
+PREFETCH_WEATHER_INTERVAL = float(os.getenv("PREFETCH_WEATHER_INTERVAL", str(weather.weather_cache.ttl)))
+PREFETCH_SOIL_INTERVAL = float(os.getenv("PREFETCH_SOIL_INTERVAL", str(weather.soil_cache.ttl)))
+PREFETCH_SOIL_DELAY = float(os.getenv("PREFETCH_SOIL_DELAY", "300"))
+# Share of the interval by which a refresh precedes the expiry of the cached value
+PREFETCH_LEAD = float(os.getenv("PREFETCH_LEAD", "0.1"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+
+class Prefetcher:
+    def __init__(self, entries, weather_interval=PREFETCH_WEATHER_INTERVAL, soil_interval=PREFETCH_SOIL_INTERVAL,
+                 soil_delay=PREFETCH_SOIL_DELAY, lead=PREFETCH_LEAD, workers=PREFETCH_WORKERS):
+        self.weather_period = weather_interval * (1 - lead)
+        self.soil_interval = soil_interval
+        self.soil_delay = soil_delay
+        self.google_maps_token = os.getenv("google_maps_token")
+        self.openweather_api_key = os.getenv("openweather_api_key")
+        self.entries = []
+        for entry in entries:
+            try:
+                coordinates = record_coordinates(entry)
+                if coordinates is not None and not (-90 <= coordinates[0] <= 90 and -180 <= coordinates[1] <= 180):
+                    raise ValueError(f"{coordinates} is out of range")
+            except (TypeError, ValueError) as e:
+                metrics.inc("prefetch_skipped_total")
+                print(f"Skipping watchlist entry {entry.get('id')}: bad coordinates ({e})", file=sys.stderr)
+                continue
+            self.entries.append({
+                "id": entry["id"],
+                "location": entry.get("location") or None,
+                "coordinates": coordinates,
+                "weather_at": None,
+                "soil_at": None,
+                "next_weather": None,
+                "offset": 0.0,
+                "weather_error": None,
+                "soil_error": None,
+            })
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._jobs = []  # heap of (due, sequence, kind, entry index)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._started = None
+        self._stopped = False
+
+    def start(self):
+        """Queue the start-up pass and the regular refreshes, and start the scheduler thread"""
+        now = self._started = time.time()
+        with self._cond:
+            for index, entry in enumerate(self.entries):
+                # Spread the farms evenly over the weather interval from the next round on
+                entry["offset"] = index * self.weather_period / max(1, len(self.entries))
+                self._push(now, "weather", index)
+            self._push(now, "soil", None)
+            self._thread = threading.Thread(target=self._run, name="prefetch-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _push(self, due, kind, index):
+        heapq.heappush(self._jobs, (due, next(self._sequence), kind, index))
+        if index is not None:
+            self.entries[index]["next_weather"] = due
+        self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                now = time.time()
+                if not self._jobs or self._jobs[0][0] > now:
+                    self._cond.wait(self._jobs[0][0] - now if self._jobs else None)
+                    continue
+                _, _, kind, index = heapq.heappop(self._jobs)
+                if kind == "weather":
+                    self._pool.submit(self._refresh_weather, index)
+                else:
+                    self._pool.submit(self._refresh_soil)
+
+    def _next_weather(self, index):
+        """This farm's next slot: start time + its offset + a whole number of weather periods"""
+        elapsed = time.time() - self._started - self.entries[index]["offset"]
+        periods = max(1, math.floor(elapsed / self.weather_period) + 1)
+        return self._started + self.entries[index]["offset"] + periods * self.weather_period
+
+    def _next_soil(self):
+        """Next top of the soil interval (wall clock) plus PREFETCH_SOIL_DELAY"""
+        now = time.time()
+        boundary = (now - self.soil_delay) // self.soil_interval * self.soil_interval + self.soil_interval
+        return boundary + self.soil_delay
+
+    def _locate(self, entry):
+        # Geocoded once; the geocode cache and single-flight make a repeat cheap
+        if entry["coordinates"] is None:
+            entry["coordinates"] = weather.get_coordinates(entry["location"], self.google_maps_token)
+        return entry["coordinates"]
+
+    def _refresh_weather(self, index):
+        ratelimit.set_priority(ratelimit.BATCH)
+        entry = self.entries[index]
+        try:
+            self._locate(entry)
+            weather.refresh_weather(*entry["coordinates"], self.openweather_api_key)
+            entry["weather_at"] = time.time()
+            entry["weather_error"] = None
+            metrics.inc("prefetch_refreshes_total", kind="weather", result="ok")
+        except Exception as e:
+            entry["weather_error"] = str(e)
+            metrics.inc("prefetch_refreshes_total", kind="weather", result="error")
+        with self._cond:
+            if not self._stopped:
+                self._push(self._next_weather(index), "weather", index)
+
+    def _refresh_soil(self):
+        ratelimit.set_priority(ratelimit.BATCH)
+        located = []
+        for entry in self.entries:
+            try:
+                self._locate(entry)
+                located.append(entry)
+            except Exception as e:
+                entry["soil_error"] = str(e)
+        try:
+            weather.refresh_soil_moisture_many([entry["coordinates"] for entry in located])
+            now = time.time()
+            for entry in located:
+                entry["soil_at"] = now
+                entry["soil_error"] = None
+            metrics.inc("prefetch_refreshes_total", kind="soil", result="ok")
+        except Exception as e:
+            for entry in located:
+                entry["soil_error"] = str(e)
+            metrics.inc("prefetch_refreshes_total", kind="soil", result="error")
+        with self._cond:
+            if not self._stopped:
+                self._push(self._next_soil(), "soil", None)
+
+    def status(self):
+        """Per watched location: id, location, coordinates, last weather / soil refresh, next refresh, last errors"""
+        return [{key: entry[key] for key in ("id", "location", "coordinates", "weather_at", "soil_at", "next_weather",
+                                             "weather_error", "soil_error")}
+                for entry in self.entries]
+
+_prefetcher = None
+_lock = threading.Lock()
+
+def start(path=None):
+    """Start the process-wide Prefetcher for the watchlist at path (default PREFETCH_WATCHLIST); None when unset"""
+    global _prefetcher
+    path = path or PREFETCH_WATCHLIST
+    if not path:
+        return None
+    with _lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(list(read_records(path))).start()
+    return _prefetcher
+
+def get_prefetcher():
+    """The running Prefetcher, or None"""
+    return _prefetcher
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the weather and soil data of watched farms fresh.")
+    parser.add_argument("watchlist", nargs="?", default=PREFETCH_WATCHLIST,
+                        help="CSV or JSONL of locations or lat/lon pairs (default: PREFETCH_WATCHLIST)")
+    parser.add_argument("--once", action="store_true", help="refresh every farm once and exit")
+    args = parser.parse_args(argv)
+    if not args.watchlist:
+        sys.exit("No watchlist given and PREFETCH_WATCHLIST is not set")
+
+    prefetcher = Prefetcher(list(read_records(args.watchlist))).start()
+    try:
+        while True:
+            time.sleep(1)
+            # --once: done when every farm has a refresh or an error for both sources
+            if args.once and all((entry["weather_at"] or entry["weather_error"]) and (entry["soil_at"] or entry["soil_error"])
+                                 for entry in prefetcher.status()):
+                break
+    except KeyboardInterrupt:
+        pass
+    prefetcher.stop()
+    observations.flush()
+    for entry in prefetcher.status():
+        state = (f"weather {entry['weather_error'] or _age(entry['weather_at'])}, "
+                 f"soil {entry['soil_error'] or _age(entry['soil_at'])}")
+        print(f"{entry['id']}\t{entry['location'] or entry['coordinates']}\t{state}", file=sys.stderr)
+
+def _age(timestamp):
+    return "never" if timestamp is None else f"{time.time() - timestamp:.0f}s ago"
+
+if __name__ == "__main__":
+    main()
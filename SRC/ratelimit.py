@@ -0,0 +1,223 @@
+import asyncio, contextvars, heapq, itertools, os, threading, time
+import metrics
+
+# Process-wide request scheduling for the rate-limited upstreams. Every provider
+# has a token bucket refilled at its per-minute quota. A caller that finds the
+# bucket empty joins a priority queue (interactive work before batch work, FIFO
+# within a priority) and gives up after its deadline. A 429 halves the provider's
+# rate and pauses the bucket for the Retry-After period; each success then adds a
+# little back until the configured quota is reached again (AIMD), so throughput
+# settles just under the real ceiling instead of alternating between bursts and
+# failures. Threads and asyncio tasks share the same buckets.
+
+INTERACTIVE, BATCH = 0, 1
+
+# Requests per minute; 0 disables limiting for that provider
+PROVIDERS = {
+    "google": ("RATE_LIMIT_GOOGLE", 3000),
+    "openweather": ("RATE_LIMIT_OPENWEATHER", 60),
+    "open_meteo": ("RATE_LIMIT_OPEN_METEO", 600),
+    "groq": ("RATE_LIMIT_GROQ", 30),
+}
+# Bucket capacity, in seconds worth of quota
+BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+# How long a caller may wait for a token before RateLimitExceeded is raised
+MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+# Share of the configured rate given back per successful request after a 429
+RECOVERY = float(os.getenv("RATE_LIMIT_RECOVERY", "0.05"))
+
+_priority = contextvars.ContextVar("ratelimit_priority", default=INTERACTIVE)
+
+def set_priority(priority):
+    """Set the priority of upstream calls made from the current context (thread or task)"""
+    _priority.set(priority)
+
+class RateLimitExceeded(Exception):
+    pass
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted", "cancelled")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+        self.cancelled = False
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:
+            pass  # the waiting event loop is closed
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class TokenBucket:
+    def __init__(self, name, per_minute, burst_seconds=BURST_SECONDS):
+        self.name = name
+        self.max_rate = per_minute / 60.0
+        self.rate = self.max_rate
+        self.min_rate = self.max_rate / 20
+        self.burst = max(1.0, self.max_rate * burst_seconds)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self._last_cut = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, now):
+        # Only when nobody is queued, so a newcomer cannot overtake waiting callers
+        if self._waiters or now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.granted += 1
+        return True
+
+    def _enqueue(self, waiter, priority):
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, name=f"ratelimit-{self.name}", daemon=True)
+            self._dispatcher.start()
+        self._cond.notify()
+
+    def _dispatch(self):
+        """Hand out tokens to queued callers, best priority first"""
+        with self._cond:
+            while True:
+                while self._waiters and self._waiters[0][2].cancelled:
+                    heapq.heappop(self._waiters)
+                if not self._waiters:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._cond.wait(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens < 1:
+                    self._cond.wait((1 - self.tokens) / self.rate)
+                    continue
+                waiter = heapq.heappop(self._waiters)[2]
+                self.tokens -= 1
+                self.granted += 1
+                waiter.granted = True
+                waiter.wake()
+
+    def _give_up(self, waiter, timeout):
+        """Called when a waiter's deadline passed; True if the token arrived just in time"""
+        with self._cond:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self.rejected += 1
+        metrics.inc("ratelimit_rejected_total", provider=self.name)
+        raise RateLimitExceeded(f"{self.name} rate limit: no request slot within {timeout:g}s")
+
+    def acquire(self, timeout=None, priority=None):
+        """Block until a request may be sent; returns the seconds waited"""
+        timeout = MAX_WAIT if timeout is None else timeout
+        start = time.monotonic()
+        with self._cond:
+            if self._take(start):
+                return 0.0
+            waiter = _Waiter(event=threading.Event())
+            self._enqueue(waiter, _priority.get() if priority is None else priority)
+        if not waiter.event.wait(timeout):
+            self._give_up(waiter, timeout)
+        return self._waited(start)
+
+    async def aacquire(self, timeout=None, priority=None):
+        """Async acquire; cancellation (e.g. by wait_for) releases the queue slot"""
+        timeout = MAX_WAIT if timeout is None else timeout
+        start = time.monotonic()
+        with self._cond:
+            if self._take(start):
+                return 0.0
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._enqueue(waiter, _priority.get() if priority is None else priority)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self._give_up(waiter, timeout)
+        except asyncio.CancelledError:
+            with self._cond:
+                waiter.cancelled = not waiter.granted
+            raise
+        return self._waited(start)
+
+    def _waited(self, start):
+        waited = time.monotonic() - start
+        metrics.observe("ratelimit_wait_seconds", waited, provider=self.name)
+        return waited
+
+    def throttle(self, pause):
+        """The provider answered 429: halve the rate and pause for `pause` seconds"""
+        with self._cond:
+            now = time.monotonic()
+            self.throttled += 1
+            # Responses to requests sent before the cut carry no new information
+            if now - self._last_cut >= 1 / self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_cut = now
+            self._refill(now)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + pause)
+            self._cond.notify()
+        metrics.inc("ratelimit_throttled_total", provider=self.name)
+
+    def succeed(self):
+        """A request went through: move the rate back towards the quota"""
+        if self.rate < self.max_rate:
+            with self._cond:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+
+    def stats(self):
+        return {
+            "rate_per_minute": self.rate * 60,
+            "quota_per_minute": self.max_rate * 60,
+            "queued": len(self._waiters),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+        }
+
+_buckets = {}
+_lock = threading.Lock()
+
+def get_limiter(provider):
+    """The provider's TokenBucket, or None when it is not rate limited"""
+    if provider is None:
+        return None
+    bucket = _buckets.get(provider, False)
+    if bucket is False:
+        with _lock:
+            bucket = _buckets.get(provider, False)
+            if bucket is False:
+                variable, default = PROVIDERS.get(provider, (None, 0))
+                per_minute = float(os.getenv(variable, str(default))) if variable else 0
+                bucket = _buckets[provider] = TokenBucket(provider, per_minute) if per_minute > 0 else None
+    return bucket
+
+def stats():
+    """{provider: bucket stats} for the providers used so far"""
+    return {name: bucket.stats() for name, bucket in sorted(_buckets.items()) if bucket is not None}
@@ -0,0 +1,287 @@
+import argparse, os, sqlite3, sys, threading, time, uuid, weakref, zlib
+import metrics
+from history import report_facts
+
+# Bounded chat history for the Streamlit sessions. A session keeps its newest
+# SESSION_HOT_TURNS analyses as text, together with their parsed render blocks;
+# older reports are zlib-compressed in memory. When a session's history grows past
+# SESSION_MEMORY_KB, or all sessions together pass SESSION_TOTAL_MEMORY_MB, the
+# oldest compressed reports (of the least recently used sessions first) are spilled
+# to a SQLite file and only read back when they are viewed. Sessions idle for
+# SESSION_IDLE_TIMEOUT seconds are spilled completely. Every analysis keeps its
+# question and a one-line fact summary in memory for the prompt.
+#
+# Sizes are estimated from the length of the kept strings, not Python's object overhead.
+#
+#   python sessions.py stats
+
+SESSION_HOT_TURNS = int(os.getenv("SESSION_HOT_TURNS", "5"))
+SESSION_MEMORY_KB = float(os.getenv("SESSION_MEMORY_KB", "256"))
+SESSION_TOTAL_MEMORY_MB = float(os.getenv("SESSION_TOTAL_MEMORY_MB", "64"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+# Empty keeps everything in memory: reports above the caps are then dropped
+SESSION_SPILL_PATH = os.getenv("SESSION_SPILL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sessions.sqlite"))
+# Spilled reports of sessions that were never cleaned up (e.g. a killed server) expire after this many days
+SESSION_SPILL_RETENTION_DAYS = float(os.getenv("SESSION_SPILL_RETENTION_DAYS", "2"))
+# Seconds between sweeps for idle and ended sessions (run from add/get of any session)
+SWEEP_INTERVAL = 60
+
+class SpillStore:
+    def __init__(self, path, retention_days=SESSION_SPILL_RETENTION_DAYS):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spilled ("
+            "session TEXT NOT NULL, number INTEGER NOT NULL, report BLOB NOT NULL, stored_at REAL NOT NULL, "
+            "PRIMARY KEY (session, number)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spilled_stored_at ON spilled (stored_at)")
+        self._conn.execute("DELETE FROM spilled WHERE stored_at < ?", (time.time() - retention_days * 86400,))
+        self._conn.commit()
+
+    def put_many(self, session, reports):
+        """Store [(number, compressed report)] of one session in one transaction"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO spilled (session, number, report, stored_at) VALUES (?, ?, ?, ?)",
+                [(session, number, report, now) for number, report in reports],
+            )
+            self._conn.commit()
+
+    def get(self, session, number):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT report FROM spilled WHERE session = ? AND number = ?", (session, number)
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete_sessions(self, sessions):
+        with self._lock:
+            self._conn.executemany("DELETE FROM spilled WHERE session = ?", [(session,) for session in sessions])
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(report)), 0) FROM spilled").fetchone()
+        return {"reports": count, "bytes": size}
+
+_store = None
+_opened = False
+
+def get_spill_store():
+    """The process-wide SpillStore, or None when SESSION_SPILL_PATH is empty"""
+    global _store, _opened
+    if not _opened:
+        with _lock:
+            if not _opened:
+                if SESSION_SPILL_PATH:
+                    _store = SpillStore(SESSION_SPILL_PATH)
+                _opened = True
+    return _store
+
+class _Exchange:
+    __slots__ = ("question", "facts", "report", "view", "compressed", "spilled")
+
+    def __init__(self, question, facts, report, view):
+        self.question = question
+        self.facts = facts
+        self.report = report          # text while hot
+        self.view = view              # render blocks while hot, as given by the app
+        self.compressed = None        # zlib bytes while cold in memory
+        self.spilled = False          # on disk
+
+    def size(self):
+        size = len(self.question) + len(self.facts)
+        if self.report is not None:
+            # The render blocks hold about the same text again
+            size += len(self.report) * (2 if self.view is not None else 1)
+        if self.compressed is not None:
+            size += len(self.compressed)
+        return size
+
+# All operations on sessions share one lock, so the global cap sees consistent sizes
+_lock = threading.RLock()
+_sessions = weakref.WeakSet()
+_ended = []  # ids of garbage-collected sessions whose spilled reports are still on disk
+_last_sweep = time.time()
+
+class SessionHistory:
+    def __init__(self, hot_turns=SESSION_HOT_TURNS, memory_limit=SESSION_MEMORY_KB * 1024):
+        self.id = uuid.uuid4().hex
+        self.hot_turns = hot_turns
+        self.memory_limit = memory_limit
+        self.memory = 0
+        self.last_used = time.time()
+        self._exchanges = []
+        with _lock:
+            _sessions.add(self)
+        # Runs at garbage collection (e.g. "Clear History" or an ended browser session);
+        # only records the id, the disk rows are deleted by the next sweep
+        weakref.finalize(self, _ended.append, self.id)
+
+    def __len__(self):
+        return len(self._exchanges)
+
+    def add(self, question, report, view=None):
+        """Append an analysis; view is the app's parsed form of the report, kept while it is hot"""
+        exchange = _Exchange(question, report_facts(report), report, view)
+        with _lock:
+            self._exchanges.append(exchange)
+            self.memory += exchange.size()
+            self._touch()
+            # The analysis that just dropped out of the hot window
+            if len(self._exchanges) > self.hot_turns:
+                self._compress(self._exchanges[-self.hot_turns - 1])
+            # Over the cap, hot reports other than the newest are spilled as well
+            self._shrink(self.memory_limit, include_hot=True, keep=1)
+            _enforce_total(self)
+
+    def get(self, index):
+        """(question, report, view) of an analysis, loading a spilled report from disk.
+
+        view is None for a cold analysis; report is None once it was dropped.
+        """
+        with _lock:
+            self._touch()
+            exchange = self._exchanges[index]
+            if exchange.report is not None:
+                return exchange.question, exchange.report, exchange.view
+            data = exchange.compressed
+            if data is None and exchange.spilled:
+                store = get_spill_store()
+                data = store.get(self.id, index) if store is not None else None
+                metrics.inc("session_history_loads_total", source="disk")
+        return exchange.question, zlib.decompress(data).decode() if data is not None else None, None
+
+    def set_view(self, index, view):
+        """Keep the parsed form of a hot analysis, so it is only parsed once"""
+        with _lock:
+            exchange = self._exchanges[index]
+            if exchange.report is not None and exchange.view is None:
+                self.memory -= exchange.size()
+                exchange.view = view
+                self.memory += exchange.size()
+
+    @property
+    def messages(self):
+        """Messages for the analysis prompt: hot analyses verbatim, older ones as their fact line"""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        with _lock:
+            self._touch()
+            messages = []
+            for exchange in self._exchanges:
+                messages.append(HumanMessage(content=exchange.question))
+                messages.append(AIMessage(content=exchange.report if exchange.report is not None else exchange.facts,
+                                          response_metadata={"facts": exchange.facts}))
+        return messages
+
+    def _touch(self):
+        self.last_used = time.time()
+        _sweep(self.last_used)
+
+    def _compress(self, exchange):
+        if exchange.report is None:
+            return
+        self.memory -= exchange.size()
+        exchange.compressed = zlib.compress(exchange.report.encode(), 6)
+        exchange.report = exchange.view = None
+        self.memory += exchange.size()
+
+    def _shrink(self, limit, include_hot=False, keep=0):
+        """Spill the oldest compressed reports (with include_hot, also hot ones but the newest keep) until memory <= limit"""
+        store = get_spill_store()
+        spilled, dropped = [], 0
+        for index, exchange in enumerate(self._exchanges[:len(self._exchanges) - keep]):
+            if self.memory <= limit:
+                break
+            if exchange.report is not None:
+                if not include_hot:
+                    break
+                self._compress(exchange)
+            if exchange.compressed is None:
+                continue
+            self.memory -= exchange.size()
+            if store is not None:
+                spilled.append((index, exchange.compressed))
+                exchange.spilled = True
+            else:
+                dropped += 1
+            exchange.compressed = None
+            self.memory += exchange.size()
+        if spilled:
+            store.put_many(self.id, spilled)
+            metrics.inc("session_history_spilled_total", len(spilled))
+        if dropped:
+            metrics.inc("session_history_dropped_total", dropped)
+
+def _enforce_total(current):
+    """Spill the least recently used sessions until all sessions fit SESSION_TOTAL_MEMORY_MB"""
+    limit = SESSION_TOTAL_MEMORY_MB * 1024 * 1024
+    sessions = sorted(_sessions, key=lambda session: session.last_used)
+    total = sum(session.memory for session in sessions)
+    # Cold reports of every session first, then the hot ones (but the newest of the current session)
+    for include_hot in (False, True):
+        for session in sessions:
+            if total <= limit:
+                return
+            before = session.memory
+            session._shrink(max(0, session.memory - (total - limit)), include_hot, keep=int(session is current))
+            total -= before - session.memory
+
+def _sweep(now):
+    """Spill sessions idle for SESSION_IDLE_TIMEOUT and delete the disk rows of ended ones"""
+    global _last_sweep
+    if now - _last_sweep < SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    for session in list(_sessions):
+        if now - session.last_used > SESSION_IDLE_TIMEOUT and session.memory:
+            session._shrink(0, include_hot=True)
+            metrics.inc("session_history_idle_evictions_total")
+    if _ended:
+        ended = [_ended.pop() for _ in range(len(_ended))]
+        store = get_spill_store()
+        if store is not None:
+            store.delete_sessions(ended)
+
+def stats():
+    """Memory use of the chat histories of this server process"""
+    with _lock:
+        sessions = list(_sessions)
+        counts = {"hot": 0, "compressed": 0, "spilled": 0, "dropped": 0}
+        for session in sessions:
+            for exchange in session._exchanges:
+                state = ("hot" if exchange.report is not None else "compressed" if exchange.compressed is not None
+                         else "spilled" if exchange.spilled else "dropped")
+                counts[state] += 1
+        now = time.time()
+        result = {
+            "sessions": len(sessions),
+            "idle_sessions": sum(now - session.last_used > SESSION_IDLE_TIMEOUT for session in sessions),
+            "memory_bytes": sum(session.memory for session in sessions),
+            "memory_limit_bytes": SESSION_TOTAL_MEMORY_MB * 1024 * 1024,
+            **counts,
+        }
+    store = get_spill_store()
+    result["disk_bytes"] = store.stats()["bytes"] if store is not None else 0
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the on-disk chat history spill store.")
+    parser.add_argument("command", choices=("stats",))
+    parser.parse_args(argv)
+    store = get_spill_store()
+    if store is None:
+        sys.exit("SESSION_SPILL_PATH is empty; chat history is not spilled to disk")
+    print(store.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio, threading, weakref
+from collections import Counter
+
+# Request coalescing: concurrent calls with the same key share one execution and
+# all receive its result (or its exception). Keys are tuples whose first element
+# names the upstream, e.g. ("weather", cell), so stats can be reported per upstream.
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # In-flight asyncio tasks, one table per event loop
+        self._tasks = weakref.WeakKeyDictionary()
+        self.executed = Counter()
+        self.coalesced = Counter()
+
+    def do(self, key, fn):
+        """Run fn() unless an identical call is already in flight in another thread"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed[key[0]] += 1
+            else:
+                self.coalesced[key[0]] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn):
+        """Async variant: fn is a zero-argument callable returning an awaitable"""
+        loop = asyncio.get_running_loop()
+        tasks = self._tasks.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = loop.create_task(fn())
+            task.add_done_callback(lambda done: self._finished(tasks, key, done))
+            self.executed[key[0]] += 1
+        else:
+            self.coalesced[key[0]] += 1
+        # shield: one caller timing out must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finished(tasks, key, task):
+        tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark as retrieved even if every waiter gave up
+
+    def stats(self):
+        return {
+            name: {"executed": self.executed[name], "coalesced": self.coalesced[name]}
+            for name in sorted(set(self.executed) | set(self.coalesced))
+        }
@@ -0,0 +1,134 @@
+import argparse, json, os, subprocess, sys, time
+
+# Startup and rerun cost of the Streamlit app.
+#
+# Import times are measured in fresh interpreters (best of --repeat runs). Rerun
+# times use Streamlit's AppTest harness: the first run is the cold start, then the
+# sidebar checkboxes are toggled to reproduce the reruns a user triggers. No API
+# calls are made because no analysis is requested. --history N seeds the session
+# with N earlier analyses and shows the chat history, to check that reruns do not
+# slow down as the history grows. With --max-import-ms / --max-rerun-ms the script
+# exits non-zero when a budget is exceeded.
+#
+#   python startup_benchmark.py --reruns 20 --max-rerun-ms 150
+#   python startup_benchmark.py --reruns 20 --history 500
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the app may import, cheapest first; the heavy ones should only load on first analysis
+MODULES = ("metrics", "sessions", "streamlit", "weather", "analysis", "langchain_core.prompts",
+           "langchain_groq")
+
+def import_time(module, repeat=3):
+    """Best-of-N seconds to import module in a fresh interpreter, or None if it is not installed"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        elapsed = float(result.stdout.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+SAMPLE_REPORT = """### 🌤️ Weather Analysis for Sample Farm
+**Description:** Scattered clouds
+**Temperature:** 27°C
+
+#### 🌾 Crop Recommendations
+- **Maize**: all factors optimal
+- **Cotton**: all factors optimal
+
+#### 🧪 Agricultural Inputs
+
+```plaintext
+FERTILIZERS:
+Chemical Options:
+  • Maize: Urea 120 kg N/ha in three splits
+```
+
+#### ⚠️ Recommendations & Precautions
+- Irrigate in the early morning
+"""
+
+def seed_history(app, analyses):
+    """Give the AppTest session `analyses` earlier reports and tick Show Chat History"""
+    from sessions import SessionHistory
+
+    history = SessionHistory()
+    for index in range(analyses):
+        history.add(f"Analyze weather for Farm {index}", SAMPLE_REPORT)
+    app.session_state["chat_history"] = history
+    checkbox = next(checkbox for checkbox in app.checkbox if "Chat History" in checkbox.label)
+    checkbox.set_value(True)
+    app.run()
+    return checkbox
+
+def rerun_times(reruns=10, timeout=60, history=0):
+    """(cold start seconds, [rerun seconds]) for streamlit_app.py under AppTest"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(HERE, "streamlit_app.py"), default_timeout=timeout)
+    start = time.perf_counter()
+    app.run()
+    cold = time.perf_counter() - start
+    if app.exception:
+        raise Exception(f"streamlit_app.py failed: {app.exception[0].message}")
+
+    # The history checkbox stays ticked; the others are toggled
+    shown = seed_history(app, history) if history else None
+    checkboxes = [checkbox for checkbox in app.checkbox if shown is None or checkbox.label != shown.label]
+    times = []
+    for index in range(reruns):
+        checkbox = checkboxes[index % len(checkboxes)]
+        checkbox.set_value(not checkbox.value)
+        start = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - start)
+    return cold, times
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import, cold-start and rerun time of the Streamlit app.")
+    parser.add_argument("--reruns", type=int, default=10, help="number of checkbox-toggle reruns")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per import measurement")
+    parser.add_argument("--max-import-ms", type=float, help="fail if importing streamlit_app's eager modules takes longer")
+    parser.add_argument("--max-rerun-ms", type=float, help="fail if the median rerun takes longer")
+    parser.add_argument("--history", type=int, default=0, help="earlier analyses in the session, shown during the reruns")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"imports": {module: import_time(module, args.repeat) for module in MODULES}}
+    try:
+        cold, times = rerun_times(args.reruns, history=args.history)
+        times.sort()
+        report["cold_start"] = cold
+        report["rerun_median"] = times[len(times) // 2] if times else None
+        report["rerun_max"] = times[-1] if times else None
+    except ImportError:
+        report["cold_start"] = report["rerun_median"] = report["rerun_max"] = None
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, seconds in report["imports"].items():
+            print(f"import {module:45} {'not installed' if seconds is None else f'{seconds * 1000:8.1f} ms'}")
+        if report["cold_start"] is None:
+            print("streamlit.testing is not available; rerun times skipped")
+        else:
+            print(f"cold start {report['cold_start'] * 1000:.1f} ms, rerun median "
+                  f"{report['rerun_median'] * 1000:.1f} ms, max {report['rerun_max'] * 1000:.1f} ms")
+
+    failures = []
+    # Only the modules streamlit_app.py imports at the top count towards the import budget
+    eager = sum(report["imports"][module] or 0 for module in ("metrics", "streamlit"))
+    if args.max_import_ms is not None and eager * 1000 > args.max_import_ms:
+        failures.append(f"eager imports took {eager * 1000:.1f} ms (budget {args.max_import_ms:g} ms)")
+    if args.max_rerun_ms is not None and report["rerun_median"] is not None \
+            and report["rerun_median"] * 1000 > args.max_rerun_ms:
+        failures.append(f"median rerun took {report['rerun_median'] * 1000:.1f} ms (budget {args.max_rerun_ms:g} ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
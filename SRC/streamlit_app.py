@@ -1,14 +1,16 @@
 import streamlit as st
-from weather import get_weather, get_coordinates, get_soil_moisture
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain_groq import ChatGroq
+import metrics
 from dotenv import load_dotenv
+import json
+import math
 import os
+import time
 from datetime import datetime
 
+# Streamlit re-runs this script on every widget interaction. LangChain, the
+# fetchers (numpy, requests) and the analysis chain are therefore imported and
+# built on first use only, and the chain is constructed once per server process.
+
 # Page configuration
 st.set_page_config(
     page_title="Weather & Farmer Helper",
@@ -17,7 +19,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for better styling
+# Custom CSS for better styling (re-emitted on every run: Streamlit drops elements a run does not draw)
 st.markdown("""
     <style>
     .main-header {
@@ -55,7 +57,7 @@ load_dotenv()
 def init_session_state():
     """Initialize all session state variables"""
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = ChatMessageHistory()
+        st.session_state.chat_history = None  # created with the first analysis
     if 'last_analysis' not in st.session_state:
         st.session_state.last_analysis = None
     if 'analysis_timestamp' not in st.session_state:
@@ -63,212 +65,285 @@ def init_session_state():
 
 init_session_state()
 
-# Initialize LLM
-@st.cache_resource
-def get_llm():
-    """Initialize and cache the language model"""
-    return ChatGroq(
-        model="Llama-3.3-70b-Versatile",
-        api_key=os.getenv("GROQ_API_KEY"),
-        temperature=0.3
-    )
-
-llm = get_llm()
-
-# Enhanced prompt template
-prompt = ChatPromptTemplate.from_messages([
-    (
-        "system",
-        """You are an expert agricultural and weather analysis assistant. Your role is to provide actionable insights for farmers.
-
-**IMPORTANT**: Only respond to weather and agriculture-related queries. For other topics, politely redirect users.
-
-Structure your response as follows:
-
-### 🌤️ Weather Analysis for {location}
-
-#### 📍 Location Information
-{coordinates}
+def get_chat_history():
+    """The session's chat history (memory-bounded, see sessions.py), created on first use"""
+    if st.session_state.chat_history is None:
+        from sessions import SessionHistory
 
-#### 🌡️ Current Conditions
-**Description:** {description}
-**Temperature:** {temp}°C (Feels like: {feels_like}°C)
-**Humidity:** {humidity}%
-**Wind Speed:** {wind_speed} m/s
-**Soil Moisture:** {soil_moisture}
+        st.session_state.chat_history = SessionHistory()
+    return st.session_state.chat_history
 
-#### 📊 Detailed Analysis
+def chat_messages():
+    """Messages of the session's chat history for the prompt (empty before the first analysis)"""
+    history = st.session_state.chat_history
+    return history.messages if history is not None else []
 
-**Temperature Impact:**
-- Analyze the temperature range and its suitability for different crops
-- Consider the "feels like" temperature for outdoor work conditions
+def history_length():
+    history = st.session_state.chat_history
+    return len(history) if history is not None else 0
 
-**Humidity Assessment:**
-- Evaluate humidity levels and their implications for plant growth
-- Discuss disease risk based on moisture levels
-
-**Wind Conditions:**
-- Assess wind speed effects on crops and farming operations
-- Consider pollination and spray application conditions
-
-**Soil Moisture Analysis:**
-- Interpret soil moisture data for irrigation planning
-- Recommend water management strategies
-
-#### 🌾 Crop Recommendations
-
-Based on current conditions, recommend suitable crops with specific rationale.
-
-#### 🧪 Agricultural Inputs
-
-```plaintext
-PESTICIDES:
-Chemical Options:
-  • [List specific pesticides with application rates]
-
-Natural Alternatives:
-  • [List organic/natural pest control methods]
-
-FERTILIZERS:
-Chemical Options:
-  • [List NPK ratios and specific fertilizers]
+# Initialize LLM
+@st.cache_resource
+def get_llm():
+    """Initialize and cache the language model"""
+    import analysis
 
-Organic Alternatives:
-  • [List compost, manure, and natural fertilizer options]
+    return analysis.get_llm(temperature=0.3)
 
-WEEDICIDES:
-Chemical Options:
-  • [List selective and non-selective herbicides]
+@st.cache_resource
+def get_chain():
+    """Build the prompt | llm | parser chain once per server process"""
+    from analysis import build_chain
 
-Natural Alternatives:
-  • [List mulching, manual, and organic weed control methods]
-```
+    return build_chain(get_llm())
 
-#### ⚠️ Recommendations & Precautions
-- List specific actions farmers should take
-- Include timing recommendations
-- Safety considerations
+# Prometheus endpoint / metrics file, if configured (started once per server process)
+metrics.start_exporter()
 
----
-*Analysis generated at {timestamp}*
-"""
-    ),
-    (
-        "human",
-        """Analyze weather conditions for {location}.
+@st.cache_resource
+def start_prefetch():
+    """Start refreshing the PREFETCH_WATCHLIST farms once per server process"""
+    import prefetch
 
-Location: {coordinates}
-Weather Data: {weather_info}
-Soil Conditions: {soil_moisture}
+    return prefetch.start()
 
-Provide comprehensive agricultural guidance based on this data."""
-    ),
-    MessagesPlaceholder(variable_name="chat_history"),
-])
+prefetcher = start_prefetch() if os.getenv("PREFETCH_WATCHLIST") else None
 
-chain = prompt | llm | StrOutputParser()
+# Repeated lookups of the same location within FETCH_CACHE_TTL seconds skip the whole
+# geocode + fetch pipeline; failures raise and are therefore never cached
+@st.cache_data(ttl=float(os.getenv("FETCH_CACHE_TTL", "60")), max_entries=256, show_spinner=False)
+def fetch_weather_data(location, coordinates, google_maps_token, openweather_api_key):
+    """Geocode a location (unless coordinates are known) and fetch its weather and soil moisture"""
+    from analysis import query_conditions
 
-def parse_weather_data(weather_str):
-    """Parse weather information string into structured data"""
-    weather_data = {}
-    try:
-        for line in weather_str.split('\n'):
-            if "Description:" in line:
-                weather_data['description'] = line.split(': ', 1)[1].strip()
-            elif "Temperature:" in line:
-                weather_data['temp'] = float(line.split(': ')[1].replace('°C', '').strip())
-            elif "Feels like:" in line:
-                weather_data['feels_like'] = float(line.split(': ')[1].replace('°C', '').strip())
-            elif "Humidity:" in line:
-                weather_data['humidity'] = int(line.split(': ')[1].replace('%', '').strip())
-            elif "Wind speed:" in line:
-                weather_data['wind_speed'] = float(line.split(': ')[1].replace(' m/s', '').strip())
-    except Exception as e:
-        st.error(f"Error parsing weather data: {str(e)}")
-    return weather_data
+    return query_conditions(location, google_maps_token, openweather_api_key, coordinates)
 
-def process_weather_query(location):
-    """Process weather data for a given location"""
+def process_weather_query(location, coordinates=None):
+    """Process weather data for a given location; coordinates from a suggestion skip geocoding"""
     try:
         google_maps_token = os.getenv("google_maps_token")
         openweather_api_key = os.getenv("openweather_api_key")
 
-        if not google_maps_token or not openweather_api_key:
+        if not openweather_api_key or (coordinates is None and not google_maps_token):
             return "⚠️ API keys not found. Please check your .env file."
 
-        # Get coordinates
-        coordinates = get_coordinates(location, google_maps_token)
-        if not coordinates:
-            return f"❌ Could not find coordinates for '{location}'. Please check the location name."
-
-        # Get weather data
-        weather_info_str = get_weather(coordinates[0], coordinates[1], openweather_api_key)
-        weather_data = parse_weather_data(weather_info_str)
-
-        if not weather_data:
-            return "❌ Failed to retrieve weather data. Please try again."
-
-        # Get soil moisture
-        soil_moisture = get_soil_moisture(coordinates[0], coordinates[1])
-
-        return {
-            "location": location,
-            "coordinates": f"Lat: {coordinates[0]:.4f}, Lon: {coordinates[1]:.4f}",
-            "description": weather_data.get('description', 'N/A'),
-            "temp": weather_data.get('temp', 0),
-            "feels_like": weather_data.get('feels_like', 0),
-            "humidity": weather_data.get('humidity', 0),
-            "wind_speed": weather_data.get('wind_speed', 0),
-            "soil_moisture": soil_moisture,
-            "weather_info": weather_info_str,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
+        # Get coordinates, then weather data and soil moisture in parallel
+        weather_data = fetch_weather_data(location, coordinates, google_maps_token, openweather_api_key)
+        weather_data["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return weather_data
     except Exception as e:
         return f"❌ Error: {str(e)}"
 
+def suggest_locations(text):
+    """Place suggestions for the location box (gazetteer places and earlier lookups)"""
+    import autocomplete
+
+    return autocomplete.suggest(text)
+
+def remember_location(location, weather_data):
+    """Offer a geocoded location as a suggestion in later lookups"""
+    import autocomplete
+
+    autocomplete.remember(location, weather_data["latitude"], weather_data["longitude"])
+
 def display_weather_metrics(data):
     """Display weather metrics in a clean card layout"""
     col1, col2, col3, col4 = st.columns(4)
     
+    def fmt(value, unit):
+        return "N/A" if value == "N/A" else f"{value}{unit}"
+
     with col1:
-        st.metric("🌡️ Temperature", f"{data['temp']}°C", f"Feels like {data['feels_like']}°C")
+        st.metric("🌡️ Temperature", fmt(data['temp'], "°C"), f"Feels like {fmt(data['feels_like'], '°C')}")
     with col2:
-        st.metric("💧 Humidity", f"{data['humidity']}%")
+        st.metric("💧 Humidity", fmt(data['humidity'], "%"))
     with col3:
-        st.metric("💨 Wind Speed", f"{data['wind_speed']} m/s")
+        st.metric("💨 Wind Speed", fmt(data['wind_speed'], " m/s"))
     with col4:
-        st.metric("🌱 Soil Moisture", data['soil_moisture'])
-
-def display_analysis(response):
-    """Display formatted analysis with proper styling"""
+        st.metric("🌱 Soil Moisture", fmt(data['soil_moisture_value'], " m³/m³"))
+
+def parse_section(section):
+    """Split one '###' section of an analysis report into ("markdown" | "code", text) blocks"""
+    blocks = []
+    # Handle code blocks separately
+    if "```plaintext" in section:
+        parts = section.split("```plaintext")
+        for i, part in enumerate(parts):
+            if i == 0 and part.strip():
+                blocks.append(("markdown", part))
+            elif part.strip():
+                code_content = part.split("```")[0]
+                blocks.append(("code", code_content.strip()))
+                remaining = "```".join(part.split("```")[1:])
+                if remaining.strip():
+                    blocks.append(("markdown", remaining))
+    else:
+        # Display markdown sections
+        blocks.append(("markdown", "### " + section))
+    return blocks
+
+def parse_analysis(response):
+    """Render blocks of a whole report; parsed once per report and kept with the history"""
+    blocks = []
+    # Split by main sections
+    for section in response.split("###"):
+        section = section.strip()
+        if section:
+            blocks.extend(parse_section(section))
+    return tuple(blocks)
+
+def render_blocks(blocks):
+    for kind, text in blocks:
+        if kind == "code":
+            st.code(text, language="plaintext")
+        else:
+            st.markdown(text)
+
+def render_section(section):
+    """Render one '###' section of an analysis report"""
+    render_blocks(parse_section(section))
+
+def display_analysis(response, blocks=None):
+    """Display formatted analysis with proper styling; returns its render blocks"""
     try:
-        # Split by main sections
-        sections = response.split("###")
-        
-        for section in sections:
-            section = section.strip()
-            if not section:
-                continue
-            
-            # Handle code blocks separately
-            if "```plaintext" in section:
-                parts = section.split("```plaintext")
-                for i, part in enumerate(parts):
-                    if i == 0 and part.strip():
-                        st.markdown(part)
-                    elif part.strip():
-                        code_content = part.split("```")[0]
-                        st.code(code_content.strip(), language="plaintext")
-                        remaining = "```".join(part.split("```")[1:])
-                        if remaining.strip():
-                            st.markdown(remaining)
-            else:
-                # Display markdown sections
-                st.markdown("### " + section)
-        
+        blocks = parse_analysis(response) if blocks is None else blocks
+        render_blocks(blocks)
     except Exception as e:
         st.error(f"Error displaying analysis: {str(e)}")
         st.markdown(response)
+    return blocks
+
+def display_streaming_analysis(chunks, refresh_interval=0.05):
+    """Render an analysis while it is being generated and return the full text.
+
+    Sections are drawn once they are complete; only the section still being
+    generated (including an open plaintext block) is redrawn as tokens arrive.
+    Errors of the model (raised by chunks) propagate; a rendering error is shown
+    and the rest of the text is still collected.
+    """
+    finished = st.container()
+    live = st.empty()
+    text = ""
+    rendered = 0
+    last_draw = 0.0
+    render_error = None
+    for chunk in chunks:
+        text += chunk
+        if render_error is not None:
+            continue
+        try:
+            sections = text.split("###")
+            for section in sections[rendered:-1]:
+                if section.strip():
+                    with finished:
+                        render_section(section.strip())
+            rendered = len(sections) - 1
+            now = time.perf_counter()
+            if now - last_draw >= refresh_interval and sections[-1].strip():
+                with live.container():
+                    render_section(sections[-1].strip())
+                last_draw = now
+        except Exception as e:
+            render_error = e
+    if render_error is None:
+        try:
+            tail = text.split("###")[-1].strip()
+            if tail:
+                with live.container():
+                    render_section(tail)
+        except Exception as e:
+            render_error = e
+    if render_error is not None:
+        st.error(f"Error displaying analysis: {str(render_error)}")
+    return text
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5"))
+
+def save_exchange(question, response, blocks=None):
+    """Add an analysis and its render blocks to the chat history"""
+    get_chat_history().add(question, response, blocks or parse_analysis(response))
+
+def display_history(page_size=HISTORY_PAGE_SIZE):
+    """Newest analyses first, one page at a time, so a rerun draws at most page_size reports"""
+    history = get_chat_history()
+    pages = math.ceil(len(history) / page_size)
+    page = 1
+    if pages > 1:
+        page = st.selectbox("Page", range(1, pages + 1), format_func=lambda number: f"Page {number} of {pages}")
+    end = len(history) - (page - 1) * page_size
+    for number in range(end, max(0, end - page_size), -1):
+        # Older reports are decompressed or read back from disk only when their page is shown
+        question, report, blocks = history.get(number - 1)
+        st.info(f"👤 **You:** {question}")
+        with st.expander(f"🤖 Analysis #{number}", expanded=(number == len(history))):
+            if report is None:
+                st.caption("This report is no longer kept in memory.")
+                continue
+            if blocks is None:
+                blocks = parse_analysis(report)
+                history.set_view(number - 1, blocks)
+            render_blocks(blocks)
+
+STAGE_ORDER = ("geocode", "weather", "soil", "total", "analysis")
+
+def time_ago(timestamp):
+    if timestamp is None:
+        return "never"
+    minutes = int(time.time() - timestamp) // 60
+    return "just now" if minutes < 1 else f"{minutes} min ago" if minutes < 60 else f"{minutes // 60} h ago"
+
+def display_watchlist():
+    """Last refresh of every watched farm"""
+    st.table([{
+        "farm": entry["location"] or f"{entry['coordinates'][0]:.3f}, {entry['coordinates'][1]:.3f}",
+        "weather": time_ago(entry["weather_at"]),
+        "soil": time_ago(entry["soil_at"]),
+        "status": "; ".join(f"⚠️ {kind}: {entry[kind + '_error']}" for kind in ("weather", "soil")
+                            if entry[kind + "_error"]) or "✅",
+    } for entry in prefetcher.status()])
+
+def display_diagnostics():
+    """Show per-stage latency, cache hit rates and token counts of this server process"""
+    if not metrics.METRICS_ENABLED:
+        st.caption("Metrics are disabled (METRICS_ENABLED=false).")
+        return
+    snapshot = metrics.snapshot()
+    stages = metrics.stage_summary(snapshot)
+    if stages:
+        ordered = sorted(stages, key=lambda stage: STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER))
+        st.table([{
+            "stage": stage,
+            "count": stages[stage]["count"],
+            "errors": stages[stage]["errors"],
+            "p50 ms": round(stages[stage]["p50"] * 1000),
+            "p95 ms": round(stages[stage]["p95"] * 1000),
+        } for stage in ordered])
+    else:
+        st.caption("No requests measured yet.")
+    for name, stats in snapshot["caches"].items():
+        st.caption(f"{name} cache: {stats['hit_rate']:.0%} hits ({stats['hits']} hits, {stats['misses']} misses)")
+    import observations, ratelimit, sessions
+
+    store = observations.get_store()
+    if store is not None:
+        stats = store.stats()
+        st.caption(f"Observation store: {stats['cells']} locations, {stats['rows_written']} readings written, "
+                   f"warm reads {stats['warm_hit_rate']:.0%} ({stats['warm_hits']} served without a request)")
+
+    stats = sessions.stats()
+    st.caption(f"Chat history: {stats['sessions']} sessions ({stats['idle_sessions']} idle), "
+               f"{stats['memory_bytes'] / 1024:.0f} KB in memory of {stats['memory_limit_bytes'] / 2**20:.0f} MB; "
+               f"{stats['hot']} reports as text, {stats['compressed']} compressed, {stats['spilled']} on disk "
+               f"({stats['disk_bytes'] / 1024:.0f} KB)")
+
+    for provider, stats in ratelimit.stats().items():
+        st.caption(f"{provider} rate limit: {stats['rate_per_minute']:.0f}/{stats['quota_per_minute']:.0f} per min, "
+                   f"{stats['queued']} queued, {stats['throttled']} × 429")
+    tokens = {entry["labels"]["kind"]: entry["value"] for entry in snapshot["counters"].get("llm_tokens_total", [])}
+    if tokens:
+        st.caption(f"LLM tokens (estimated): {tokens.get('prompt', 0)} prompt, {tokens.get('completion', 0)} completion")
+    st.download_button("📥 Metrics (Prometheus)", metrics.prometheus(), file_name="metrics.prom", mime="text/plain")
+    st.download_button("📥 Metrics (JSON)", json.dumps(snapshot, indent=2), file_name="metrics.json", mime="application/json")
 
 # Main App Header
 st.markdown('<div class="main-header"><h1>🌤️ Weather & Farmer Helper 🌾</h1><p>Real-time Weather Analysis & Agricultural Guidance</p></div>', unsafe_allow_html=True)
@@ -280,6 +355,13 @@ with st.sidebar:
     
     show_history = st.checkbox("💬 Show Chat History", value=False)
     show_raw_data = st.checkbox("📊 Show Raw Weather Data", value=False)
+    stream_output = st.checkbox("⚡ Stream Analysis", value=True, help="Show the report while it is being generated")
+    show_diagnostics = st.checkbox("📈 Show Diagnostics", value=False, help="Stage latencies and cache hit rates")
+    
+    if prefetcher is not None:
+        st.markdown("---")
+        st.subheader("🛰️ Watched Farms")
+        display_watchlist()
     
     st.markdown("---")
     st.subheader("ℹ️ About")
@@ -293,7 +375,7 @@ with st.sidebar:
     """)
     
     if st.button("🗑️ Clear History"):
-        st.session_state.chat_history = ChatMessageHistory()
+        st.session_state.chat_history = None
         st.session_state.last_analysis = None
         st.success("History cleared!")
 
@@ -306,6 +388,18 @@ with col1:
         placeholder="e.g., New York, London, Tokyo, Mumbai",
         help="Enter a city name or region"
     )
+    # Picking a suggestion passes its coordinates on, so no geocoding request is made
+    suggestions = suggest_locations(location) if location.strip() else []
+    places = {suggestion.label: suggestion for suggestion in suggestions}
+    place = None
+    if places:
+        label = st.selectbox(
+            "📌 Matching places",
+            list(places),
+            index=None,
+            placeholder="Pick a place, or analyze the text as typed",
+        )
+        place = places.get(label)
 
 with col2:
     st.write("")  # Spacer
@@ -315,75 +409,84 @@ with col2:
 # Process analysis
 if analyze_button:
     if location:
-        with st.spinner("🌐 Fetching weather data and generating analysis..."):
-            weather_data = process_weather_query(location)
+        with st.spinner("🌐 Fetching weather data..."):
+            if place is not None:
+                location = place.label
+                weather_data = process_weather_query(location, place.coordinates)
+            else:
+                weather_data = process_weather_query(location)
             
-            if isinstance(weather_data, dict):
-                # Display weather metrics
-                st.subheader(f"📊 Current Weather - {weather_data['location']}")
-                display_weather_metrics(weather_data)
+        if isinstance(weather_data, dict):
+            if place is None:
+                remember_location(location, weather_data)
+            # Display weather metrics
+            st.subheader(f"📊 Current Weather - {weather_data['location']}")
+            display_weather_metrics(weather_data)
+            for field, error in weather_data["errors"].items():
+                st.warning(f"⚠️ {'Weather data' if field == 'weather' else 'Soil moisture'} unavailable: {error}")
+            
+            if show_raw_data:
+                with st.expander("📋 Raw Weather Data"):
+                    st.code(weather_data['weather_info'], language="plaintext")
+                    st.caption(" | ".join(f"{stage}: {seconds * 1000:.0f} ms" for stage, seconds in weather_data["timings"].items()))
+            
+            st.markdown("---")
+            
+            try:
+                # Generate and display analysis
+                from analysis import invoke_analysis, stream_analysis
+
+                chain = get_chain()
+                history = chat_messages()
+                blocks = None
+                if stream_output:
+                    response = display_streaming_analysis(stream_analysis(chain, weather_data, history))
+                else:
+                    with st.spinner("🤖 Generating analysis..."):
+                        response = invoke_analysis(chain, weather_data, history)
+                    blocks = display_analysis(response)
                 
-                if show_raw_data:
-                    with st.expander("📋 Raw Weather Data"):
-                        st.code(weather_data['weather_info'], language="plaintext")
+                if show_raw_data and "prompt_usage" in weather_data:
+                    usage = weather_data["prompt_usage"]
+                    st.caption(f"Prompt: ~{usage['prompt_tokens']} tokens (history {usage['history_tokens']} of "
+                               f"{usage['full_history_tokens']}, {usage['summarized_turns']} earlier turns summarized)")
                 
-                st.markdown("---")
+                # Save to chat history
+                save_exchange(f"Analyze weather for {location}", response, blocks)
+                st.session_state.last_analysis = response
+                st.session_state.analysis_timestamp = weather_data["timestamp"]
                 
-                try:
-                    # Generate analysis
-                    response = chain.invoke({
-                        "location": weather_data["location"],
-                        "coordinates": weather_data["coordinates"],
-                        "description": weather_data["description"],
-                        "temp": weather_data["temp"],
-                        "feels_like": weather_data["feels_like"],
-                        "humidity": weather_data["humidity"],
-                        "wind_speed": weather_data["wind_speed"],
-                        "soil_moisture": weather_data["soil_moisture"],
-                        "weather_info": weather_data["weather_info"],
-                        "timestamp": weather_data["timestamp"],
-                        "chat_history": st.session_state.chat_history.messages
-                    })
-                    
-                    # Save to chat history
-                    st.session_state.chat_history.add_user_message(f"Analyze weather for {location}")
-                    st.session_state.chat_history.add_ai_message(response)
-                    st.session_state.last_analysis = response
-                    st.session_state.analysis_timestamp = weather_data["timestamp"]
-                    
-                    # Display analysis
-                    display_analysis(response)
-                    
-                    # Download button
-                    col1, col2, col3 = st.columns([1, 1, 2])
-                    with col1:
-                        st.download_button(
-                            "📥 Download Report",
-                            response,
-                            file_name=f"weather_analysis_{location.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                            mime="text/plain",
-                            use_container_width=True
-                        )
-                    
-                except Exception as e:
-                    st.error(f"❌ Error generating analysis: {str(e)}")
-                    st.exception(e)
-            else:
-                st.error(weather_data)
+                # Download button
+                col1, col2, col3 = st.columns([1, 1, 2])
+                with col1:
+                    st.download_button(
+                        "📥 Download Report",
+                        response,
+                        file_name=f"weather_analysis_{location.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                        mime="text/plain",
+                        use_container_width=True
+                    )
+                
+            except Exception as e:
+                st.error(f"❌ Error generating analysis: {str(e)}")
+                st.exception(e)
+        else:
+            st.error(weather_data)
     else:
         st.warning("⚠️ Please enter a location to analyze.")
 
 # Chat history display
-if show_history and len(st.session_state.chat_history.messages) > 0:
+if show_history and history_length() > 0:
     st.markdown("---")
     st.subheader("💬 Conversation History")
-    
-    for i, message in enumerate(st.session_state.chat_history.messages):
-        if isinstance(message, HumanMessage):
-            st.info(f"👤 **You:** {message.content}")
-        elif isinstance(message, AIMessage):
-            with st.expander(f"🤖 Analysis #{i//2 + 1}", expanded=(i == len(st.session_state.chat_history.messages) - 1)):
-                display_analysis(message.content)
+    display_history()
+
+# Diagnostics are drawn last so they include the request handled in this run
+if show_diagnostics:
+    with st.sidebar:
+        st.markdown("---")
+        st.subheader("📈 Diagnostics")
+        display_diagnostics()
 
 # Footer
 st.markdown("---")
@@ -1,11 +1,12 @@
-from weather import get_weather,get_coordinates,get_soil_moisture
+from weather import get_coordinates,fetch_conditions
+from history import HistoryWindow,estimate_tokens
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate,MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_groq import ChatGroq
 from dotenv import load_dotenv
-import os
+import os,time
 load_dotenv()
 
 # Groq model name and API key
@@ -50,6 +51,9 @@ prompt = ChatPromptTemplate.from_messages([
 
 chain=prompt | llm | StrOutputParser()
 
+# keep the chat history passed to the model under a token budget
+history_window=HistoryWindow(budget_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET","2000")),recent_turns=int(os.getenv("HISTORY_RECENT_TURNS","1")))
+
 
 # In a new cell, add this function to process location and weather data
 def process_weather_query(location):
@@ -59,22 +63,27 @@ def process_weather_query(location):
         google_maps_token = os.getenv("google_maps_token")
         openweather_api_key = os.getenv("openweather_api_key")
         
+        start = time.perf_counter()
+
         # Get coordinates
         coordinates = get_coordinates(location, google_maps_token)
         if not coordinates:
             return "Could not get coordinates for this location."
+        geocode_time = time.perf_counter() - start
             
-        # Get weather data
-        weather_info = get_weather(coordinates[0], coordinates[1], openweather_api_key)
-        
-        # Get soil moisture
-        soil_moisture = get_soil_moisture(coordinates[0], coordinates[1])
+        # Get weather data and soil moisture in parallel
+        conditions = fetch_conditions(coordinates[0], coordinates[1], openweather_api_key)
+        weather, soil = conditions["weather"], conditions["soil"]
+        if weather is None and soil is None:
+            return f"Error processing weather data: {conditions['errors']}"
         
         return {
             "location": location,
             "coordinates": f"({coordinates[0]}, {coordinates[1]})",
-            "weather_info": weather_info,
-            "soil_moisture": soil_moisture
+            "weather_info": str(weather) if weather else f"Weather data unavailable: {conditions['errors'].get('weather')}",
+            "soil_moisture": str(soil) if soil else f"Soil moisture unavailable: {conditions['errors'].get('soil')}",
+            "errors": conditions["errors"],
+            "timings": {"geocode": geocode_time, **conditions["timings"], "total": time.perf_counter() - start}
         }
     except Exception as e:
         return f"Error processing weather data: {str(e)}"
@@ -86,31 +95,27 @@ while(flag):
     location = input("Enter location (or 'exit' to quit): ")
     if location.lower() == 'exit':
         break
-    # Get coordinates for the location
-    latitude, longitude = get_coordinates(location, os.getenv("google_maps_token"))
-    print(f"Coordinates for '{location}': Latitude {latitude}, Longitude {longitude}")
-    
-    # Get the weather data using the coordinates
-    weather_info = get_weather(latitude, longitude, os.getenv("openweather_api_key"))
-    print(weather_info)
-    
-    # Get the soil moisture data using the coordinates
-    soil_moisture_info = get_soil_moisture(latitude, longitude)
-    print(soil_moisture_info)
     # Process weather data
     weather_data = process_weather_query(location)
 
     if isinstance(weather_data, dict):
+        print(f"Coordinates for '{location}': {weather_data['coordinates']}")
+        print(weather_data["weather_info"])
+        print(weather_data["soil_moisture"])
+        print("Timings: " + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in weather_data["timings"].items()))
         # If weather data was successfully retrieved
         try:
             # Invoke the model with weather data
-            response = chain.invoke({
+            inputs = {
                 "location": weather_data["location"],
                 "coordinates": weather_data["coordinates"],
                 "weather_info": weather_data["weather_info"],
                 "soil_moisture": weather_data["soil_moisture"],
-                "chat_history": chat_history.messages
-            })
+            }
+            inputs["chat_history"], usage = history_window.select(chat_history.messages)
+            prompt_tokens = sum(estimate_tokens(message.content) for message in prompt.format_messages(**inputs))
+            print(f"Prompt tokens (approx): {prompt_tokens} ({usage['summarized_turns']} earlier turns summarized)")
+            response = chain.invoke(inputs)
             
             # Add interaction to chat history
             chat_history.add_user_message(f"Analyze weather for {location}")
@@ -0,0 +1,14 @@
+import os, sys, tempfile
+
+# The modules read their configuration at import time: keep the tests off the real
+# caches and stores, and make the flat SRC modules importable.
+_scratch = tempfile.mkdtemp(prefix="weather-tests-")
+os.environ.update({
+    "OBSERVATION_STORE_PATH": "",
+    "ANALYSIS_CACHE_PATH": "",
+    "GEOCODE_CACHE_PATH": "",
+    "GAZETTEER_PATH": os.path.join(_scratch, "gazetteer"),
+    "SESSION_SPILL_PATH": os.path.join(_scratch, "sessions.sqlite"),
+    "METRICS_ENABLED": "false",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,79 @@
+import asyncio
+import analysis
+
+class FakeChain:
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return self.response
+
+    async def ainvoke(self, inputs):
+        return self.invoke(inputs)
+
+    def stream(self, inputs):
+        self.calls += 1
+        # Split inside the placeholder, as a model's tokens may be
+        for start in range(0, len(self.response), 5):
+            yield self.response[start:start + 5]
+
+def weather(**fields):
+    data = {
+        "location": "Pune, Maharashtra, India", "coordinates": "**Latitude:** 18.52, **Longitude:** 73.86",
+        "latitude": 18.52, "longitude": 73.86, "description": "clear sky", "temp": 27.0, "feels_like": 28.0,
+        "humidity": 60, "wind_speed": 2.0, "soil_moisture": "0.300 m³/m³", "soil_moisture_value": 0.3,
+        "weather_info": "", "crop_facts": "", "crop_inputs": "#### 🧪 Inputs", "crops": [],
+        "timestamp": "2026-10-18 09:00:00",
+    }
+    data.update(fields)
+    return data
+
+PROSE = "#### 📊 Detailed Analysis\nA warm day in <<location>>; irrigate <<location>> fields at dusk."
+
+def setup_function():
+    analysis.analysis_cache.clear()
+
+def test_placeholders_are_filled_without_mangling():
+    # Short values would corrupt the report if they were replaced back into the text
+    data = weather(location="a", timestamp="t")
+    report = analysis.invoke_analysis(FakeChain(PROSE), data)
+    assert "A warm day in a; irrigate a fields at dusk." in report
+    assert "<<" not in report
+    assert report.startswith("### 🌤️ Weather Analysis for a\n")
+    assert report.endswith("*Analysis generated at t*")
+
+def test_cached_prose_gets_the_second_request_conditions():
+    chain = FakeChain(PROSE)
+    analysis.invoke_analysis(chain, weather())
+    other = weather(location="Nashik, India", coordinates="**Latitude:** 18.60", temp=27.3, feels_like=28.2,
+                    humidity=62, timestamp="2026-10-18 10:00:00")
+    report = analysis.invoke_analysis(chain, other)
+    assert chain.calls == 1
+    assert "Pune" not in report
+    assert "A warm day in Nashik, India" in report
+    assert "**Temperature:** 27.3°C (Feels like: 28.2°C)" in report
+    assert "**Humidity:** 62%" in report
+    assert "*Analysis generated at 2026-10-18 10:00:00*" in report
+
+def test_feels_like_is_part_of_the_key():
+    assert analysis.analysis_key(weather()) != analysis.analysis_key(weather(feels_like=35.0))
+
+def test_response_naming_the_location_is_not_cached():
+    chain = FakeChain("#### 📊 Detailed Analysis\nRain is unlikely in pune today.")
+    analysis.invoke_analysis(chain, weather())
+    analysis.invoke_analysis(chain, weather())
+    assert chain.calls == 2
+
+def test_stream_matches_invoke():
+    data = weather()
+    streamed = "".join(analysis.stream_analysis(FakeChain(PROSE), data))
+    analysis.analysis_cache.clear()
+    assert streamed == analysis.invoke_analysis(FakeChain(PROSE), weather())
+
+def test_async_uses_the_same_cache():
+    chain = FakeChain(PROSE)
+    first = asyncio.run(analysis.ainvoke_analysis(chain, weather()))
+    assert analysis.invoke_analysis(chain, weather()) == first
+    assert chain.calls == 1
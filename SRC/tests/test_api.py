@@ -0,0 +1,18 @@
+import asyncio
+import pytest
+import api
+
+def run(handler, deadline):
+    return asyncio.run(api.WorkerPool(workers=1, queue=1).run(handler, deadline))
+
+def test_deadline_is_a_504():
+    with pytest.raises(api.HTTPError) as error:
+        run(lambda: asyncio.sleep(1), 0.05)
+    assert error.value.status == 504
+
+def test_timeout_inside_the_handler_is_not_a_504():
+    async def upstream_timeout():
+        await asyncio.wait_for(asyncio.sleep(1), 0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        run(upstream_timeout, 5)
@@ -0,0 +1,30 @@
+import autocomplete, weather
+from autocomplete import PlaceIndex, Suggestion
+
+def test_short_prefix_finds_the_heaviest_places_anywhere_in_the_range():
+    # 1000 small places sort before the big one
+    small = [Suggestion(f"Aa{number:04d}", 0.0, 0.0, number) for number in range(1000)]
+    index = PlaceIndex(small + [Suggestion("Azamgarh", 26.07, 83.18, 10 ** 6)])
+    labels = [suggestion.label for suggestion in index.suggest("a", limit=3)]
+    assert labels == ["Azamgarh", "Aa0999", "Aa0998"]
+    assert [suggestion.label for suggestion in index.suggest("az")] == ["Azamgarh"]
+    assert index.suggest("b") == []
+
+def test_duplicate_labels_are_suggested_once():
+    index = PlaceIndex([Suggestion("Salem", 1.0, 1.0, 5)] * 40 + [Suggestion("Sangli", 2.0, 2.0, 1)])
+    assert [suggestion.label for suggestion in index.suggest("sa", limit=2)] == ["Salem", "Sangli"]
+
+def test_added_places_are_ranked_by_weight():
+    index = PlaceIndex([Suggestion("Nagpur", 21.1, 79.1, 100)])
+    index.add(Suggestion("Nashik", 20.0, 73.8, autocomplete.HISTORY_WEIGHT))
+    assert [suggestion.label for suggestion in index.suggest("na")] == ["Nashik", "Nagpur"]
+
+def test_geocoding_history_keeps_the_typed_label(monkeypatch):
+    monkeypatch.setattr(weather, "_fetch_coordinates", lambda address, token: (18.52, 73.86))
+    monkeypatch.setattr(weather, "_local_match", lambda address: None)
+    weather.geocode_cache.clear()
+    assert weather.get_coordinates("Pune, Maharashtra", "key") == (18.52, 73.86)
+    assert weather.get_coordinates("pune,  maharashtra", "key") == (18.52, 73.86)
+    labels = [suggestion.label for suggestion in autocomplete.build_index().suggest("pu")]
+    weather.geocode_cache.clear()
+    assert labels == ["Pune, Maharashtra"]
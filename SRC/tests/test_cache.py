@@ -0,0 +1,20 @@
+from cache import MISS, DiskCache
+
+def count(cache):
+    return cache._conn.execute(f"SELECT COUNT(*) FROM {cache.table}").fetchone()[0]
+
+def test_disk_cache_prunes_every_n_writes(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=5, prune_every=10, prune_interval=3600)
+    for number in range(9):
+        cache.set(str(number), number, ttl=60)
+    assert count(cache) == 9
+    cache.set("9", 9, ttl=60)
+    assert count(cache) == 5
+    # The oldest rows go first
+    assert cache.get("4")[0] is MISS
+    assert cache.get("9")[0] == 9
+
+def test_disk_cache_prunes_expired_rows_on_open(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    DiskCache(path).set("old", 1, ttl=-1)
+    assert count(DiskCache(path)) == 0
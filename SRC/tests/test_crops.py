@@ -0,0 +1,35 @@
+import numpy as np
+import crops
+
+def conditions(**fields):
+    data = {"temp": 27, "humidity": 60, "wind_speed": 2, "soil_moisture_value": 0.3}
+    data.update(fields)
+    return data
+
+def test_missing_weather_ranks_nothing():
+    result = crops.recommend(conditions(temp="N/A", humidity="N/A", wind_speed="N/A", soil_moisture_value="N/A"))
+    assert result["crops"] == []
+    assert result["crop_inputs"] == ""
+    assert "optimal" not in result["crop_facts"]
+    assert "No ranking" in result["crop_facts"]
+
+def test_missing_humidity_alone_ranks_nothing():
+    assert crops.rank(27.0, np.nan, 2.0, 0.3) == []
+
+def test_missing_soil_is_unknown_not_optimal():
+    result = crops.recommend(conditions(soil_moisture_value="N/A"))
+    assert result["crops"]
+    assert "all factors optimal" not in result["crop_facts"]
+    assert "soil moisture unknown" in result["crop_facts"]
+    assert all(crop["limiting"] is None or "soil" not in crop["limiting"] for crop in result["crops"])
+
+def test_rank_many_marks_missing_locations():
+    best, scores = crops.rank_many(np.array([27.0, np.nan]), np.array([60.0, 60.0]),
+                                   np.array([2.0, 2.0]), np.array([0.3, 0.3]), top=3)
+    assert np.all(scores[0] > 0)
+    assert np.all(np.isnan(scores[1]))
+
+def test_rank_and_rank_many_agree():
+    reading = (27.0, 60.0, 2.0, 0.3)
+    best, _ = crops.rank_many(*(np.array([value]) for value in reading), top=5)
+    assert [crops.CROP_NAMES[index] for index in best[0]] == [crop.crop for crop in crops.rank(*reading, top=5)]
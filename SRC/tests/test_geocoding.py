@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+import weather
+from gazetteer import GazetteerMatch
+
+AMBIGUOUS = GazetteerMatch(17.68, 74.0, "Satara, Maharashtra, India", 120000, True)
+
+@pytest.fixture
+def google(monkeypatch):
+    requests = []
+
+    def no_results(address, token):
+        requests.append(address)
+        raise LookupError(address)
+
+    async def ano_results(address, token):
+        return no_results(address, token)
+
+    monkeypatch.setattr(weather, "_fetch_coordinates", no_results)
+    monkeypatch.setattr(weather, "_afetch_coordinates", ano_results)
+    weather.geocode_cache.clear()
+    yield requests
+    weather.geocode_cache.clear()
+
+def test_zero_results_falls_back_to_the_ambiguous_local_match(google, monkeypatch):
+    monkeypatch.setattr(weather, "_local_match", lambda address: AMBIGUOUS)
+    assert weather.get_coordinates("Satara", "key") == AMBIGUOUS.coordinates
+    # The cached negative answer falls back as well, without asking Google again
+    assert weather.get_coordinates("Satara", "key") == AMBIGUOUS.coordinates
+    assert asyncio.run(weather.aget_coordinates("Satara", "key")) == AMBIGUOUS.coordinates
+    assert google == ["Satara"]
+
+def test_async_zero_results_falls_back_to_the_ambiguous_local_match(google, monkeypatch):
+    monkeypatch.setattr(weather, "_local_match", lambda address: AMBIGUOUS)
+    assert asyncio.run(weather.aget_coordinates("Satara", "key")) == AMBIGUOUS.coordinates
+
+def test_zero_results_without_a_local_match_is_not_found(google, monkeypatch):
+    monkeypatch.setattr(weather, "_local_match", lambda address: None)
+    for _ in range(2):
+        with pytest.raises(weather.LocationNotFound):
+            weather.get_coordinates("Nowhere", "key")
+    with pytest.raises(weather.LocationNotFound):
+        asyncio.run(weather.aget_coordinates("Nowhere", "key"))
+    assert google == ["Nowhere"]
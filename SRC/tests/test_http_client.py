@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+import http_client
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+class FakeAsyncClient(FakeSession):
+    async def get(self, url, params=None, **kwargs):
+        return FakeSession.get(self, url, params)
+
+class FakeLimiter:
+    def __init__(self):
+        self.acquired = 0
+        self.throttled = []
+        self.succeeded = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+    async def aacquire(self):
+        self.acquired += 1
+
+    def throttle(self, delay):
+        self.throttled.append(delay)
+
+    def succeed(self):
+        self.succeeded += 1
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(http_client.time, "sleep", slept.append)
+
+    async def asleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(http_client.asyncio, "sleep", asleep)
+    return slept
+
+def use(monkeypatch, session, limiter=None):
+    monkeypatch.setattr(http_client, "get_session", lambda url: session)
+    monkeypatch.setattr(http_client, "get_async_client", lambda url: session)
+    monkeypatch.setattr(http_client.ratelimit, "get_limiter", lambda provider: limiter)
+
+def test_429_waits_on_the_limiter_without_sleeping(monkeypatch, sleeps):
+    limiter = FakeLimiter()
+    use(monkeypatch, FakeSession(Response(429, {"Retry-After": "2"}), Response(200)), limiter)
+    assert http_client.get("http://upstream/", provider="openweather").status_code == 200
+    assert limiter.acquired == 2
+    assert limiter.throttled == [2.0]
+    assert sleeps == []
+
+def test_5xx_is_retried_up_to_max_retries(monkeypatch, sleeps):
+    limiter = FakeLimiter()
+    session = FakeSession(*[Response(503)] * (http_client.MAX_RETRIES + 1))
+    use(monkeypatch, session, limiter)
+    assert http_client.get("http://upstream/", provider="openweather").status_code == 503
+    assert session.calls == http_client.MAX_RETRIES + 1
+    # Every attempt goes through the limiter
+    assert limiter.acquired == session.calls
+    assert len(sleeps) == http_client.MAX_RETRIES
+
+def test_retry_after_is_honoured_and_capped(monkeypatch, sleeps):
+    monkeypatch.setattr(http_client, "MAX_RETRY_AFTER", 5.0)
+    use(monkeypatch, FakeSession(Response(503, {"Retry-After": "3"}), Response(503, {"Retry-After": "3600"}), Response(200)))
+    assert http_client.get("http://upstream/").status_code == 200
+    assert sleeps == [3.0, 5.0]
+
+def test_async_5xx_is_retried_through_the_limiter(monkeypatch, sleeps):
+    limiter = FakeLimiter()
+    client = FakeAsyncClient(Response(502), Response(503, {"Retry-After": "3600"}), Response(200))
+    use(monkeypatch, client, limiter)
+    monkeypatch.setattr(http_client, "MAX_RETRY_AFTER", 5.0)
+    assert asyncio.run(http_client.aget("http://upstream/", provider="openweather")).status_code == 200
+    assert limiter.acquired == 3
+    assert sleeps[1] == 5.0
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pytest
+from observations import SOIL_LAYERS, ObservationStore
+
+CELL = (18.525, 73.875)
+OTHER = (19.075, 72.875)
+HOUR = 3600
+
+def reading(temp):
+    return {"description": "clear sky", "temp": temp, "feels_like": temp + 1, "humidity": 60, "wind_speed": 2.0}
+
+@pytest.fixture
+def store(tmp_path):
+    # A long interval keeps the background writer out of the way; the tests flush themselves
+    store = ObservationStore(str(tmp_path / "observations.sqlite"), flush_interval=3600)
+    yield store
+    store.close()
+
+def test_readings_are_buffered_until_flushed(store):
+    now = time.time()
+    store.record_weather(CELL, reading(20), observed_at=now)
+    assert store.latest_weather(CELL) is None
+    assert store.flush() == 1
+    observed_at, fields = store.latest_weather(CELL)
+    assert observed_at == now and fields == reading(20)
+    assert store.latest_weather(CELL, max_age=-1) is None
+
+def test_weather_range_by_cell_and_time(store):
+    start = (time.time() // HOUR - 5) * HOUR
+    for hour in range(5):
+        store.record_weather(CELL, reading(20 + hour), observed_at=start + hour * HOUR)
+    store.record_weather(OTHER, reading(30), observed_at=start + HOUR)
+    store.flush()
+    rows = store.weather_range(CELL, start + HOUR, start + 4 * HOUR)
+    assert [fields["temp"] for _, fields in rows] == [21, 22, 23]
+    observed_at, temp, feels_like, humidity, wind = store.weather_array(CELL, start)
+    assert temp.tolist() == [20, 21, 22, 23, 24]
+    assert store.latest_weather(CELL)[1]["temp"] == 24
+    assert set(store.latest_weather_many()) == {CELL, OTHER}
+
+def test_soil_series_round_trip_with_missing_layers(store):
+    start = int(time.time()) // HOUR * HOUR - 2 * HOUR
+    times = np.arange(start, start + 3 * HOUR, HOUR)
+    values = np.full((SOIL_LAYERS, 3), np.nan)
+    values[0] = [0.1, 0.2, 0.3]
+    store.record_soil(CELL, times, values, utc_offset=19800)
+    store.flush()
+    fetched_at, utc_offset, stored_times, stored = store.latest_soil(CELL)
+    assert utc_offset == 19800
+    assert stored_times.tolist() == times.tolist()
+    assert stored[0].tolist() == [0.1, 0.2, 0.3]
+    assert np.isnan(stored[1:]).all()
+
+def test_maintain_compacts_old_hours_and_drops_expired_readings(store):
+    base = (time.time() // HOUR - 24 * 10) * HOUR  # ten days ago, on the hour
+    for minute in (0, 20, 40):
+        store.record_weather(CELL, reading(minute), observed_at=base + minute * 60)
+    store.record_weather(CELL, reading(99), observed_at=base - 100 * 86400)
+    store.record_weather(CELL, reading(50), observed_at=time.time())
+    store.flush()
+    result = store.maintain(retention_days=90, compact_after_days=7)
+    assert result == {"expired": 1, "compacted": 2}
+    rows = store.weather_range(CELL, 0)
+    # The last reading of the old hour survives, recent readings are untouched
+    assert [fields["temp"] for _, fields in rows] == [40, 50]
+    # Compaction is incremental: a second run finds nothing new
+    assert store.maintain(retention_days=90, compact_after_days=7) == {"expired": 0, "compacted": 0}
@@ -0,0 +1,94 @@
+import asyncio, threading, time
+import pytest
+import ratelimit
+from ratelimit import BATCH, INTERACTIVE, RateLimitExceeded, TokenBucket
+
+def paused_bucket(pause=0.2):
+    """A 10/s bucket with no tokens left, paused so that callers queue up"""
+    bucket = TokenBucket("test", per_minute=600, burst_seconds=0.1)
+    bucket.tokens = 0.0
+    bucket.paused_until = time.monotonic() + pause
+    return bucket
+
+def wait_queued(bucket, count):
+    deadline = time.monotonic() + 2
+    while len(bucket._waiters) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+def test_refill_is_capped_at_the_burst():
+    bucket = TokenBucket("test", per_minute=600, burst_seconds=0.5)
+    start = bucket.updated
+    assert [bucket._take(start) for _ in range(6)] == [True] * 5 + [False]
+    # 10 per second: one token after 0.1 s
+    assert bucket._take(start + 0.1)
+    assert not bucket._take(start + 0.1)
+    # A long idle period refills no more than the burst
+    assert [bucket._take(start + 100) for _ in range(6)] == [True] * 5 + [False]
+
+def test_empty_bucket_rejects_after_the_deadline():
+    bucket = paused_bucket(pause=5)
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire(timeout=0.05)
+    assert bucket.rejected == 1
+
+def test_interactive_callers_go_before_batch_callers_fifo_within_a_priority():
+    bucket = paused_bucket()
+    order = []
+
+    def caller(name, priority):
+        bucket.acquire(timeout=5, priority=priority)
+        order.append(name)
+
+    threads = []
+    for count, (name, priority) in enumerate((("batch-1", BATCH), ("batch-2", BATCH), ("interactive", INTERACTIVE)), 1):
+        threads.append(threading.Thread(target=caller, args=(name, priority)))
+        threads[-1].start()
+        wait_queued(bucket, count)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "batch-1", "batch-2"]
+
+def test_throttle_halves_the_rate_once_and_success_recovers_it():
+    bucket = TokenBucket("test", per_minute=600)
+    bucket.throttle(0.5)
+    assert bucket.rate == pytest.approx(5.0)
+    assert bucket.tokens == 0.0
+    assert bucket.paused_until > time.monotonic()
+    # 429s of requests sent before the cut do not cut again
+    bucket.throttle(0)
+    assert bucket.rate == pytest.approx(5.0)
+    bucket.succeed()
+    assert bucket.rate == pytest.approx(5.0 + 10.0 * ratelimit.RECOVERY)
+    for _ in range(100):
+        bucket.succeed()
+    assert bucket.rate == pytest.approx(10.0)
+
+def test_rate_never_drops_below_the_floor():
+    bucket = TokenBucket("test", per_minute=600)
+    for _ in range(20):
+        bucket._last_cut = 0.0
+        bucket.throttle(0)
+    assert bucket.rate == pytest.approx(bucket.min_rate)
+
+def test_priority_is_carried_into_child_tasks_only():
+    bucket = paused_bucket()
+    order = []
+
+    async def batch_job():
+        ratelimit.set_priority(BATCH)
+        # Tasks started from here inherit the batch priority
+        await asyncio.gather(fetch("batch"))
+
+    async def fetch(name):
+        await bucket.aacquire(timeout=5)
+        order.append(name)
+
+    async def main():
+        batch = asyncio.create_task(batch_job())
+        while not bucket._waiters:
+            await asyncio.sleep(0.005)
+        # A sibling task keeps the default interactive priority
+        await asyncio.gather(fetch("interactive"), batch)
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch"]
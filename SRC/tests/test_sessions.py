@@ -0,0 +1,35 @@
+import sessions
+
+def report(number):
+    return f"### 🌤️ Weather Analysis for Place{number}\n**Temperature:** {number}°C\n" + "detail " * 200
+
+def states(history):
+    return ["hot" if exchange.report is not None else "compressed" if exchange.compressed is not None
+            else "spilled" if exchange.spilled else "dropped" for exchange in history._exchanges]
+
+def test_spilled_reports_are_read_back():
+    history = sessions.SessionHistory(hot_turns=2, memory_limit=2000)
+    for number in range(5):
+        history.add(f"q{number}", report(number))
+    assert states(history)[0] == "spilled"
+    assert history.memory <= 2000
+    for number in range(5):
+        assert history.get(number) == (f"q{number}", report(number), None)
+
+def test_cold_reports_stay_in_the_prompt_as_facts():
+    history = sessions.SessionHistory(hot_turns=1, memory_limit=2000)
+    for number in range(3):
+        history.add(f"q{number}", report(number))
+    first = history.messages[1]
+    assert first.content == "Place0; temperature 0°C"
+    assert first.response_metadata["facts"] == first.content
+
+def test_reports_are_dropped_without_a_spill_store(monkeypatch):
+    monkeypatch.setattr(sessions, "_store", None)
+    monkeypatch.setattr(sessions, "_opened", True)
+    history = sessions.SessionHistory(hot_turns=2, memory_limit=2000)
+    for number in range(5):
+        history.add(f"q{number}", report(number))
+    assert states(history)[0] == "dropped"
+    assert history.get(0) == ("q0", None, None)
+    assert history.get(4)[1] == report(4)
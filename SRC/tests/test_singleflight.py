@@ -0,0 +1,82 @@
+import asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from singleflight import SingleFlight
+
+WAITERS = 8
+
+def wait_coalesced(flights, name):
+    deadline = time.monotonic() + 5
+    while flights.coalesced[name] < WAITERS - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+def test_concurrent_threads_share_one_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    with ThreadPoolExecutor(WAITERS) as pool:
+        futures = [pool.submit(flights.do, ("weather", 1), fetch) for _ in range(WAITERS)]
+        wait_coalesced(flights, "weather")
+        release.set()
+        assert [future.result(5) for future in futures] == ["value"] * WAITERS
+    assert len(calls) == 1
+    assert flights.stats() == {"weather": {"executed": 1, "coalesced": WAITERS - 1}}
+
+def test_thread_error_reaches_every_waiter_and_releases_the_key():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise LookupError("no data")
+
+    with ThreadPoolExecutor(WAITERS) as pool:
+        futures = [pool.submit(flights.do, ("soil", 1), fail) for _ in range(WAITERS)]
+        wait_coalesced(flights, "soil")
+        release.set()
+        for future in futures:
+            with pytest.raises(LookupError):
+                future.result(5)
+    # The next call runs again instead of replaying the error
+    assert flights.do(("soil", 1), lambda: "retried") == "retried"
+    assert flights.executed["soil"] == 2
+
+def test_concurrent_tasks_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flights.ado(("weather", 1), fetch) for _ in range(WAITERS)))
+
+    assert asyncio.run(main()) == ["value"] * WAITERS
+    assert len(calls) == 1
+    assert flights.coalesced["weather"] == WAITERS - 1
+
+def test_task_error_reaches_every_waiter_and_releases_the_key():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise LookupError("no data")
+
+    async def retried():
+        return "retried"
+
+    async def main():
+        results = await asyncio.gather(*(flights.ado(("soil", 1), fail) for _ in range(WAITERS)), return_exceptions=True)
+        assert all(isinstance(result, LookupError) for result in results)
+        return await flights.ado(("soil", 1), retried)
+
+    assert asyncio.run(main()) == "retried"
+    assert flights.executed["soil"] == 2
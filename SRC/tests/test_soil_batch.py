@@ -0,0 +1,89 @@
+import asyncio, time
+import numpy as np
+import pytest
+import weather
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+
+    def json(self):
+        return self.data
+
+def location(moisture):
+    hour = int(time.time()) // 3600 * 3600
+    return {"utc_offset_seconds": 0, "hourly": {
+        "time": [hour - 3600, hour],
+        **{f"soil_moisture_{depth}": [moisture, moisture] for depth in weather.SOIL_DEPTHS},
+    }}
+
+# Three cells; Open-Meteo has no data for the second one
+PAYLOAD = [location(0.1), {"utc_offset_seconds": 0, "hourly": {}}, location(0.3)]
+COORDS = [(10.0, 10.0), (20.0, 20.0), (30.0, 30.0)]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    requests = []
+
+    def get(url, params=None, **kwargs):
+        requests.append(params)
+        return Response(PAYLOAD)
+
+    async def aget(url, params=None, **kwargs):
+        return get(url, params)
+
+    monkeypatch.setattr(weather.http_client, "get", get)
+    monkeypatch.setattr(weather.http_client, "aget", aget)
+    weather.soil_cache.clear()
+    yield requests
+    weather.soil_cache.clear()
+
+def check(snapshots):
+    assert [snapshot.moisture for snapshot in snapshots] == [0.1, None, 0.3]
+    assert [(snapshot.latitude, snapshot.longitude) for snapshot in snapshots] == [weather.grid_cell(*c) for c in COORDS]
+    assert snapshots[1].depths == () and not len(snapshots[1].times)
+
+def test_many_splits_one_response_per_cell(upstream):
+    check(weather.get_soil_moisture_many(COORDS))
+    assert len(upstream) == 1
+    assert upstream[0]["latitude"].count(",") == 2
+
+def test_concurrent_lookups_share_one_batched_request(upstream, monkeypatch):
+    monkeypatch.setattr(weather, "SOIL_BATCH_WINDOW", 0.01)
+
+    async def main():
+        return await asyncio.gather(*(weather.aget_soil_moisture(*coords) for coords in COORDS))
+
+    check(asyncio.run(main()))
+    assert len(upstream) == 1
+
+def test_short_response_leaves_the_remaining_cells_without_data(upstream):
+    cells = [weather.grid_cell(*coords) for coords in COORDS]
+    results = weather._parse_soil_moisture_many(cells, PAYLOAD[:1])
+    assert results[cells[0]].moisture == 0.1
+    # No data: None, which the public lookups turn into SoilSnapshot.empty
+    assert all(results[cell] is None for cell in cells[1:])
+    assert np.isnan(results[cells[0]].values).sum() == 0
+
+def test_cells_without_data_are_cached_as_negative_results(upstream, monkeypatch):
+    monkeypatch.setattr(weather, "SOIL_BATCH_WINDOW", 0)
+    monkeypatch.setattr(weather, "_fetch_soil_moisture", lambda latitude, longitude: upstream.append(1) or
+                        weather._parse_soil_moisture(latitude, longitude, PAYLOAD[1]))
+    for _ in range(3):
+        assert weather.get_soil_moisture(*COORDS[1]).moisture is None
+    assert len(upstream) == 1
+    # The batched lookup remembers the missing cell as well
+    weather.get_soil_moisture_many(COORDS)
+    assert weather.soil_cache.get(weather.grid_cell(*COORDS[1])) is None
+    assert weather.get_soil_moisture_many(COORDS)[1].depths == ()
+    assert len(upstream) == 2
+
+def test_negative_results_expire_after_the_negative_ttl(monkeypatch):
+    cache = weather.ResponseCache(ttl=600, negative_ttl=60)
+    cache.set("cell", None)
+    cache.set("other", "snapshot")
+    now = time.time()
+    monkeypatch.setattr(weather.time, "time", lambda: now + 120)
+    assert cache.get("cell") is weather.MISS
+    assert cache.get("other") == "snapshot"
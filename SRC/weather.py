@@ -72,83 +72,714 @@
 #         print("Error:", str(e))
 
 
-import requests,os
+import asyncio,contextvars,os,re,time,weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, asdict
+import numpy as np
 from dotenv import load_dotenv
+import gazetteer, http_client, metrics, observations
+from cache import MISS, Dated, ResponseCache, TieredCache
+from singleflight import SingleFlight
 load_dotenv()
 
+# Compact records returned by the fetchers. They carry the raw numeric fields;
+# str() renders the human readable text on demand.
+@dataclass(frozen=True)
+class WeatherSnapshot:
+    __slots__ = ("latitude", "longitude", "description", "temp", "feels_like", "humidity", "wind_speed")
+    latitude: float
+    longitude: float
+    description: str
+    temp: float
+    feels_like: float
+    humidity: int
+    wind_speed: float
+
+    def __str__(self):
+        return (f"Weather at coordinates ({self.latitude}, {self.longitude}):\n"
+                f"Description: {self.description.capitalize()}\n"
+                f"Temperature: {self.temp}°C\n"
+                f"Feels like: {self.feels_like}°C\n"
+                f"Humidity: {self.humidity}%\n"
+                f"Wind speed: {self.wind_speed} m/s")
+
+    def to_dict(self):
+        return asdict(self)
+
+# Open-Meteo soil moisture layers, shallowest first
+SOIL_DEPTHS = ("0_to_1cm", "1_to_3cm", "3_to_9cm", "9_to_27cm", "27_to_81cm")
+
+@dataclass(frozen=True, eq=False)
+class SoilSnapshot:
+    __slots__ = ("latitude", "longitude", "times", "depths", "values", "utc_offset")
+    latitude: float
+    longitude: float
+    times: np.ndarray  # hourly timestamps, unix seconds (int64)
+    depths: tuple  # layer names, one row of values per depth
+    values: np.ndarray  # m³/m³, shape (len(depths), len(times)), NaN where missing
+    utc_offset: int  # seconds, used to find the local calendar day
+
+    @classmethod
+    def empty(cls, latitude, longitude):
+        return cls(latitude, longitude, np.empty(0, dtype=np.int64), (), np.empty((0, 0)), 0)
+
+    def _current_index(self, now=None):
+        if not len(self.times):
+            return None
+        now = time.time() if now is None else now
+        return max(0, int(np.searchsorted(self.times, now, side="right")) - 1)
+
+    @property
+    def moisture(self):
+        """Current-hour moisture of the top (0-1cm) layer, None when unavailable"""
+        index = self._current_index()
+        if index is None or not self.depths:
+            return None
+        value = self.values[0, index]
+        return None if np.isnan(value) else round(float(value), 4)
+
+    def summary(self, now=None):
+        """Per-depth current value, today's min/mean/max and 24h trend (m³/m³ per hour)"""
+        index = self._current_index(now)
+        if index is None or not self.depths:
+            return {}
+        now = time.time() if now is None else now
+        values = self.values
+        # Today's local calendar day
+        days = (self.times + self.utc_offset) // 86400
+        today = values[:, days == (int(now) + self.utc_offset) // 86400]
+        # Least-squares slope over the 24 hours up to the current hour
+        window = (self.times <= self.times[index]) & (self.times > self.times[index] - 86400)
+        hours = (self.times[window] - self.times[index]) / 3600.0
+        recent = values[:, window]
+        valid = ~np.isnan(recent)
+        count = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_h = np.where(valid, hours, 0).sum(axis=1) / count
+            mean_v = np.where(valid, recent, 0).sum(axis=1) / count
+            dh = np.where(valid, hours - mean_h[:, None], 0)
+            dv = np.where(valid, recent - mean_v[:, None], 0)
+            trend = (dh * dv).sum(axis=1) / (dh * dh).sum(axis=1)
+            has_today = (~np.isnan(today)).any(axis=1) if today.size else np.zeros(len(self.depths), bool)
+            daily = np.full((3, len(self.depths)), np.nan)
+            if has_today.any():
+                daily[:, has_today] = (np.nanmin(today[has_today], axis=1),
+                                       np.nanmean(today[has_today], axis=1),
+                                       np.nanmax(today[has_today], axis=1))
+
+        def clean(value):
+            return None if np.isnan(value) or np.isinf(value) else round(float(value), 5)
+
+        return {
+            depth: {
+                "current": clean(values[row, index]),
+                "min": clean(daily[0, row]),
+                "mean": clean(daily[1, row]),
+                "max": clean(daily[2, row]),
+                "trend": clean(trend[row]),
+            }
+            for row, depth in enumerate(self.depths)
+        }
+
+    def __str__(self):
+        if self.moisture is None:
+            return "No soil moisture data available for the specified location."
+        return f"Soil Moisture at coordinates ({self.latitude}, {self.longitude}): {self.moisture} m³/m³"
+
+    def profile(self):
+        """Readable multi-depth view of summary()"""
+        lines = [str(self)]
+        for depth, stats in self.summary().items():
+            if stats["current"] is None:
+                continue
+            label = depth.replace("_to_", "-")
+            lines.append(f"  {label}: {stats['current']} m³/m³ (today {stats['min']}-{stats['max']}, "
+                         f"trend {stats['trend']:+.4f}/h)" if stats["trend"] is not None else
+                         f"  {label}: {stats['current']} m³/m³ (today {stats['min']}-{stats['max']})")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"latitude": self.latitude, "longitude": self.longitude,
+                "moisture": self.moisture, "depths": self.summary()}
+
+# Geocoding cache: place names almost never move, so results are kept for a long time
+# in memory and on disk. ZERO_RESULTS answers are cached for a shorter period.
+geocode_cache = TieredCache(
+    maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600))),
+    negative_ttl=float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL", str(24 * 3600))),
+    path=os.getenv("GEOCODE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "geocode.sqlite")) or None,
+    table="geocode",
+    disk_max_entries=int(os.getenv("GEOCODE_CACHE_DISK_SIZE", "100000")),
+)
+
+# Weather and soil responses are cached per grid cell rather than per raw coordinate.
+# TTLs follow the upstream update cadence: OpenWeather refreshes current conditions
+# roughly every 10 minutes, Open-Meteo's hourly soil series once an hour.
+GRID_PRECISION = float(os.getenv("GRID_PRECISION", "0.05"))
+_stale_while_revalidate = os.getenv("STALE_WHILE_REVALIDATE", "true").lower() in ("1", "true", "yes")
+_max_stale = float(os.getenv("STALE_MAX_AGE", str(6 * 3600)))
+
+weather_cache = ResponseCache(
+    ttl=float(os.getenv("WEATHER_CACHE_TTL", "600")),
+    max_stale=_max_stale,
+    stale_while_revalidate=_stale_while_revalidate,
+)
+# Cells without soil data (e.g. over water) are remembered for SOIL_CACHE_NEGATIVE_TTL
+soil_cache = ResponseCache(
+    ttl=float(os.getenv("SOIL_CACHE_TTL", "3600")),
+    negative_ttl=float(os.getenv("SOIL_CACHE_NEGATIVE_TTL", "21600")),
+    max_stale=_max_stale,
+    stale_while_revalidate=_stale_while_revalidate,
+)
+
+# Identical upstream calls in flight at the same time (across sessions and threads of
+# this process) share a single request
+flights = SingleFlight()
+
+metrics.register_cache("geocode", geocode_cache)
+metrics.register_cache("weather", weather_cache)
+metrics.register_cache("soil", soil_cache)
+metrics.register_singleflight(flights)
+
+# Every reading is also appended to the local observation store (observations.py).
+# When the in-memory cache misses, a stored reading younger than the cache TTL, written
+# by this or another process (batch runs, the app after a restart), is served first.
+OBSERVATION_WARM_READS = os.getenv("OBSERVATION_WARM_READS", "true").lower() in ("1", "true", "yes")
+# Days of stored readings summarized for the analysis prompt (0 disables)
+OBSERVATION_PROMPT_DAYS = float(os.getenv("OBSERVATION_PROMPT_DAYS", "7"))
+
+def grid_cell(latitude, longitude, precision=None):
+    """Snap a coordinate to the centre of its grid cell"""
+    precision = precision or GRID_PRECISION
+    lat = min(90.0, max(-90.0, ((latitude // precision) + 0.5) * precision))
+    lon = ((longitude // precision) + 0.5) * precision
+    return round(lat, 6), round(lon, 6)
+
+def normalize_address(address):
+    """Normalize an address so that trivially different spellings share a cache entry"""
+    address = re.sub(r"\s*,\s*", ", ", address.strip().lower())
+    return re.sub(r"\s+", " ", address).strip(" ,")
+
 # Step 1: Get the coordinates of the location using Google Maps Geocoding API
+GEOCODING_URL = os.getenv("GEOCODING_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+
+class LocationNotFound(Exception):
+    """Raised by get_coordinates/aget_coordinates when Google has no result for the address"""
+
+    def __init__(self, address=""):
+        super().__init__("Geocoding error: ZERO_RESULTS - ")
+        self.address = address
+
 def get_coordinates(address, google_maps_token):
-    geocoding_url = "https://maps.googleapis.com/maps/api/geocode/json"
-    
-    params = {
+    # A local gazetteer (see gazetteer.py) answers unambiguous place names without a request
+    match = _local_match(address)
+    if match is not None and not match.ambiguous:
+        return match.coordinates
+    key = normalize_address(address)
+    cached = _cached_coordinates(key)
+    if cached is None:
+        return _not_found(address, match)
+    if cached is not MISS:
+        return cached
+
+    try:
+        coordinates = flights.do(("geocode", key), lambda: _fetch_coordinates(address, google_maps_token))
+    except LookupError:
+        geocode_cache.set(key, None)
+        return _not_found(address, match)
+    except Exception:
+        # Quota exhausted or Google unreachable: an ambiguous local match beats no answer
+        if match is None:
+            raise
+        return match.coordinates
+    # The address as typed is kept for the autocomplete labels
+    geocode_cache.set(key, (*coordinates, address.strip()))
+    return coordinates
+
+async def aget_coordinates(address, google_maps_token):
+    # A local gazetteer (see gazetteer.py) answers unambiguous place names without a request
+    match = _local_match(address)
+    if match is not None and not match.ambiguous:
+        return match.coordinates
+    key = normalize_address(address)
+    cached = _cached_coordinates(key)
+    if cached is None:
+        return _not_found(address, match)
+    if cached is not MISS:
+        return cached
+
+    try:
+        coordinates = await flights.ado(("geocode", key), lambda: _afetch_coordinates(address, google_maps_token))
+    except LookupError:
+        geocode_cache.set(key, None)
+        return _not_found(address, match)
+    except Exception:
+        # Quota exhausted or Google unreachable: an ambiguous local match beats no answer
+        if match is None:
+            raise
+        return match.coordinates
+    # The address as typed is kept for the autocomplete labels
+    geocode_cache.set(key, (*coordinates, address.strip()))
+    return coordinates
+
+def _not_found(address, match):
+    """Google has no result (now or cached): the best ambiguous local candidate, else LocationNotFound"""
+    if match is None:
+        raise LocationNotFound(address)
+    return match.coordinates
+
+def _local_match(address):
+    """Gazetteer lookup; None when there is no index or no match"""
+    index = gazetteer.get_gazetteer()
+    if index is None:
+        return None
+    match = index.resolve(address)
+    metrics.inc("gazetteer_lookups_total", result="miss" if match is None else "ambiguous" if match.ambiguous else "hit")
+    return match
+
+def _fetch_coordinates(address, google_maps_token):
+    response = http_client.get(GEOCODING_URL, params=_geocoding_params(address, google_maps_token), provider="google")
+    return _parse_coordinates(address, response.json())
+
+async def _afetch_coordinates(address, google_maps_token):
+    response = await http_client.aget(GEOCODING_URL, params=_geocoding_params(address, google_maps_token), provider="google")
+    return _parse_coordinates(address, response.json())
+
+def _cached_coordinates(key):
+    """Cached coordinates, None for a cached ZERO_RESULTS, or MISS"""
+    cached = geocode_cache.get(key)
+    return cached if cached is MISS or cached is None else tuple(cached[:2])
+
+def _geocoding_params(address, google_maps_token):
+    return {
         'address': address,
         'key': google_maps_token  # Your Google Maps API key
     }
-    
-    response = requests.get(geocoding_url, params=params)
-    data = response.json()
-    
+
+def _parse_coordinates(address, data):
     if data['status'] == 'OK':
         location = data['results'][0]['geometry']['location']
         latitude = location['lat']
         longitude = location['lng']
         return latitude, longitude
+    elif data['status'] == 'ZERO_RESULTS':
+        raise LookupError(address)
     else:
         raise Exception(f"Geocoding error: {data['status']} - {data.get('error_message', '')}")
 
 # Step 2: Get the weather data using OpenWeatherMap API
+WEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+
 def get_weather(latitude, longitude, openweather_api_key):
-    weather_url = "https://api.openweathermap.org/data/2.5/weather"
-    
-    params = {
+    cell = grid_cell(latitude, longitude)
+    return weather_cache.get_or_fetch(cell, lambda: flights.do(
+        ("weather", cell), lambda: _stored_weather(cell) or _fetch_weather(cell[0], cell[1], openweather_api_key)))
+
+async def aget_weather(latitude, longitude, openweather_api_key):
+    cell = grid_cell(latitude, longitude)
+    return await weather_cache.aget_or_fetch(cell, lambda: flights.ado(
+        ("weather", cell), lambda: _astored_weather(cell, openweather_api_key)))
+
+async def _astored_weather(cell, openweather_api_key):
+    # Store reads are SQLite queries, kept off the event loop
+    return await asyncio.to_thread(_stored_weather, cell) or await _afetch_weather(cell[0], cell[1], openweather_api_key)
+
+def _stored_weather(cell):
+    """Dated WeatherSnapshot from the observation store if still within the cache TTL, else None"""
+    store = observations.get_store() if OBSERVATION_WARM_READS else None
+    if store is None:
+        return None
+    row = store.latest_weather(cell, max_age=weather_cache.ttl)
+    if row is None:
+        return None
+    observed_at, fields = row
+    return Dated(WeatherSnapshot(cell[0], cell[1], **fields), observed_at)
+
+def _fetch_weather(latitude, longitude, openweather_api_key):
+    response = http_client.get(WEATHER_URL, params=_weather_params(latitude, longitude, openweather_api_key), provider="openweather")
+    return _parse_weather(latitude, longitude, response)
+
+async def _afetch_weather(latitude, longitude, openweather_api_key):
+    response = await http_client.aget(WEATHER_URL, params=_weather_params(latitude, longitude, openweather_api_key), provider="openweather")
+    return _parse_weather(latitude, longitude, response)
+
+def _weather_params(latitude, longitude, openweather_api_key):
+    return {
         'lat': latitude,
         'lon': longitude,
         'appid': openweather_api_key,  # Your OpenWeatherMap API key
         'units': 'metric'  # Celsius
     }
-    
-    response = requests.get(weather_url, params=params)
+
+def _parse_weather(latitude, longitude, response):
     data = response.json()
     
     if response.status_code == 200:
-        weather_description = data['weather'][0]['description']
-        temperature = data['main']['temp']
-        feels_like = data['main']['feels_like']
-        humidity = data['main']['humidity']
-        wind_speed = data['wind']['speed']
-        
-        weather_info = (f"Weather at coordinates ({latitude}, {longitude}):\n"
-                        f"Description: {weather_description.capitalize()}\n"
-                        f"Temperature: {temperature}°C\n"
-                        f"Feels like: {feels_like}°C\n"
-                        f"Humidity: {humidity}%\n"
-                        f"Wind speed: {wind_speed} m/s")
-        return weather_info
+        snapshot = WeatherSnapshot(
+            latitude=latitude,
+            longitude=longitude,
+            description=data['weather'][0]['description'],
+            temp=data['main']['temp'],
+            feels_like=data['main']['feels_like'],
+            humidity=data['main']['humidity'],
+            wind_speed=data['wind']['speed'],
+        )
+        store = observations.get_store()
+        if store is not None:
+            store.record_weather((latitude, longitude), snapshot.to_dict())
+        return snapshot
     else:
         raise Exception(f"Weather API error: {data['message']}")
 
 # Step 3: Get the soil moisture data using Open-Meteo API
+SOIL_MOISTURE_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+# Open-Meteo accepts comma separated coordinate lists; chunks keep the URL well under its limits
+SOIL_BATCH_SIZE = int(os.getenv("SOIL_BATCH_SIZE", "100"))
+# Concurrent async lookups arriving within this window share one multi-location request (0 disables)
+SOIL_BATCH_WINDOW = float(os.getenv("SOIL_BATCH_WINDOW", "0.025"))
+
 def get_soil_moisture(latitude, longitude):
-    soil_moisture_url = "https://api.open-meteo.com/v1/forecast"
-    
-    params = {
+    cell = grid_cell(latitude, longitude)
+    try:
+        snapshot = soil_cache.get_or_fetch(cell, lambda: flights.do(
+            ("soil", cell), lambda: _stored_soil_moisture(cell) or _fetch_soil_moisture(cell[0], cell[1])))
+    except LookupError:
+        snapshot = soil_cache.set(cell, None)
+    return _or_empty(cell, snapshot)
+
+async def aget_soil_moisture(latitude, longitude):
+    cell = grid_cell(latitude, longitude)
+    try:
+        snapshot = await soil_cache.aget_or_fetch(cell, lambda: flights.ado(
+            ("soil", cell), lambda: _astored_soil_moisture(cell)))
+    except LookupError:
+        snapshot = soil_cache.set(cell, None)
+    return _or_empty(cell, snapshot)
+
+def _or_empty(cell, snapshot):
+    """None (no soil data for the cell, cached as a negative result) as an empty SoilSnapshot"""
+    return SoilSnapshot.empty(cell[0], cell[1]) if snapshot is None else snapshot
+
+async def _astored_soil_moisture(cell):
+    return await asyncio.to_thread(_stored_soil_moisture, cell) or await _afetch_soil_moisture(cell[0], cell[1])
+
+def _stored_soil_moisture(cell):
+    """Dated SoilSnapshot of the cell's last stored fetch if still within the cache TTL, else None"""
+    store = observations.get_store() if OBSERVATION_WARM_READS else None
+    if store is None:
+        return None
+    row = store.latest_soil(cell, max_age=soil_cache.ttl)
+    if row is None:
+        return None
+    fetched_at, utc_offset, times, values = row
+    present = ~np.isnan(values).all(axis=1)
+    depths = tuple(depth for depth, keep in zip(SOIL_DEPTHS, present) if keep)
+    if not depths:
+        return None
+    return Dated(SoilSnapshot(cell[0], cell[1], times, depths, values[present], utc_offset), fetched_at)
+
+def get_soil_moisture_many(coords):
+    """Soil moisture for many (lat, lon) pairs, in input order.
+
+    Cached cells are answered from the cache; the rest are fetched with one
+    Open-Meteo request per SOIL_BATCH_SIZE distinct cells.
+    """
+    cells = [grid_cell(latitude, longitude) for latitude, longitude in coords]
+    found, missing = _cached_soil_moisture(cells)
+    found.update(_fetch_soil_moisture_many(missing))
+    return [_or_empty(cell, found[cell]) for cell in cells]
+
+def _fetch_soil_moisture_many(cells):
+    found = {}
+    for start in range(0, len(cells), SOIL_BATCH_SIZE):
+        chunk = cells[start:start + SOIL_BATCH_SIZE]
+        response = http_client.get(SOIL_MOISTURE_URL, params=_soil_moisture_many_params(chunk), provider="open_meteo")
+        found.update(_parse_soil_moisture_many(chunk, response.json()))
+    return found
+
+async def aget_soil_moisture_many(coords):
+    """Async counterpart of get_soil_moisture_many; chunks are fetched concurrently"""
+    cells = [grid_cell(latitude, longitude) for latitude, longitude in coords]
+    found, missing = await asyncio.to_thread(_cached_soil_moisture, cells)
+
+    async def fetch_chunk(chunk):
+        response = await http_client.aget(SOIL_MOISTURE_URL, params=_soil_moisture_many_params(chunk), provider="open_meteo")
+        return _parse_soil_moisture_many(chunk, response.json())
+
+    chunks = [missing[start:start + SOIL_BATCH_SIZE] for start in range(0, len(missing), SOIL_BATCH_SIZE)]
+    for result in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+        found.update(result)
+    return [_or_empty(cell, found[cell]) for cell in cells]
+
+def _cached_soil_moisture(cells):
+    """({cell: SoilSnapshot} from the cache or the observation store, [cells still to fetch])"""
+    found = {}
+    missing = []
+    for cell in dict.fromkeys(cells):
+        value = soil_cache.get(cell)
+        if value is MISS:
+            stored = _stored_soil_moisture(cell)
+            if stored is None:
+                missing.append(cell)
+                continue
+            value = soil_cache.set(cell, stored)
+        found[cell] = value
+    return found, missing
+
+def _fetch_soil_moisture(latitude, longitude):
+    response = http_client.get(SOIL_MOISTURE_URL, params=_soil_moisture_params(latitude, longitude), provider="open_meteo")
+    return _parse_soil_moisture(latitude, longitude, response.json())
+
+async def _afetch_soil_moisture(latitude, longitude):
+    if SOIL_BATCH_WINDOW > 0:
+        return await _soil_batcher().fetch((latitude, longitude))
+    response = await http_client.aget(SOIL_MOISTURE_URL, params=_soil_moisture_params(latitude, longitude), provider="open_meteo")
+    return _parse_soil_moisture(latitude, longitude, response.json())
+
+def _soil_moisture_params(latitude, longitude):
+    return {
         'latitude': latitude,
         'longitude': longitude,
-        'hourly': 'soil_moisture_0_1cm',  # Get soil moisture at 0-1cm depth
-        'start': '2024-10-19T00:00',  # Use current date
-        'end': '2024-10-19T23:00',    # Same day for simplicity
+        'hourly': ",".join(f"soil_moisture_{depth}" for depth in SOIL_DEPTHS),  # All soil layers
+        'past_days': 1,  # Yesterday for the 24h trend
+        'forecast_days': 1,  # Today, including the current hour
+        'timeformat': 'unixtime',
         'timezone': 'auto'
     }
-    
-    response = requests.get(soil_moisture_url, params=params)
-    data = response.json()
 
-    if 'hourly' in data and 'soil_moisture_0_1cm' in data['hourly']:
-        # Extract soil moisture data
-        soil_moisture = data['hourly']['soil_moisture_0_1cm'][0]  # Get the first available value
-        return f"Soil Moisture at coordinates ({latitude}, {longitude}): {soil_moisture} m³/m³"
+def _soil_moisture_many_params(cells):
+    return _soil_moisture_params(",".join(str(cell[0]) for cell in cells), ",".join(str(cell[1]) for cell in cells))
+
+def _parse_soil_moisture(latitude, longitude, data):
+    hourly = data.get('hourly', {})
+    depths = tuple(depth for depth in SOIL_DEPTHS if f"soil_moisture_{depth}" in hourly)
+    if 'time' in hourly and depths:
+        # Keep the whole hourly series; nulls become NaN
+        times = np.asarray(hourly['time'], dtype=np.int64)
+        values = np.array([hourly[f"soil_moisture_{depth}"] for depth in depths], dtype=np.float64)
+        snapshot = SoilSnapshot(latitude, longitude, times, depths, values, int(data.get('utc_offset_seconds', 0)))
+        store = observations.get_store()
+        if store is not None:
+            # One row per hour with a column for every layer in SOIL_DEPTHS
+            layers = np.full((len(SOIL_DEPTHS), len(times)), np.nan)
+            layers[[SOIL_DEPTHS.index(depth) for depth in depths]] = values
+            store.record_soil((latitude, longitude), times, layers, snapshot.utc_offset)
+        return snapshot
     else:
-        return "No soil moisture data available for the specified location."
+        raise LookupError((latitude, longitude))
+
+def _parse_soil_moisture_many(cells, data):
+    """Split a multi-location response back into {cell: SoilSnapshot, or None without data} and cache them"""
+    if isinstance(data, dict) and data.get('error'):
+        raise Exception(f"Soil moisture API error: {data.get('reason', '')}")
+    # A single location comes back as an object, several as a list in request order
+    locations = data if isinstance(data, list) else [data]
+    results = {}
+    for cell, location in zip(cells, locations):
+        try:
+            results[cell] = _parse_soil_moisture(cell[0], cell[1], location)
+        except LookupError:
+            results[cell] = None
+        soil_cache.set(cell, results[cell])
+    # Cells missing from a short response are not cached here
+    for cell in cells[len(locations):]:
+        results[cell] = None
+    return results
+
+# Collects single-cell soil lookups made on one event loop and sends them as one
+# multi-location request once SOIL_BATCH_WINDOW elapses or the chunk is full.
+class SoilMoistureBatcher:
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.requests = 0
+        self.cells = 0
+        self._pending = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def fetch(self, cell):
+        future = self._pending.get(cell)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[cell] = future
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        # shield: a caller timing out must not cancel the lookup other callers wait on
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            task = asyncio.get_running_loop().create_task(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending):
+        cells = list(pending)
+        self.requests += 1
+        self.cells += len(cells)
+        try:
+            response = await http_client.aget(SOIL_MOISTURE_URL, params=_soil_moisture_many_params(cells), provider="open_meteo")
+            results = _parse_soil_moisture_many(cells, response.json())
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for cell, future in pending.items():
+            if not future.done():
+                future.set_result(results[cell])
+
+_soil_batchers = weakref.WeakKeyDictionary()
+
+def _soil_batcher():
+    loop = asyncio.get_running_loop()
+    batcher = _soil_batchers.get(loop)
+    if batcher is None:
+        batcher = _soil_batchers[loop] = SoilMoistureBatcher(SOIL_BATCH_WINDOW, SOIL_BATCH_SIZE)
+    return batcher
+
+# Refreshing ahead of demand (prefetch.py): fetch even when a cached value is still
+# fresh, and replace it, so the next visitor finds a full TTL left
+def refresh_weather(latitude, longitude, openweather_api_key):
+    cell = grid_cell(latitude, longitude)
+    return weather_cache.set(cell, flights.do(
+        ("weather", cell), lambda: _fetch_weather(cell[0], cell[1], openweather_api_key)))
+
+def refresh_soil_moisture_many(coords):
+    """Refetch soil moisture for many (lat, lon) pairs, SOIL_BATCH_SIZE cells per request"""
+    return _fetch_soil_moisture_many(list(dict.fromkeys(grid_cell(latitude, longitude) for latitude, longitude in coords)))
+
+# Step 4: Fetch weather and soil moisture concurrently for one coordinate
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+_fetch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("FETCH_WORKERS", "16")), thread_name_prefix="fetch")
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def fetch_conditions(latitude, longitude, openweather_api_key, timeout=None):
+    """Run the weather and soil moisture lookups in parallel.
+
+    Returns the WeatherSnapshot under "weather" and the SoilSnapshot under "soil".
+    Each call gets its own timeout; a failed or slow provider only leaves its own
+    field empty (None) and records the reason under "errors".
+    """
+    timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+    start = time.perf_counter()
+    # Run in a copy of the caller's context so its rate limit priority applies in the workers
+    futures = {
+        "weather": _fetch_pool.submit(contextvars.copy_context().run, _timed, get_weather, latitude, longitude, openweather_api_key),
+        "soil": _fetch_pool.submit(contextvars.copy_context().run, _timed, get_soil_moisture, latitude, longitude),
+    }
+    results, timings, errors = {}, {}, {}
+    for field, future in futures.items():
+        remaining = max(0.0, timeout - (time.perf_counter() - start))
+        try:
+            results[field], timings[field] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            results[field], timings[field] = None, time.perf_counter() - start
+            errors[field] = f"timed out after {timeout:g}s"
+        except Exception as e:
+            results[field], timings[field] = None, time.perf_counter() - start
+            errors[field] = str(e)
+    metrics.record_timings(timings, errors)
+    results["timings"] = timings
+    results["errors"] = errors
+    return results
+
+async def _atimed(coro, timeout):
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(coro, timeout), time.perf_counter() - start, None
+    except asyncio.TimeoutError:
+        return None, time.perf_counter() - start, f"timed out after {timeout:g}s"
+    except Exception as e:
+        return None, time.perf_counter() - start, str(e)
+
+async def afetch_conditions(latitude, longitude, openweather_api_key, timeout=None):
+    """Async counterpart of fetch_conditions, with the same result layout"""
+    timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+    outcomes = await asyncio.gather(
+        _atimed(aget_weather(latitude, longitude, openweather_api_key), timeout),
+        _atimed(aget_soil_moisture(latitude, longitude), timeout),
+    )
+    results, timings, errors = {}, {}, {}
+    for field, (value, elapsed, error) in zip(("weather", "soil"), outcomes):
+        results[field], timings[field] = value, elapsed
+        if error is not None:
+            errors[field] = error
+    metrics.record_timings(timings, errors)
+    results["timings"] = timings
+    results["errors"] = errors
+    return results
+
+async def aprocess_weather_query(location, google_maps_token=None, openweather_api_key=None, timeout=None):
+    """Geocode a location and fetch its conditions without blocking the event loop.
+
+    API keys default to the environment. Geocoding errors are raised; weather and
+    soil failures are reported under "errors" like afetch_conditions.
+    """
+    google_maps_token = google_maps_token or os.getenv("google_maps_token")
+    openweather_api_key = openweather_api_key or os.getenv("openweather_api_key")
+
+    start = time.perf_counter()
+    with metrics.span("geocode") as geocode:
+        latitude, longitude = await aget_coordinates(location, google_maps_token)
+
+    conditions = await afetch_conditions(latitude, longitude, openweather_api_key, timeout)
+    total = time.perf_counter() - start
+    metrics.observe("stage_seconds", total, stage="total")
+    conditions["timings"] = {"geocode": geocode.elapsed, **conditions["timings"], "total": total}
+    return {"location": location, "latitude": latitude, "longitude": longitude, **conditions}
+
+# Step 5: Past readings of a location from the observation store
+def weather_history(latitude, longitude, since, until=None):
+    """Stored (observed_at, WeatherSnapshot) readings of the location's grid cell, oldest first"""
+    store = observations.get_store()
+    if store is None:
+        return []
+    cell = grid_cell(latitude, longitude)
+    return [(observed_at, WeatherSnapshot(cell[0], cell[1], **fields))
+            for observed_at, fields in store.weather_range(cell, since, until)]
+
+def history_summary(latitude, longitude, days=None):
+    """Trends of the last `days` days of stored readings as text, None when there is too little history"""
+    days = OBSERVATION_PROMPT_DAYS if days is None else days
+    store = observations.get_store()
+    if store is None or days <= 0:
+        return None
+    cell = grid_cell(latitude, longitude)
+    now = time.time()
+    since = now - days * 86400
+    lines = []
+
+    observed_at, temp, _, humidity, wind_speed = store.weather_array(cell, since)
+    if len(observed_at) >= 2 and observed_at[-1] - observed_at[0] >= 3600:
+        with np.errstate(invalid="ignore"):
+            lines.append(f"Past {(observed_at[-1] - observed_at[0]) / 86400:.1f} days ({len(observed_at)} readings): "
+                         f"temperature {np.nanmin(temp):.1f}-{np.nanmax(temp):.1f}°C (mean {np.nanmean(temp):.1f}), "
+                         f"humidity {np.nanmin(humidity):.0f}-{np.nanmax(humidity):.0f}%, "
+                         f"wind up to {np.nanmax(wind_speed):.1f} m/s")
+
+    # One fetch already covers the last 24 hours; only a longer stored series adds information
+    times, values = store.soil_range(cell, since, now)
+    valid = ~np.isnan(values[0]) if len(times) else np.zeros(0, bool)
+    if valid.any() and times[valid][-1] - times[valid][0] > 86400:
+        top, hours = values[0][valid], times[valid]
+        lines.append(f"Top-layer soil moisture {top[0]:.3f} -> {top[-1]:.3f} m³/m³ over "
+                     f"{(hours[-1] - hours[0]) / 86400:.1f} days (range {top.min():.3f}-{top.max():.3f})")
+    return "\n".join(lines) or None
 
 # Main function
 if __name__ == "__main__":
@@ -170,7 +801,7 @@ if __name__ == "__main__":
         
         # Step 3: Get the soil moisture data using the coordinates
         soil_moisture_info = get_soil_moisture(latitude, longitude)
-        print(soil_moisture_info)
+        print(soil_moisture_info.profile())
         
     except Exception as e:
         print("Error:", str(e))